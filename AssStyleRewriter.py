@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming restyle of ASS scripts.
+
+Only [Script Info] (ScaledBorderAndShadow) and [V4+ Styles] (predefined styles) are rewritten,
+everything from the next section on ([Events], [Fonts], [Graphics]...) is copied byte-for-byte in
+chunks, so memory stays constant and 40k-line typeset scripts are never parsed. The replaced
+"Style:" lines are the ones pysubs2 would write for the same styles.
+"""
+
+import os
+import shutil
+import tempfile
+
+CHUNK_SIZE = 1024 * 1024
+
+# Format line of [V4+ Styles] that pysubs2 reads and writes, other layouts use the pysubs2 path
+STANDARD_STYLE_FORMAT = [
+    "Name", "Fontname", "Fontsize", "PrimaryColour", "SecondaryColour", "OutlineColour", "BackColour",
+    "Bold", "Italic", "Underline", "StrikeOut", "ScaleX", "ScaleY", "Spacing", "Angle", "BorderStyle",
+    "Outline", "Shadow", "Alignment", "MarginL", "MarginR", "MarginV", "Encoding",
+]
+
+
+class UnsupportedScriptError(Exception):
+    """The script layout is not handled by the streaming rewriter, use the pysubs2 path instead."""
+
+
+def format_style_lines(styles):
+    """Returns the "Style:" line pysubs2 writes for each style of the alias -> style mapping."""
+    import pysubs2  # Only loaded by the restyle stage
+    subs = pysubs2.SSAFile()
+    for name, style in styles.items():
+        subs.styles[name] = style
+    lines = {}
+    for line in subs.to_string("ass").splitlines():
+        if line.startswith("Style: "):
+            lines[line[len("Style: "):].split(",", 1)[0]] = line
+    return lines
+
+
+def _line_ending(raw_line):
+    if raw_line.endswith(b"\r\n"):
+        return b"\r\n"
+    if raw_line.endswith(b"\n"):
+        return b"\n"
+    return b""
+
+
+def _decode(raw_line):
+    try:
+        return raw_line.decode("utf-8-sig").rstrip("\r\n")
+    except UnicodeDecodeError:
+        raise UnsupportedScriptError("Header is not valid UTF-8")
+
+
+def _section_name(text):
+    stripped = text.strip()
+    if stripped.startswith("[") and stripped.endswith("]"):
+        return stripped.lower()
+    return None
+
+
+def _rewrite_script_info(raw_lines, scaled_border_and_shadow=True):
+    """Sets ScaledBorderAndShadow to yes (if asked) and returns (lines, (PlayResX, PlayResY))."""
+    play_res = {"PlayResX": 1920, "PlayResY": 1080}
+    output = []
+    replaced = False
+    last_content = 0
+    for raw_line in raw_lines:
+        text = _decode(raw_line)
+        key = text.split(":", 1)[0].strip() if ":" in text and not text.startswith(";") else None
+        if key in play_res:
+            try:
+                play_res[key] = int(text.split(":", 1)[1].strip())
+            except ValueError:
+                raise UnsupportedScriptError(f"Invalid {key} value")
+        if key == "ScaledBorderAndShadow" and scaled_border_and_shadow:
+            raw_line = b"ScaledBorderAndShadow: yes" + _line_ending(raw_line)
+            replaced = True
+        output.append(raw_line)
+        if text.strip():
+            last_content = len(output)
+    if scaled_border_and_shadow and not replaced:
+        ending = _line_ending(raw_lines[0]) or b"\n"
+        output.insert(last_content, b"ScaledBorderAndShadow: yes" + ending)
+    return output, (play_res["PlayResX"], play_res["PlayResY"])
+
+
+def _rewrite_styles(raw_lines, style_lines):
+    """Replaces the predefined styles, returns (lines, [(style name, applied)])."""
+    output = []
+    results = []
+    for raw_line in raw_lines:
+        text = _decode(raw_line)
+        if text.startswith("Format:"):
+            columns = [column.strip() for column in text.split(":", 1)[1].split(",")]
+            if columns != STANDARD_STYLE_FORMAT:
+                raise UnsupportedScriptError("Non standard style format")
+        elif text.startswith("Style:"):
+            name = text.split(":", 1)[1].strip().split(",", 1)[0]
+            if name in style_lines:
+                raw_line = style_lines[name].encode("utf-8") + _line_ending(raw_line)
+                results.append((name, True))
+            else:
+                results.append((name, False))
+        output.append(raw_line)
+    return output, results
+
+
+def restyle_file_streaming(subtitle_file, get_style_lines, scaled_border_and_shadow=True):
+    """
+    Rewrites the styles of an ASS file without parsing its events.
+
+    Args:
+        subtitle_file (str): The ASS file, replaced atomically.
+        get_style_lines (callable): get_style_lines(play_res_x, play_res_y) -> {style name: "Style:" line}.
+        scaled_border_and_shadow (bool): Set ScaledBorderAndShadow to yes in [Script Info].
+
+    Returns:
+        dict: {"play_res": (x, y), "styles": [(style name, applied)]}
+
+    Raises:
+        UnsupportedScriptError: When the layout is unusual (SSA v4, custom Format, sections out of order...).
+    """
+    directory = os.path.dirname(os.path.abspath(subtitle_file))
+    result = {"play_res": (1920, 1080), "styles": []}
+    fd, temp_path = tempfile.mkstemp(suffix=".ass.tmp", dir=directory)
+    try:
+        with open(subtitle_file, "rb") as src, os.fdopen(fd, "wb") as dst:
+            section = None
+            section_lines = []
+            done = set()
+
+            def flush_section():
+                if section == "[script info]":
+                    lines, result["play_res"] = _rewrite_script_info(section_lines, scaled_border_and_shadow)
+                    done.add(section)
+                elif section == "[v4+ styles]":
+                    if "[script info]" not in done:
+                        raise UnsupportedScriptError("[V4+ Styles] before [Script Info]")
+                    lines, result["styles"] = _rewrite_styles(section_lines, get_style_lines(*result["play_res"]))
+                    done.add(section)
+                else:
+                    return
+                dst.writelines(lines)
+
+            for raw_line in src:
+                name = _section_name(_decode(raw_line)) if raw_line.lstrip()[:1] in (b"[", b"\xef") else None
+                if name is None:
+                    if section in ("[script info]", "[v4+ styles]"):
+                        section_lines.append(raw_line)
+                    else:
+                        dst.write(raw_line)
+                    continue
+                flush_section()
+                if name == "[v4 styles]":
+                    raise UnsupportedScriptError("SSA v4 styles")
+                section, section_lines = name, []
+                if name in ("[script info]", "[v4+ styles]"):
+                    section_lines.append(raw_line)
+                    continue
+                dst.write(raw_line)
+                if done >= {"[script info]", "[v4+ styles]"}:
+                    # Events, fonts and graphics: byte-for-byte copy of the rest of the file
+                    shutil.copyfileobj(src, dst, CHUNK_SIZE)
+                    break
+            else:
+                flush_section()
+
+            if not done >= {"[script info]", "[v4+ styles]"}:
+                raise UnsupportedScriptError("Missing [Script Info] or [V4+ Styles]")
+        shutil.copymode(subtitle_file, temp_path)
+        os.replace(temp_path, subtitle_file)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return result
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio engine for the track-renaming tools.
+
+Probing (`mkvmerge -J`, through the probe cache) and editing (`mkvpropedit`) are tiny header
+operations dominated by process startup and seek latency, so thousands of files are driven
+concurrently with asyncio.create_subprocess_exec under a concurrency cap. Results come back in
+the order of the input files and an error on one file does not stop the batch. Both are done
+natively (MkvEbml, MkvHeaderEdit) when the file allows it, the processes only run for the others.
+"""
+
+import json
+import asyncio
+import subprocess
+import MkvProbe
+from MkvHeaderEdit import edit_track_headers
+
+DEFAULT_CONCURRENCY = 16
+
+
+async def run_command(command):
+    """Runs a command without blocking the event loop, returns (returncode, stdout, stderr)."""
+    process = await asyncio.create_subprocess_exec(
+        *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await process.communicate()
+    return process.returncode, stdout.decode('utf-8', errors='replace'), stderr.decode('utf-8', errors='replace')
+
+
+def _probe_without_process(mkv_file):
+    """(key, info) from the cache or the native header read, info is None when mkvmerge has to run."""
+    key = MkvProbe.file_key(mkv_file)
+    info = MkvProbe.get_cached_info(key)
+    if info is None:
+        info = MkvProbe.read_native_info(key[0])
+        if info is not None:
+            MkvProbe.store_info(key, info)
+    return key, info
+
+
+async def probe_async(mkv_file):
+    """Same as MkvProbe.get_mkv_info, with the mkvmerge -J process awaited instead of blocking."""
+    # Cache query and header read touch the disk (seeks on a cold HDD), one thread hop for both
+    key, info = await asyncio.to_thread(_probe_without_process, mkv_file)
+    if info is None:
+        command = [MkvProbe.MKVMERGE_PATH, '-J', key[0]]
+        returncode, stdout, stderr = await run_command(command)
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, command, stdout, stderr)
+        info = json.loads(stdout)
+        await asyncio.to_thread(MkvProbe.store_info, key, info)
+    return info
+
+
+async def _process_file(mkv_file, plan, mkvpropedit_path, semaphore):
+    result = {"file": mkv_file, "updates": [], "logs": [], "edited": False, "error": None}
+    async with semaphore:
+        try:
+            info = await probe_async(mkv_file)
+            commands, result["updates"], result["logs"] = plan(info)
+            # In-place edit in a thread (pwrite + fsync), mkvpropedit when the change does not fit
+            if commands and not await asyncio.to_thread(edit_track_headers, mkv_file, commands):
+                command = [mkvpropedit_path, mkv_file] + commands
+                returncode, stdout, stderr = await run_command(command)
+                if returncode != 0:
+                    raise subprocess.CalledProcessError(returncode, command, stdout, stderr)
+            result["edited"] = bool(commands)
+        except Exception as e:
+            result["error"] = e
+    return result
+
+
+def run_batch(mkv_files, plan, mkvpropedit_path, concurrency=None):
+    """
+    Probes and edits every file concurrently.
+
+    Args:
+        mkv_files (list): Paths of the MKV files.
+        plan (callable): plan(info) -> (mkvpropedit arguments, updates, log lines), no edit when the arguments are empty.
+        mkvpropedit_path (str): Path of mkvpropedit.
+        concurrency (int): Maximum number of files handled at the same time (DEFAULT_CONCURRENCY if None).
+
+    Returns:
+        list: One dict per file, in the order of `mkv_files`: {"file", "updates", "logs", "edited", "error"}.
+    """
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency or DEFAULT_CONCURRENCY)
+        return await asyncio.gather(
+            *(_process_file(mkv_file, plan, mkvpropedit_path, semaphore) for mkv_file in mkv_files)
+        )
+    return asyncio.run(main())
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+End-to-end benchmark of the batch tools with the MKVToolNix stand-ins of FakeMkvToolNix.
+
+A batch of fake MKVs is generated, the fake tools are installed in a temporary directory given
+through MKVTOOLNIX_DIR, and every (tool, batch size, workers) configuration runs in a fresh
+process with an empty probe cache. Throughput is reported in files/s and in MB/s of simulated
+MKV data. Every fake tool call starts a Python interpreter, so with few cores the small
+batches of the rename tools measure that startup more than the scheduling.
+
+    python BenchPipeline.py --files 10 100 1000 --workers 1 2 4 auto
+    python BenchPipeline.py --tool rename-subs --files 5000 --workers 1 8 --latency 0.05
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+import concurrent.futures
+
+import FakeMkvToolNix
+
+TOOLS = ("mux", "rename-audio", "rename-subs")
+MB = 1024 * 1024
+
+
+def _run_batch(tool, directory, workers, env, mux_options):
+    """Runs in a fresh process: wall time of one batch, the output of the tools is discarded."""
+    os.environ.update(env)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    os.dup2(devnull, 2)
+
+    started = time.perf_counter()
+    if tool == "mux":
+        import MuxingNoPlayRes
+        MuxingNoPlayRes.process_all_mkv_files_in_directory(directory, mux_workers=workers, incremental=False,
+                                                           report=False, log_to_file=False, verbosity="quiet",
+                                                           **mux_options)
+    elif tool == "rename-audio":
+        import ChangeAudioTracksDynamic
+        if workers == 1:
+            ChangeAudioTracksDynamic.process_all_mkv_files_in_directory(directory)
+        else:
+            ChangeAudioTracksDynamic.process_all_mkv_files_in_directory(directory, use_asyncio=True,
+                                                                         concurrency=None if workers == "auto" else workers)
+    else:
+        import ChangeSubTracksDynamic
+        if workers == 1:
+            ChangeSubTracksDynamic.process_all_mkv_files_in_directory(directory)
+        else:
+            ChangeSubTracksDynamic.process_all_mkv_files_in_directory(directory, parallel=True,
+                                                                       max_workers=None if workers == "auto" else workers)
+    return time.perf_counter() - started
+
+
+def create_batch(directory, files, size):
+    os.makedirs(directory, exist_ok=True)
+    for n in range(files):
+        info = FakeMkvToolNix.fake_info(subtitle_tracks=1 + n % 3)
+        FakeMkvToolNix.create_fake_mkv(os.path.join(directory, f"Episode {n + 1:04d}.mkv"), size, info)
+
+
+def run_benchmarks(tools, batch_sizes, worker_counts, size, settings, mux_options=None, root=None):
+    """
+    Prints and returns [(tool, files, workers, seconds, files/s, MB/s)].
+
+    The batches are created under `root`: a spinning disk gets a single read and write slot
+    in DeviceLimits, whatever the limits given.
+    """
+    results = []
+    work_dir = tempfile.mkdtemp(prefix="bench-pipeline-", dir=root)
+    mp_context = multiprocessing.get_context("spawn")
+    try:
+        bin_dir = FakeMkvToolNix.install(os.path.join(work_dir, "bin"))
+        for files in batch_sizes:
+            directory = os.path.join(work_dir, f"batch-{files}")
+            create_batch(directory, files, size)
+            for tool in tools:
+                for workers in worker_counts:
+                    shutil.rmtree(os.path.join(directory, "Output"), ignore_errors=True)
+                    env = dict(settings, MKVTOOLNIX_DIR=bin_dir,
+                               MKV_PROBE_CACHE=os.path.join(work_dir, f"probe-{tool}-{files}-{workers}.sqlite"))
+                    with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=mp_context) as pool:
+                        seconds = pool.submit(_run_batch, tool, directory, workers, env, mux_options or {}).result()
+                    files_per_second = files / seconds
+                    mb_per_second = files * size / MB / seconds
+                    results.append((tool, files, workers, seconds, files_per_second, mb_per_second))
+                    print(f"{tool:13} {files:6d} files  workers={str(workers):5} {seconds:9.2f} s "
+                          f"{files_per_second:9.1f} files/s {mb_per_second:10.1f} MB/s")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def _workers(value):
+    return value if value == "auto" else int(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark of the batch tools with fake MKVToolNix executables.")
+    parser.add_argument("--tool", nargs="+", choices=TOOLS, default=list(TOOLS))
+    parser.add_argument("--files", type=int, nargs="+", default=[10, 100], help="Batch sizes (10 to 5000)")
+    parser.add_argument("--workers", type=_workers, nargs="+", default=[1, 2, 4, "auto"],
+                        help="Mux workers, asyncio concurrency or threads depending on the tool (1 = sequential)")
+    parser.add_argument("--file-size-mb", type=float, default=200, help="Simulated size of each MKV")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds per tool call")
+    parser.add_argument("--read-mbps", type=float, default=500)
+    parser.add_argument("--write-mbps", type=float, default=300)
+    parser.add_argument("--read-limit", type=int, help="mux: concurrent readers per device")
+    parser.add_argument("--write-limit", type=int, help="mux: concurrent writers per device")
+    parser.add_argument("--work-dir", help="Where the fake batches are created (default: the temp directory)")
+    args = parser.parse_args(argv)
+
+    settings = {"FAKE_MKV_LATENCY": str(args.latency), "FAKE_MKV_READ_MBPS": str(args.read_mbps),
+                "FAKE_MKV_WRITE_MBPS": str(args.write_mbps)}
+    mux_options = {"read_limit": args.read_limit, "write_limit": args.write_limit}
+    run_benchmarks(args.tool, args.files, args.workers, int(args.file_size_mb * MB), settings, mux_options,
+                   args.work_dir)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Offline benchmark of the subtitle path: style tables, ASS restyle (streaming and pysubs2) and forced-sub filter.
+
+Synthetic scripts are generated (events with heavy override tags, the aliases of the style
+table plus extra styles, several PlayRes), every case runs in a fresh process so its peak RSS
+is its own, and the best time of the repetitions is kept. Only pysubs2 is needed.
+
+    python BenchSubtitles.py --save-baseline bench_baseline.json
+    python BenchSubtitles.py --baseline bench_baseline.json          (exit code 1 on regression)
+    python BenchSubtitles.py --sizes 1000 200000 --repeat 5
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import multiprocessing
+import concurrent.futures
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+DEFAULT_SIZES = (1000, 20000, 200000)
+DEFAULT_PLAY_RES = ((1920, 1080), (1280, 720), (640, 360))
+EXTRA_STYLES = 30
+
+# A regression is flagged above this ratio, and only when the difference is above the noise floor
+REGRESSION_RATIO = 1.20
+NOISE_FLOOR_SECONDS = 0.005
+
+CASES = ("dynamic_styles_cold", "dynamic_styles_warm", "pysubs2_load", "pysubs2_save",
+         "restyle_pysubs2", "restyle_streaming", "forced_filter")
+
+STYLE_FORMAT = ("Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, "
+                "Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, "
+                "Alignment, MarginL, MarginR, MarginV, Encoding")
+EVENT_FORMAT = "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text"
+OVERRIDE_TAGS = (
+    r"{\pos(%d,%d)\fad(150,200)}",
+    r"{\an8\blur3\bord4\c&H%06X&}",
+    r"{\move(%d,%d,960,540)\t(0,500,\frz30)}",
+    r"{\fnArial\fs%d\i1}",
+    r"{\clip(0,0,%d,%d)\3c&H000000&\alpha&H40&}",
+)
+WORDS = ("le", "la", "tu", "sais", "pourquoi", "encore", "ce", "monde", "jamais", "nous", "vraiment", "ici")
+
+
+def _timestamp(centiseconds):
+    hours, rest = divmod(centiseconds, 360000)
+    minutes, rest = divmod(rest, 6000)
+    seconds, centis = divmod(rest, 100)
+    return f"{hours}:{minutes:02d}:{seconds:02d}.{centis:02d}"
+
+
+def generate_script(path, events, play_res, style_names, seed=0):
+    """Writes a synthetic ASS script with `events` Dialogue lines."""
+    rng = random.Random(seed)
+    width, height = play_res
+    with open(path, "w", encoding="utf-8", newline="\n") as f:
+        f.write("[Script Info]\nScriptType: v4.00+\nWrapStyle: 0\n")
+        f.write(f"PlayResX: {width}\nPlayResY: {height}\nScaledBorderAndShadow: no\n\n")
+        f.write("[V4+ Styles]\n" + STYLE_FORMAT + "\n")
+        for name in style_names:
+            f.write(f"Style: {name},Arial,{rng.randint(40, 80)},&H00FFFFFF,&H000000FF,&H00000000,&H00000000,"
+                    f"0,0,0,0,100,100,0,0,1,2,1,2,10,10,{rng.randint(10, 80)},1\n")
+        f.write("\n[Events]\n" + EVENT_FORMAT + "\n")
+        start = 0
+        for _ in range(events):
+            start += rng.randint(0, 300)
+            style = rng.choice(style_names)
+            parts = []
+            for _ in range(rng.randint(1, 4)):
+                tag = rng.choice(OVERRIDE_TAGS)
+                parts.append(tag % tuple(rng.randint(0, 0xFFFFFF if "c&H" in tag else width) for _ in range(tag.count("%"))))
+                parts.append(" ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 8))))
+            f.write(f"Dialogue: 0,{_timestamp(start)},{_timestamp(start + rng.randint(80, 600))},{style},,0,0,0,,"
+                    + "".join(parts) + "\n")
+
+
+def peak_rss_mb():
+    """Peak resident memory of the process in MB (None on Windows)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kB on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _run_case(case, source, repeat):
+    """Runs in a fresh process: best time of `repeat` runs of the case and the peak RSS."""
+    import pysubs2
+    import MuxingNoPlayRes
+    from MakeForcedSub import process_ass_file
+
+    best = None
+    work_dir = tempfile.mkdtemp(prefix="bench-")
+    try:
+        for _ in range(repeat):
+            work_file = os.path.join(work_dir, "work.ass")
+            shutil.copyfile(source, work_file)
+            subs = pysubs2.load(work_file) if case == "pysubs2_save" else None
+            if case == "dynamic_styles_cold":
+                for cache in (MuxingNoPlayRes._cached_style_table, MuxingNoPlayRes._cached_style_properties,
+                              MuxingNoPlayRes.get_style_lines):
+                    cache.cache_clear()
+            elif case == "dynamic_styles_warm":
+                for width, height in DEFAULT_PLAY_RES:
+                    MuxingNoPlayRes.create_dynamic_styles(f"{width}x{height}")
+
+            started = time.perf_counter()
+            if case in ("dynamic_styles_cold", "dynamic_styles_warm"):
+                for width, height in DEFAULT_PLAY_RES:
+                    MuxingNoPlayRes.create_dynamic_styles(f"{width}x{height}")
+            elif case == "pysubs2_load":
+                pysubs2.load(work_file)
+            elif case == "pysubs2_save":
+                subs.save(work_file)
+            elif case == "restyle_pysubs2":
+                MuxingNoPlayRes.change_style_in_file(work_file, None, streaming=False)
+            elif case == "restyle_streaming":
+                MuxingNoPlayRes.change_style_in_file(work_file, None, streaming=True)
+            elif case == "forced_filter":
+                process_ass_file(work_file)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return best, peak_rss_mb()
+
+
+def run_benchmarks(sizes, repeat, cases=CASES):
+    """Returns {"case/events/PlayRes": {"seconds", "peak_rss_mb", "size_mb"}}."""
+    import MuxingNoPlayRes
+    style_names = list(MuxingNoPlayRes.STYLE_ALIASES) + [f"Sign {n}" for n in range(EXTRA_STYLES)]
+    results = {}
+    data_dir = tempfile.mkdtemp(prefix="bench-data-")
+    mp_context = multiprocessing.get_context("spawn")
+    try:
+        for index, events in enumerate(sizes):
+            play_res = DEFAULT_PLAY_RES[index % len(DEFAULT_PLAY_RES)]
+            source = os.path.join(data_dir, f"{events}.ass")
+            generate_script(source, events, play_res, style_names, seed=events)
+            size_mb = os.path.getsize(source) / (1024 * 1024)
+            for case in cases:
+                # The style tables do not depend on the script, measured once
+                if case.startswith("dynamic_styles") and index > 0:
+                    continue
+                key = f"{case}/{events}ev/{play_res[0]}x{play_res[1]}"
+                with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=mp_context) as pool:
+                    seconds, rss = pool.submit(_run_case, case, source, repeat).result()
+                results[key] = {"seconds": round(seconds, 6), "peak_rss_mb": rss and round(rss, 1), "size_mb": round(size_mb, 2)}
+                rss_text = f"{rss:8.1f} MB" if rss is not None else "       n/a"
+                print(f"{key:45} {seconds * 1000:10.1f} ms {rss_text}")
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline):
+    """Prints the ratio of every case to the baseline, returns the regressed keys."""
+    regressions = []
+    for key, result in results.items():
+        reference = baseline.get(key)
+        if reference is None:
+            continue
+        ratio = result["seconds"] / reference["seconds"] if reference["seconds"] else 1.0
+        regressed = ratio > REGRESSION_RATIO and result["seconds"] - reference["seconds"] > NOISE_FLOOR_SECONDS
+        if regressed:
+            regressions.append(key)
+        print(f"{key:45} x{ratio:5.2f}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark of the ASS restyle and forced-sub filter.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="Numbers of events")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per case, the best is kept")
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=list(CASES))
+    parser.add_argument("--baseline", help="Baseline JSON to compare with")
+    parser.add_argument("--save-baseline", help="Write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    import pysubs2
+    print(f"Python {platform.python_version()}, pysubs2 {pysubs2.VERSION}, {platform.platform()}")
+    results = run_benchmarks(args.sizes, args.repeat, args.cases)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump({"python": platform.python_version(), "pysubs2": pysubs2.VERSION, "platform": platform.platform(),
+                       "results": results}, f, indent=2)
+        print(f"Baseline saved: {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f)["results"])
+        if regressions:
+            print(f"{len(regressions)} regression(s) against {args.baseline}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,86 +5,148 @@ Program to change audio track names based on language flags and codec informatio
 
 import os
 import subprocess
-import json
-from tkinter import Tk, filedialog
+from MkvProbe import get_mkv_info, print_probe_stats
+from MkvToolNix import tool_path
+from MkvHeaderEdit import edit_track_headers
 
-def change_audio_track_names_by_language(mkv_file):
-    mkvmerge_path = r"C:\Program Files\MKVToolNix\mkvmerge.exe"
-    mkvpropedit_path = mkvmerge_path.replace('mkvmerge.exe', 'mkvpropedit.exe')
+# Determine new track name based on language, codec, and channels
+LANGUAGE_MAP = {
+    'JPN': 'JP',
+    'FRE': 'FR',
+    'ENG': 'EN',
+    'CHI': 'CN'
+}
+CODEC_MAP = {
+    'A_AAC': 'AAC',
+    'A_FLAC': 'FLAC',
+    'A_AC3': 'AC3',
+    'A_EAC3': 'EAC3',
+    'A_DTS': 'DTS',
+    'A_TRUEHD': 'TrueHD',
+    'A_MPEG/L3': 'MP3',        # Common MP3 codec
+    'A_VORBIS': 'Vorbis',      # Vorbis codec
+    'A_OPUS': 'Opus',          # Opus codec
+    'A_PCM/INT/LIT': 'PCM',    # PCM codec
+    'A_PCM/FLOAT/IEEE': 'PCM', # Floating-point PCM codec
+    'A_MS/ACM': 'MS Audio',    # Microsoft Audio codec, commonly WMA
+    'A_MLP': 'MLP',            # Meridian Lossless Packing
+    'A_ALAC': 'ALAC'           # Apple Lossless Audio Codec
+}
+# Map channel counts to typical layouts
+CHANNEL_LAYOUTS = {
+    1: "1.0",
+    2: "2.0",
+    6: "5.1",
+    8: "7.1"
+}
 
-    # Get the current track information
-    result = subprocess.run([mkvmerge_path, '-J', mkv_file], capture_output=True, text=True, check=True, encoding='utf-8')
-    info = json.loads(result.stdout)
+def get_audio_track_name(track):
+    """
+    Computes the name of an audio track from the probe data.
 
-    # Prepare commands to change track names
+    Returns:
+        tuple: (new language or None when unchanged, new track name)
+    """
+    language = track['properties'].get('language', '').upper()
+    codec = track['codec']
+    channels = track['properties'].get('audio_channels', '')
+    new_language = None
+
+    # If language is 'UND', set it to 'JPN'
+    if language == 'UND':
+        new_language = 'jpn'
+        language = 'JPN'  # Update language variable for naming purposes
+
+    lang_short = LANGUAGE_MAP.get(language, language)  # Use mapped abbreviation or original if missing
+    codec_short = CODEC_MAP.get(codec, codec)  # Use mapped codec or original if missing
+    # Determine channel layout
+    channel_layout = CHANNEL_LAYOUTS.get(channels, f"{channels}.1" if channels and int(channels) > 2 else f"{channels}.0")
+
+    # Format the new track name
+    return new_language, f"{lang_short} {codec_short} {channel_layout}"
+
+def plan_audio_track_updates(info):
+    """
+    Computes the mkvpropedit arguments renaming the audio tracks of a probed MKV file.
+
+    Returns:
+        tuple: (mkvpropedit arguments, [(current name, new name)], log lines)
+    """
     commands = []
     track_updates = []
+    logs = []
 
     for track in info['tracks']:
         if track['type'] == 'audio':
             track_id = track['id']
-            language = track['properties'].get('language', '').upper()
-            codec = track['codec']
-            channels = track['properties'].get('audio_channels', '')
             current_name = track['properties'].get('track_name', '')
 
-            # Debug: Print track information
-            print(f"Track ID: {track_id}, Language: {language}, Codec: {codec}, Channels: {channels}, Current Name: {current_name}")
-
-                        # If language is 'UND', set it to 'FRE'
-            if language == 'UND':
-                commands.extend(['--edit', f'track:a{track_id}', '--set', 'language=jpn'])
-                language = 'JPN'  # Update language variable for naming purposes
-                
-            # Determine new track name based on language, codec, and channels
-            language_map = {
-                'JPN': 'JP',
-                'FRE': 'FR',
-                'ENG': 'EN',
-                'CHI': 'CN'
-            }
-            lang_short = language_map.get(language, language)  # Use mapped abbreviation or original if missing
-            codec_map = {
-                'A_AAC': 'AAC',
-                'A_FLAC': 'FLAC',
-                'A_AC3': 'AC3',
-                'A_EAC3': 'EAC3',
-                'A_DTS': 'DTS',
-                'A_TRUEHD': 'TrueHD',
-                'A_MPEG/L3': 'MP3',        # Common MP3 codec
-                'A_VORBIS': 'Vorbis',      # Vorbis codec
-                'A_OPUS': 'Opus',          # Opus codec
-                'A_PCM/INT/LIT': 'PCM',    # PCM codec
-                'A_PCM/FLOAT/IEEE': 'PCM', # Floating-point PCM codec
-                'A_MS/ACM': 'MS Audio',    # Microsoft Audio codec, commonly WMA
-                'A_MLP': 'MLP',            # Meridian Lossless Packing
-                'A_ALAC': 'ALAC'           # Apple Lossless Audio Codec
-            }
-            codec_short = codec_map.get(codec, codec)  # Use mapped codec or original if missing
-
-            # Map channel counts to typical layouts
-            channel_layouts = {
-                1: "1.0",
-                2: "2.0",
-                6: "5.1",
-                8: "7.1"
-            }
-            # Determine channel layout
-            channel_layout = channel_layouts.get(channels, f"{channels}.1" if channels and int(channels) > 2 else f"{channels}.0")
-            
-            # Format the new track name
-            new_name = f"{lang_short} {codec_short} {channel_layout}"
+            # Debug: track information
+            logs.append(f"Track ID: {track_id}, Language: {track['properties'].get('language', '').upper()}, "
+                        f"Codec: {track['codec']}, Channels: {track['properties'].get('audio_channels', '')}, Current Name: {current_name}")
+
+            new_language, new_name = get_audio_track_name(track)
+            if new_language:
+                commands.extend(['--edit', f'track:a{track_id}', '--set', f'language={new_language}'])
 
             # Append update command for mkvpropedit if necessary
             if new_name and current_name != new_name:
                 commands.extend(['--edit', f'track:a{track_id}', '--set', f'name={new_name}'])
                 track_updates.append((current_name, new_name))
-                print(f"Scheduled update: {current_name} -> {new_name}")
+                logs.append(f"Scheduled update: {current_name} -> {new_name}")
+
+    return commands, track_updates, logs
+
+def audio_track_edits(info):
+    """
+    Same renaming as {track id: {"language": ..., "name": ...}} for the probed file, to apply it
+    during a remux instead of editing the file afterwards.
+
+    Returns:
+        tuple: (edits of the tracks to rename, log lines)
+    """
+    edits = {}
+    logs = []
+    for track in info['tracks']:
+        if track['type'] == 'audio':
+            track_id = track['id']
+            current_name = track['properties'].get('track_name', '')
+            new_language, new_name = get_audio_track_name(track)
+            changes = {}
+            if new_language:
+                changes['language'] = new_language
+            if new_name and current_name != new_name:
+                changes['name'] = new_name
+                logs.append(f"Audio track {track_id}: {current_name} -> {new_name}")
+            if changes:
+                edits[track_id] = changes
+    return edits, logs
+
+def audio_track_options(edits):
+    """mkvmerge options applying audio_track_edits, to put before the input file."""
+    options = []
+    for track_id, changes in edits.items():
+        if 'language' in changes:
+            options.extend(['--language', f'{track_id}:{changes["language"]}'])
+        if 'name' in changes:
+            options.extend(['--track-name', f'{track_id}:{changes["name"]}'])
+    return options
+
+def change_audio_track_names_by_language(mkv_file):
+    mkvpropedit_path = tool_path("mkvpropedit")
+
+    # Get the current track information
+    info = get_mkv_info(mkv_file)
+
+    # Prepare commands to change track names
+    commands, track_updates, logs = plan_audio_track_updates(info)
+    print("\n".join(logs))
 
     if commands:
-        # Execute the mkvpropedit command
+        # Names and languages rewritten in place when they fit in the header padding, else mkvpropedit
         try:
-            subprocess.run([mkvpropedit_path, mkv_file] + commands, check=True)
+            if not edit_track_headers(mkv_file, commands):
+                subprocess.run([mkvpropedit_path, mkv_file] + commands, check=True)
             print(f"Updated track names for {os.path.basename(mkv_file)}: {track_updates}")
         except subprocess.CalledProcessError as e:
             print(f"Error during mkvpropedit execution: {e.stderr}")
@@ -92,6 +154,8 @@ def change_audio_track_names_by_language(mkv_file):
         print(f"No updates necessary for {os.path.basename(mkv_file)}")
 
 def select_mkv_folder():
+    # Tk is only imported when the folder picker is used, the batch runs headless
+    from tkinter import Tk, filedialog
     root = Tk()
     root.withdraw()
     root.attributes("-topmost", True)
@@ -99,11 +163,28 @@ def select_mkv_folder():
     root.destroy()
     return mkv_folder
 
-def process_all_mkv_files_in_directory(directory):
-    mkv_files = [f for f in os.listdir(directory) if f.endswith('.mkv')]
-    for mkv_file in mkv_files:
-        mkv_file_path = os.path.join(directory, mkv_file)
-        change_audio_track_names_by_language(mkv_file_path)
+def process_all_mkv_files_in_directory(directory, use_asyncio=False, concurrency=None, mkv_files=None):
+    if mkv_files is None:
+        mkv_files = [f for f in os.listdir(directory) if f.endswith('.mkv')]
+    if use_asyncio:
+        from AsyncMkvRunner import run_batch  # asyncio is only imported for this mode
+        # Probe + edit of every file driven concurrently, report printed in file order
+        mkvpropedit_path = tool_path("mkvpropedit")
+        mkv_file_paths = [os.path.join(directory, mkv_file) for mkv_file in mkv_files]
+        for result in run_batch(mkv_file_paths, plan_audio_track_updates, mkvpropedit_path, concurrency):
+            base_name = os.path.basename(result["file"])
+            print("\n".join(result["logs"]))
+            if result["error"] is not None:
+                print(f"Error processing {base_name}: {result['error']}")
+            elif result["edited"]:
+                print(f"Updated track names for {base_name}: {result['updates']}")
+            else:
+                print(f"No updates necessary for {base_name}")
+    else:
+        for mkv_file in mkv_files:
+            mkv_file_path = os.path.join(directory, mkv_file)
+            change_audio_track_names_by_language(mkv_file_path)
+    print_probe_stats()
 
 if __name__ == "__main__":
     mkv_folder = select_mkv_folder()
@@ -6,22 +6,19 @@ and skip empty subtitle tracks based on track size in MKV files.
 
 import os
 import subprocess
-import json
-from tkinter import Tk, filedialog
+import concurrent.futures
+from MkvProbe import get_mkv_info, print_probe_stats
+from MkvToolNix import tool_path
+from MkvHeaderEdit import edit_track_headers
 
-def change_subtitle_track_names_by_size(mkv_file):
-    mkvmerge_path = r"C:\Program Files\MKVToolNix\mkvmerge.exe"
-    mkvpropedit_path = mkvmerge_path.replace('mkvmerge.exe', 'mkvpropedit.exe')
-
-    print(f"Processing file: {mkv_file}")
-
-    try:
-        result = subprocess.run([mkvmerge_path, '-J', mkv_file], capture_output=True, text=True, check=True, encoding='utf-8')
-        info = json.loads(result.stdout)
-    except subprocess.CalledProcessError as e:
-        print(f"Error running mkvmerge: {e.stderr}")
-        return
+def get_subtitle_track_names(info):
+    """
+    Decides the names of the subtitle tracks: the largest one is "Français", the second one "Français (forcé)".
+    Empty tracks are skipped.
 
+    Returns:
+        list: (track number, size, current name, new name or None) sorted by size, largest first.
+    """
     subtitle_tracks = []
     for track in info['tracks']:
         if track['type'] == 'subtitles':
@@ -32,32 +29,72 @@ def change_subtitle_track_names_by_size(mkv_file):
 
     subtitle_tracks.sort(key=lambda x: x[1], reverse=True)
 
-    print("Tracks and their sizes:")
-    for track_number, size, current_name in subtitle_tracks:
-        print(f"Track {track_number}: Size = {size} bytes, Current Name = '{current_name}'")
-
+    names = []
     for i, (track_number, size, current_name) in enumerate(subtitle_tracks):
-        if size == 0:
-            continue
-
-        if i == 0 and current_name != "Français":
+        new_name = None
+        if size != 0 and i == 0:
             new_name = "Français"
-            commands = ["--edit", f"track:{track_number}", "--set", f"name={new_name}"]
-        elif i == 1 and current_name != "Français (forcé)":
+        elif size != 0 and i == 1:
             new_name = "Français (forcé)"
-            commands = ["--edit", f"track:{track_number}", "--set", f"name={new_name}"]
-        else:
+        names.append((track_number, size, current_name, new_name))
+    return names
+
+def plan_subtitle_track_updates(info):
+    """
+    Computes the mkvpropedit arguments renaming the subtitle tracks of a probed MKV file.
+
+    Returns:
+        tuple: (mkvpropedit arguments, [(track number, current name, new name)], log lines)
+    """
+    subtitle_names = get_subtitle_track_names(info)
+
+    logs = ["Tracks and their sizes:"]
+    for track_number, size, current_name, _ in subtitle_names:
+        logs.append(f"Track {track_number}: Size = {size} bytes, Current Name = '{current_name}'")
+
+    # Every rename of the file goes in a single mkvpropedit call (one header write)
+    commands = []
+    track_updates = []
+    for track_number, size, current_name, new_name in subtitle_names:
+        if new_name is None or current_name == new_name:
             continue
+        commands.extend(["--edit", f"track:{track_number}", "--set", f"name={new_name}"])
+        track_updates.append((track_number, current_name, new_name))
+
+    return commands, track_updates, logs
 
-        try:
+def change_subtitle_track_names_by_size(mkv_file):
+    mkvpropedit_path = tool_path("mkvpropedit")
+
+    print(f"Processing file: {mkv_file}")
+
+    try:
+        info = get_mkv_info(mkv_file)
+    except subprocess.CalledProcessError as e:
+        print(f"Error running mkvmerge: {e.stderr}")
+        return
+
+    commands, track_updates, logs = plan_subtitle_track_updates(info)
+    print("\n".join(logs))
+
+    if not commands:
+        print(f"No updates necessary for {os.path.basename(mkv_file)}")
+        return
+
+    try:
+        # Names rewritten in place when they fit in the header padding, else mkvpropedit
+        if not edit_track_headers(mkv_file, commands):
             full_command = [mkvpropedit_path, mkv_file] + commands
             subprocess.run(full_command, check=True, capture_output=True, text=True)
+        for track_number, current_name, new_name in track_updates:
             print(f"Updated track {track_number}: Old Name = '{current_name}', New Name = '{new_name}'")
-        except subprocess.CalledProcessError as e:
-            print(f"Error during mkvpropedit execution for track {track_number}.")
+    except subprocess.CalledProcessError as e:
+        print(f"Error during mkvpropedit execution for tracks {[update[0] for update in track_updates]}: {e.stderr}")
 
 
 def select_mkv_folder():
+    # Tk is only imported when the folder picker is used, the batch runs headless
+    from tkinter import Tk, filedialog
     root = Tk()
     root.withdraw()
     root.attributes("-topmost", True)
@@ -65,11 +102,37 @@ def select_mkv_folder():
     root.destroy()
     return mkv_folder
 
-def process_all_mkv_files_in_directory(directory):
-    mkv_files = [f for f in os.listdir(directory) if f.endswith('.mkv')]
-    for mkv_file in mkv_files:
-        mkv_file_path = os.path.join(directory, mkv_file)
-        change_subtitle_track_names_by_size(mkv_file_path)
+def process_all_mkv_files_in_directory(directory, parallel=False, max_workers=4, use_asyncio=False, concurrency=None,
+                                       mkv_files=None):
+    if mkv_files is None:
+        mkv_files = [f for f in os.listdir(directory) if f.endswith('.mkv')]
+    mkv_file_paths = [os.path.join(directory, mkv_file) for mkv_file in mkv_files]
+    if use_asyncio:
+        from AsyncMkvRunner import run_batch  # asyncio is only imported for this mode
+        # Probe + edit of every file driven concurrently, report printed in file order
+        mkvpropedit_path = tool_path("mkvpropedit")
+        for result in run_batch(mkv_file_paths, plan_subtitle_track_updates, mkvpropedit_path, concurrency):
+            print(f"Processing file: {result['file']}")
+            print("\n".join(result["logs"]))
+            if result["error"] is not None:
+                print(f"Error processing {os.path.basename(result['file'])}: {result['error']}")
+            elif not result["edited"]:
+                print(f"No updates necessary for {os.path.basename(result['file'])}")
+            for track_number, current_name, new_name in result["updates"] if result["edited"] else []:
+                print(f"Updated track {track_number}: Old Name = '{current_name}', New Name = '{new_name}'")
+    elif parallel:
+        # Header edits are dominated by process startup and seeks, a few files at once keep the disk busy
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(change_subtitle_track_names_by_size, path): path for path in mkv_file_paths}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Error processing file {os.path.basename(futures[future])}: {e}")
+    else:
+        for mkv_file_path in mkv_file_paths:
+            change_subtitle_track_names_by_size(mkv_file_path)
+    print_probe_stats()
 
 if __name__ == "__main__":
     mkv_folder = select_mkv_folder()
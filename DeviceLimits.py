@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Limits the number of heavy mkvextract/mkvmerge jobs running at the same time on each disk.
+
+Every job declares the files it reads and writes. A semaphore per block device (from the
+st_dev of the paths) and per direction bounds the concurrent readers and writers, so several
+muxes targeting the same HDD do not make the heads thrash. Spinning disks get a limit of one
+reader and one writer, other devices use the configured limits.
+"""
+
+import os
+import sys
+import shutil
+import threading
+import subprocess
+from contextlib import contextmanager
+import StageMetrics
+import TraceEvents
+
+DEFAULT_READ_LIMIT = 4
+DEFAULT_WRITE_LIMIT = 2
+
+_lock = threading.Lock()
+_semaphores = {}
+_settings = {
+    "read_limit": DEFAULT_READ_LIMIT,
+    "write_limit": DEFAULT_WRITE_LIMIT,
+    "low_priority": False,
+}
+
+
+def configure(read_limit=None, write_limit=None, low_priority=None):
+    """Changes the limits (only for devices not used yet) and the priority of the heavy jobs."""
+    with _lock:
+        if read_limit is not None:
+            _settings["read_limit"] = read_limit
+        if write_limit is not None:
+            _settings["write_limit"] = write_limit
+        if low_priority is not None:
+            _settings["low_priority"] = low_priority
+
+
+def get_device(path):
+    """st_dev of a path, or of its first existing parent for outputs not created yet."""
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return os.stat(path).st_dev
+
+
+def is_rotational(device):
+    """True when the device is a spinning disk (only detected on Linux, None elsewhere)."""
+    if not sys.platform.startswith("linux"):
+        return None
+    block_dir = f"/sys/dev/block/{os.major(device)}:{os.minor(device)}"
+    # Partitions do not have a queue directory, their parent disk does
+    for queue_dir in (os.path.join(block_dir, "queue"), os.path.join(block_dir, "..", "queue")):
+        try:
+            with open(os.path.join(queue_dir, "rotational")) as f:
+                return f.read().strip() == "1"
+        except OSError:
+            continue
+    return None
+
+
+def _get_semaphore(device, direction):
+    with _lock:
+        key = (device, direction)
+        if key not in _semaphores:
+            if is_rotational(device):
+                limit = 1
+            else:
+                limit = _settings["read_limit"] if direction == "read" else _settings["write_limit"]
+            _semaphores[key] = threading.BoundedSemaphore(max(1, limit))
+        return _semaphores[key]
+
+
+@contextmanager
+def device_slots(read=(), write=(), program=None):
+    """
+    Holds a read slot on the devices of `read` and a write slot on the devices of `write`.
+
+    The semaphores are always acquired in the same order so two jobs can never deadlock.
+    """
+    keys = {(get_device(path), "read") for path in read}
+    keys |= {(get_device(path), "write") for path in write}
+    semaphores = [_get_semaphore(device, direction) for device, direction in sorted(keys)]
+    acquired = []
+    try:
+        with TraceEvents.span("wait disk slot", "io", program=program):
+            for semaphore in semaphores:
+                semaphore.acquire()
+                acquired.append(semaphore)
+        yield
+    finally:
+        for semaphore in reversed(acquired):
+            semaphore.release()
+
+
+def low_priority_command(command):
+    """Returns the command and subprocess arguments to run it with a low CPU and I/O priority."""
+    if os.name == "nt":
+        return command, {"creationflags": subprocess.BELOW_NORMAL_PRIORITY_CLASS}
+    prefix = []
+    if shutil.which("ionice"):
+        prefix += ["ionice", "-c", "2", "-n", "7"]
+    if shutil.which("nice"):
+        prefix += ["nice", "-n", "10"]
+    return prefix + list(command), {}
+
+
+def run_limited(command, read=(), write=(), low_priority=None, **kwargs):
+    """subprocess.run(command, check=True) once the device slots of the job are available."""
+    program = os.path.basename(command[0])
+    if low_priority is None:
+        low_priority = _settings["low_priority"]
+    if low_priority:
+        command, extra = low_priority_command(command)
+        kwargs.update(extra)
+    with device_slots(read=read, write=write, program=program):
+        with TraceEvents.span(program, "subprocess"):
+            if hasattr(os, "wait4") and not {"stderr", "capture_output", "input"} & kwargs.keys():
+                return _run_measured(command, **kwargs)
+            return subprocess.run(command, check=True, **kwargs)
+
+
+def _run_measured(command, **kwargs):
+    """subprocess.run(command, check=True) reaping the child with os.wait4, to count its CPU time in the stage metrics."""
+    with subprocess.Popen(command, **kwargs) as process:
+        try:
+            # stdout=PIPE is read to the end before reaping, the child would block on a full pipe
+            output = process.stdout.read() if process.stdout else None
+            _, status, usage = os.wait4(process.pid, 0)
+        except BaseException:
+            process.kill()
+            raise
+        process.returncode = os.waitstatus_to_exitcode(status)
+    StageMetrics.add_cpu(usage.ru_utime + usage.ru_stime)
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command, output)
+    return subprocess.CompletedProcess(command, process.returncode, output)
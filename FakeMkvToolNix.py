@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Stand-ins of mkvmerge, mkvextract and mkvpropedit for the benchmarks, no MKVToolNix or real MKV needed.
+
+A fake MKV starts with one line of JSON, the output of `mkvmerge -J`, and is padded (sparse)
+up to the size it simulates. The tools sleep to simulate their startup latency and the
+read/write bandwidth, and write real bytes:
+    mkvmerge -J      prints the JSON line
+    mkvextract       writes a synthetic ASS file per extracted track
+    mkvmerge -o      writes a fake MKV of the size of its input
+    mkvpropedit      only waits
+
+    python FakeMkvToolNix.py install DIR      (mkvmerge/mkvextract/mkvpropedit wrappers, for MKVTOOLNIX_DIR)
+    python FakeMkvToolNix.py mkvmerge -J file.mkv
+
+Environment: FAKE_MKV_LATENCY (seconds per call, default 0.02), FAKE_MKV_READ_MBPS (default 500),
+FAKE_MKV_WRITE_MBPS (default 300), FAKE_MKV_WRITE_BYTES (bytes really written per output, the rest
+is sparse, default 1 MiB).
+"""
+
+import os
+import sys
+import json
+import time
+import stat
+
+TOOLS = ("mkvmerge", "mkvextract", "mkvpropedit")
+MB = 1024 * 1024
+
+# Synthetic ASS tracks are capped, a tag size of several MB is not needed to exercise the restyle
+MAX_SUBTITLE_BYTES = 256 * 1024
+
+
+def _setting(name, default):
+    return float(os.environ.get(name, default))
+
+
+def fake_info(audio_tracks=1, subtitle_tracks=2, subtitle_bytes=60000, play_res="1920x1080"):
+    """mkvmerge -J data of a fake episode: video, audio (und) and French subtitle tracks, the first one the largest."""
+    tracks = [{"id": 0, "type": "video", "codec": "AVC/H.264/MPEG-4p10",
+               "properties": {"number": 1, "pixel_dimensions": play_res, "language": "und"}}]
+    for n in range(audio_tracks):
+        tracks.append({"id": len(tracks), "type": "audio", "codec": "AAC",
+                       "properties": {"number": len(tracks) + 1, "language": "und", "audio_channels": 2}})
+    for n in range(subtitle_tracks):
+        tracks.append({"id": len(tracks), "type": "subtitles", "codec": "SubStationAlpha",
+                       "properties": {"number": len(tracks) + 1, "language": "fre", "track_name": f"Track {n}",
+                                      "tag_number_of_bytes": str(subtitle_bytes // (n + 1))}})
+    return {"container": {"recognized": True, "supported": True, "type": "Matroska"}, "tracks": tracks}
+
+
+def create_fake_mkv(path, size, info):
+    with open(path, "wb") as f:
+        f.write(json.dumps(info).encode("utf-8") + b"\n")
+        f.truncate(max(size, f.tell()))
+
+
+def read_info(path):
+    with open(path, "rb") as f:
+        return json.loads(f.readline())
+
+
+def _simulate(read_bytes=0, write_bytes=0):
+    time.sleep(_setting("FAKE_MKV_LATENCY", 0.02)
+               + read_bytes / (_setting("FAKE_MKV_READ_MBPS", 500) * MB)
+               + write_bytes / (_setting("FAKE_MKV_WRITE_MBPS", 300) * MB))
+
+
+def _write_ass(path, nbytes):
+    lines = ["[Script Info]", "ScriptType: v4.00+", "PlayResX: 1920", "PlayResY: 1080", "",
+             "[V4+ Styles]",
+             "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, "
+             "Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, "
+             "MarginR, MarginV, Encoding"]
+    for name in ("Default", "Italique", "DefaultTop", "Sign"):
+        lines.append(f"Style: {name},Arial,60,&H00FFFFFF,&H000000FF,&H00000000,&H00000000,0,0,0,0,100,100,0,0,1,2,1,2,10,10,40,1")
+    lines += ["", "[Events]", "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text"]
+    event = r"Dialogue: 0,0:00:01.00,0:00:03.00,Default,,0,0,0,,{\pos(960,1000)}Une ligne de dialogue synthétique."
+    count = max(1, min(nbytes, MAX_SUBTITLE_BYTES) // len(event))
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines + [event] * count) + "\n")
+
+
+def mkvmerge(args):
+    if args[0] == "-J":
+        _simulate()
+        print(json.dumps(read_info(args[1])))
+        return 0
+    output = args[args.index("-o") + 1]
+    inputs = [arg for arg in args if arg.endswith(".mkv") and arg != output and os.path.isfile(arg)]
+    size = sum(os.path.getsize(path) for path in inputs)
+    _simulate(read_bytes=size, write_bytes=size)
+    with open(output, "wb") as f:
+        f.write(json.dumps(read_info(inputs[0])).encode("utf-8") + b"\n")
+        f.write(b"\0" * int(min(size, _setting("FAKE_MKV_WRITE_BYTES", MB))))
+        f.truncate(max(size, f.tell()))
+    return 0
+
+
+def mkvextract(args):
+    mkv_file, specs = args[1], args[2:]
+    info = read_info(mkv_file)
+    sizes = {track["id"]: int(track["properties"].get("tag_number_of_bytes", 0)) for track in info["tracks"]}
+    _simulate(read_bytes=os.path.getsize(mkv_file))
+    for spec in specs:
+        track_id, output = spec.split(":", 1)
+        _write_ass(output, sizes.get(int(track_id), 0))
+    return 0
+
+
+def mkvpropedit(args):
+    _simulate()
+    return 0
+
+
+def install(directory):
+    """Writes mkvmerge/mkvextract/mkvpropedit wrappers calling this script, returns the directory."""
+    os.makedirs(directory, exist_ok=True)
+    script = os.path.abspath(__file__)
+    for tool in TOOLS:
+        if os.name == "nt":
+            with open(os.path.join(directory, tool + ".cmd"), "w") as f:
+                f.write(f'@"{sys.executable}" "{script}" {tool} %*\n')
+        else:
+            path = os.path.join(directory, tool)
+            with open(path, "w") as f:
+                f.write(f'#!/bin/sh\nexec "{sys.executable}" "{script}" {tool} "$@"\n')
+            os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return directory
+
+
+def main(argv):
+    tool, args = argv[0], argv[1:]
+    if tool == "install":
+        print(install(args[0]))
+        return 0
+    return {"mkvmerge": mkvmerge, "mkvextract": mkvextract, "mkvpropedit": mkvpropedit}[tool](args)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
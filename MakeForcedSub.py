@@ -2,43 +2,131 @@
 Deletes every line containing Default to create a forced subtitle using the original one
 """
 import os
-import re
-import tkinter as tk
-from tkinter import filedialog
-from tkinter import messagebox
+import shutil
+import tempfile
+import concurrent.futures
+
+# Styles of the full (non forced) dialogue, their lines are removed from the forced subtitle
+UNWANTED_STYLES = frozenset({
+    "Default",
+    "Default I",
+    "Default top",
+    "DefaultUP",
+    "DefaultTop",
+    "Default (Arial 1080p) - Copier",
+    "Default - With margins",
+    "Italique",
+    "ItaliqueUP",
+    "TiretsDefault",
+    "TiretsItalique",
+})
+
+# Position of the Style column when [Events] has no Format line
+DEFAULT_STYLE_INDEX = 3
 
 def select_folder():
+    # Tk is only imported for the GUI, the filter itself runs headless
+    import tkinter as tk
+    from tkinter import filedialog
     root = tk.Tk()
     root.withdraw()  # Hide the root window
     folder_path = filedialog.askdirectory(title="Select folder containing .ass files")
     return folder_path
 
-def process_ass_file(file_path):
-    # Regex pattern to identify lines that have a "Default" style
-    # This will match any style that contains "Default" in its name
-    unwanted_styles_pattern = re.compile(r'Dialogue:.*,Default|Dialogue:.*,Italique|Dialogue:.*,TiretsItalique|Dialogue:.*,TiretsDefault')
+def process_ass_file(file_path, dry_run=False):
+    """
+    Removes the Dialogue lines whose Style column is in UNWANTED_STYLES.
+
+    The Style column is located from the Format line of [Events], so a style name appearing
+    in the dialogue text is never matched. The result is streamed to a temporary file which
+    replaces the original atomically.
 
-    with open(file_path, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
+    Args:
+        file_path (str): The .ass file to filter in place.
+        dry_run (bool): Only count the lines that would be removed, the file is not modified.
 
-    with open(file_path, 'w', encoding='utf-8') as f:
-        for line in lines:
-            # If the line does not match the "Default" style, keep it
-            if not unwanted_styles_pattern.search(line):
-                f.write(line)
+    Returns:
+        int: The number of removed (or removable) lines.
+    """
+    removed = 0
+    style_index = DEFAULT_STYLE_INDEX
+    in_events = False
+    dst = None
+    temp_path = None
+    if not dry_run:
+        fd, temp_path = tempfile.mkstemp(suffix=".ass.tmp", dir=os.path.dirname(os.path.abspath(file_path)))
+        dst = open(fd, 'w', encoding='utf-8', newline='')
 
-def process_folder(folder_path):
-    if not folder_path:
-        messagebox.showerror("Error", "No folder selected.")
+    try:
+        with open(file_path, 'r', encoding='utf-8', newline='') as src:
+            for line in src:
+                stripped = line.strip()
+                if stripped.startswith('['):
+                    in_events = stripped.lower() == '[events]'
+                elif in_events and line.startswith('Format:'):
+                    columns = [column.strip().lower() for column in line[len('Format:'):].split(',')]
+                    if 'style' in columns:
+                        style_index = columns.index('style')
+                elif in_events and line.startswith('Dialogue:'):
+                    fields = line[len('Dialogue:'):].split(',', style_index + 1)
+                    # If the line does use an unwanted style, drop it
+                    if len(fields) > style_index and fields[style_index].strip() in UNWANTED_STYLES:
+                        removed += 1
+                        continue
+                if dst:
+                    dst.write(line)
+        if dst:
+            dst.close()
+            shutil.copymode(file_path, temp_path)
+            os.replace(temp_path, file_path)
+    except BaseException:
+        if dst:
+            dst.close()
+            os.remove(temp_path)
+        raise
+    return removed
+
+def process_folder(folder_path, dry_run=False, max_workers=None, gui=True, file_paths=None):
+    if gui:
+        from tkinter import messagebox
+    if not folder_path and not file_paths:
+        if gui:
+            messagebox.showerror("Error", "No folder selected.")
+        else:
+            print("No folder selected.")
         return
 
-    # Iterate through all files in the folder
-    for filename in os.listdir(folder_path):
-        if filename.endswith(".ass"):
-            file_path = os.path.join(folder_path, filename)
-            process_ass_file(file_path)
-    
-    messagebox.showinfo("Success", "All .ass files have been processed.")
+    if file_paths is None:
+        file_paths = [
+            os.path.join(folder_path, filename)
+            for filename in os.listdir(folder_path) if filename.endswith(".ass")
+        ]
+
+    # Each file is filtered in its own worker process
+    # A file that fails is reported and skipped, the others are still processed
+    removed_lines = {}
+    failed_files = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(process_ass_file, file_path, dry_run): file_path for file_path in file_paths}
+        for future in concurrent.futures.as_completed(futures):
+            filename = os.path.basename(futures[future])
+            try:
+                removed_lines[filename] = future.result()
+            except Exception as e:
+                failed_files.append(filename)
+                print(f"Error processing {futures[future]}: {e}")
+                continue
+            action = "would be removed" if dry_run else "removed"
+            print(f"{filename}: {removed_lines[filename]} lines {action}")
+
+    if failed_files:
+        print(f"{len(failed_files)} file(s) failed: {', '.join(sorted(failed_files))}")
+    if gui and not dry_run:
+        if failed_files:
+            messagebox.showwarning("Warning", "Some .ass files could not be processed:\n" + "\n".join(sorted(failed_files)))
+        else:
+            messagebox.showinfo("Success", "All .ass files have been processed.")
+    return removed_lines
 
 if __name__ == "__main__":
     folder_path = select_folder()
@@ -0,0 +1,434 @@
+# -*- coding: utf-8 -*-
+"""
+Pure-Python reader of the Matroska headers.
+
+The Tracks and Tags elements are located through the SeekHead and only those few KB are read,
+instead of forking `mkvmerge -J`. read_mkv_info returns the `mkvmerge -J` shape for the fields
+the tools use (type, number, language, codec, name, channels, pixel dimensions, statistics
+tags), or None as soon as the file has anything unusual, and the caller then runs mkvmerge.
+"""
+
+import os
+import struct
+
+# EBML / Matroska element IDs (marker bits kept)
+EBML_HEADER = 0x1A45DFA3
+EBML_VERSION = 0x4286
+EBML_READ_VERSION = 0x42F7
+EBML_MAX_ID_LENGTH = 0x42F2
+EBML_MAX_SIZE_LENGTH = 0x42F3
+DOC_TYPE = 0x4282
+DOC_TYPE_VERSION = 0x4287
+DOC_TYPE_READ_VERSION = 0x4285
+SEGMENT = 0x18538067
+SEEK_HEAD = 0x114D9B74
+SEEK = 0x4DBB
+SEEK_ID = 0x53AB
+SEEK_POSITION = 0x53AC
+INFO = 0x1549A966
+SEGMENT_UID = 0x73A4
+TIMESTAMP_SCALE = 0x2AD7B1
+TITLE = 0x7BA9
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+TRACK_NUMBER = 0xD7
+TRACK_UID = 0x73C5
+TRACK_TYPE = 0x83
+FLAG_ENABLED = 0xB9
+FLAG_DEFAULT = 0x88
+FLAG_FORCED = 0x55AA
+FLAG_LACING = 0x9C
+DEFAULT_DURATION = 0x23E383
+NAME = 0x536E
+LANGUAGE = 0x22B59C
+LANGUAGE_BCP47 = 0x22B59D
+CODEC_ID = 0x86
+CODEC_PRIVATE = 0x63A2
+VIDEO = 0xE0
+PIXEL_WIDTH = 0xB0
+PIXEL_HEIGHT = 0xBA
+DISPLAY_WIDTH = 0x54B0
+DISPLAY_HEIGHT = 0x54BA
+AUDIO = 0xE1
+SAMPLING_FREQUENCY = 0xB5
+CHANNELS = 0x9F
+BIT_DEPTH = 0x6264
+CONTENT_ENCODINGS = 0x6D80
+CONTENT_ENCODING = 0x6240
+CONTENT_ENCODING_SCOPE = 0x5032
+CONTENT_ENCODING_TYPE = 0x5033
+CONTENT_COMPRESSION = 0x5034
+CONTENT_COMP_ALGO = 0x4254
+CONTENT_COMP_SETTINGS = 0x4255
+ATTACHMENTS = 0x1941A469
+ATTACHED_FILE = 0x61A7
+FILE_NAME = 0x466E
+FILE_MIME_TYPE = 0x4660
+FILE_DATA = 0x465C
+FILE_UID = 0x46AE
+CHAPTERS = 0x1043A770
+TAGS = 0x1254C367
+TAG = 0x7373
+TARGETS = 0x63C0
+TARGET_TYPE_VALUE = 0x68CA
+TAG_TRACK_UID = 0x63C5
+SIMPLE_TAG = 0x67C8
+TAG_NAME = 0x45A3
+TAG_STRING = 0x4487
+CLUSTER = 0x1F43B675
+CLUSTER_TIMESTAMP = 0xE7
+BLOCK_GROUP = 0xA0
+BLOCK = 0xA1
+BLOCK_DURATION = 0x9B
+SIMPLE_BLOCK = 0xA3
+CUES = 0x1C53BB6B
+CUE_POINT = 0xBB
+CUE_TIME = 0xB3
+CUE_TRACK_POSITIONS = 0xB7
+CUE_TRACK = 0xF7
+CUE_CLUSTER_POSITION = 0xF1
+CUE_RELATIVE_POSITION = 0xF0
+CUE_DURATION = 0xB2
+CUE_BLOCK_NUMBER = 0x5378
+CUE_CODEC_STATE = 0xEA
+CUE_REFERENCE = 0xDB
+VOID = 0xEC
+CRC32 = 0xBF
+
+TRACK_TYPES = {1: "video", 2: "audio", 0x11: "subtitles"}
+
+# Codec names printed by mkvmerge -J, an unknown codec ID goes through mkvmerge
+CODEC_NAMES = {
+    "V_MPEG4/ISO/AVC": "AVC/H.264/MPEG-4p10",
+    "V_MPEGH/ISO/HEVC": "HEVC/H.265/MPEG-H",
+    "V_AV1": "AV1",
+    "V_VP8": "VP8",
+    "V_VP9": "VP9",
+    "V_MPEG2": "MPEG-1/2",
+    "A_AAC": "AAC",
+    "A_AC3": "AC-3",
+    "A_EAC3": "E-AC-3",
+    "A_DTS": "DTS",
+    "A_FLAC": "FLAC",
+    "A_OPUS": "Opus",
+    "A_VORBIS": "Vorbis",
+    "A_TRUEHD": "TrueHD",
+    "A_MPEG/L3": "MP3",
+    "A_PCM/INT/LIT": "PCM",
+    "S_TEXT/ASS": "SubStationAlpha",
+    "S_TEXT/SSA": "SubStationAlpha",
+    "S_TEXT/UTF8": "SubRip/SRT",
+    "S_HDMV/PGS": "HDMV PGS",
+    "S_VOBSUB": "VobSub",
+}
+
+# First read of the file: EBML header, SeekHead and usually Info and Tracks
+HEAD_READ_SIZE = 64 * 1024
+# Header of an element: 4 bytes of ID and 8 of size at most
+MAX_HEADER_SIZE = 12
+# Larger Tracks or Tags elements are unusual, left to mkvmerge
+MAX_ELEMENT_SIZE = 16 * 1024 * 1024
+
+
+class UnsupportedFile(Exception):
+    """The file has something the native reader does not handle, mkvmerge has to read it."""
+
+
+def read_vint(data, pos, keep_marker=False):
+    """
+    EBML variable-length integer at `pos`.
+
+    Returns:
+        tuple: (value, length); the value is None for the reserved "unknown size".
+    """
+    if pos >= len(data) or data[pos] == 0:
+        raise UnsupportedFile(f"invalid EBML integer at {pos}")
+    first = data[pos]
+    length = 9 - first.bit_length()
+    if pos + length > len(data):
+        raise UnsupportedFile(f"truncated EBML integer at {pos}")
+    value = first if keep_marker else first & (0xFF >> length)
+    for byte in data[pos + 1:pos + length]:
+        value = value << 8 | byte
+    if not keep_marker and value == (1 << 7 * length) - 1:
+        return None, length
+    return value, length
+
+
+def read_element_header(data, pos):
+    """Returns (element ID, body size or None when unknown, body start) of the element at `pos`."""
+    element_id, id_length = read_vint(data, pos, keep_marker=True)
+    if id_length > 4:
+        raise UnsupportedFile(f"invalid element ID at {pos}")
+    size, size_length = read_vint(data, pos + id_length)
+    return element_id, size, pos + id_length + size_length
+
+
+def iter_elements(data, start, end):
+    """(element ID, element start, body start, body end) of the children of a master element body."""
+    pos = start
+    while pos < end:
+        element_id, size, body = read_element_header(data, pos)
+        if size is None or body + size > end:
+            raise UnsupportedFile(f"element {element_id:#x} overflows its parent")
+        yield element_id, pos, body, body + size
+        pos = body + size
+
+
+def iter_children(data, start, end):
+    """(element ID, body start, body end) of the children of a master element body."""
+    for element_id, _, body_start, body_end in iter_elements(data, start, end):
+        yield element_id, body_start, body_end
+
+
+def read_uint(data, start, end):
+    return int.from_bytes(data[start:end], "big")
+
+
+def read_float(data, start, end):
+    if end - start == 4:
+        return struct.unpack(">f", data[start:end])[0]
+    if end - start == 8:
+        return struct.unpack(">d", data[start:end])[0]
+    return 0.0
+
+
+def read_string(data, start, end):
+    return data[start:end].split(b"\0", 1)[0].decode("utf-8")
+
+
+def encode_vint(value, length=None):
+    """EBML encoding of a size on `length` bytes (the shortest when None)."""
+    if length is None:
+        length = 1
+        while value >= (1 << 7 * length) - 1:
+            length += 1
+    if length > 8 or value >= (1 << 7 * length) - 1:
+        raise UnsupportedFile(f"size {value} does not fit in {length} bytes")
+    return ((1 << 7 * length) | value).to_bytes(length, "big")
+
+
+def encode_id(element_id):
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, "big")
+
+
+def encode_element(element_id, body, size_length=None):
+    return encode_id(element_id) + encode_vint(len(body), size_length) + body
+
+
+def encode_uint(element_id, value):
+    return encode_element(element_id, value.to_bytes(max(1, (value.bit_length() + 7) // 8), "big"))
+
+
+def void_element(total):
+    """Void element of exactly `total` bytes, None for 1 byte (the smallest Void takes 2)."""
+    for length in range(1, 9):
+        size = total - 1 - length
+        if 0 <= size < (1 << 7 * length) - 1:
+            return bytes([VOID]) + encode_vint(size, length) + bytes(size)
+    return None
+
+
+def read_at(f, offset, length):
+    """Positioned read (os.pread, seek and read on Windows)."""
+    if hasattr(os, "pread"):
+        return os.pread(f.fileno(), length, offset)
+    f.seek(offset)
+    return f.read(length)
+
+
+def read_element(f, offset, element_id, limit, head=b""):
+    """Body of the element `element_id` at `offset` of the file (the head buffer is used when it holds it)."""
+    header = head[offset:offset + MAX_HEADER_SIZE] if offset + MAX_HEADER_SIZE <= len(head) else read_at(f, offset, MAX_HEADER_SIZE)
+    found_id, size, body = read_element_header(header, 0)
+    if found_id != element_id or size is None or size > MAX_ELEMENT_SIZE or offset + body + size > limit:
+        raise UnsupportedFile(f"expected element {element_id:#x} at {offset}")
+    start = offset + body
+    if start + size <= len(head):
+        return head[start:start + size]
+    data = read_at(f, start, size)
+    if len(data) != size:
+        raise UnsupportedFile("truncated file")
+    return data
+
+
+def locate_segment(f, head, file_size):
+    """
+    Checks the EBML header and returns the positions of the segment.
+
+    Returns:
+        tuple: (segment data start, segment end, {element ID: absolute offset}) with the
+        offsets of the level 1 elements found through the SeekHead(s) and before the first Cluster.
+    """
+    element_id, size, body = read_element_header(head, 0)
+    if element_id != EBML_HEADER or size is None:
+        raise UnsupportedFile("not an EBML file")
+    doc_type = None
+    for child_id, start, end in iter_children(head, body, body + size):
+        if child_id == DOC_TYPE:
+            doc_type = read_string(head, start, end)
+    if doc_type not in ("matroska", "webm"):
+        raise UnsupportedFile(f"DocType {doc_type!r}")
+
+    element_id, size, segment_start = read_element_header(head, body + size)
+    if element_id != SEGMENT or size is None:
+        raise UnsupportedFile("no Segment or Segment of unknown size (live file)")
+    segment_end = segment_start + size
+    if segment_end > file_size:
+        raise UnsupportedFile("truncated Segment")
+
+    positions = {}
+    seek_heads = []
+    # Level 1 elements at the start of the segment, in the head buffer
+    pos = segment_start
+    while pos + MAX_HEADER_SIZE <= len(head) and pos < segment_end:
+        element_id, size, body = read_element_header(head, pos)
+        if element_id == CLUSTER or size is None:
+            break
+        positions.setdefault(element_id, pos)
+        if element_id == SEEK_HEAD:
+            seek_heads.append(pos)
+        pos = body + size
+
+    # Elements indexed by the SeekHead, which can point to a second SeekHead (usually at the end)
+    seen = set()
+    while seek_heads:
+        offset = seek_heads.pop()
+        if offset in seen:
+            continue
+        seen.add(offset)
+        data = read_element(f, offset, SEEK_HEAD, segment_end, head)
+        for child_id, start, end in iter_children(data, 0, len(data)):
+            if child_id != SEEK:
+                continue
+            seek_id = seek_position = None
+            for entry_id, entry_start, entry_end in iter_children(data, start, end):
+                if entry_id == SEEK_ID:
+                    seek_id = read_uint(data, entry_start, entry_end)
+                elif entry_id == SEEK_POSITION:
+                    seek_position = read_uint(data, entry_start, entry_end)
+            if seek_id is None or seek_position is None:
+                continue
+            positions.setdefault(seek_id, segment_start + seek_position)
+            if seek_id == SEEK_HEAD:
+                seek_heads.append(segment_start + seek_position)
+    return segment_start, segment_end, positions
+
+
+def _parse_track(data, start, end, track_id):
+    values = {}
+    for element_id, child_start, child_end in iter_children(data, start, end):
+        if element_id in (VIDEO, AUDIO):
+            for sub_id, sub_start, sub_end in iter_children(data, child_start, child_end):
+                values[sub_id] = (sub_start, sub_end)
+        values[element_id] = (child_start, child_end)
+
+    def uint(element_id, default=None):
+        return read_uint(data, *values[element_id]) if element_id in values else default
+
+    def string(element_id, default=None):
+        return read_string(data, *values[element_id]) if element_id in values else default
+
+    track_type = TRACK_TYPES.get(uint(TRACK_TYPE))
+    codec_id = string(CODEC_ID)
+    if track_type is None or codec_id not in CODEC_NAMES:
+        raise UnsupportedFile(f"track type {uint(TRACK_TYPE)} / codec {codec_id}")
+    if LANGUAGE_BCP47 in values and LANGUAGE not in values:
+        raise UnsupportedFile("language only given as BCP 47")
+
+    properties = {
+        "number": uint(TRACK_NUMBER),
+        "uid": uint(TRACK_UID),
+        "codec_id": codec_id,
+        "codec_private_length": values[CODEC_PRIVATE][1] - values[CODEC_PRIVATE][0] if CODEC_PRIVATE in values else 0,
+        "default_track": bool(uint(FLAG_DEFAULT, 1)),
+        "forced_track": bool(uint(FLAG_FORCED, 0)),
+        "enabled_track": bool(uint(FLAG_ENABLED, 1)),
+        # Matroska default language
+        "language": string(LANGUAGE, "eng"),
+    }
+    if LANGUAGE_BCP47 in values:
+        properties["language_ietf"] = string(LANGUAGE_BCP47)
+    if NAME in values:
+        properties["track_name"] = string(NAME)
+    if DEFAULT_DURATION in values:
+        properties["default_duration"] = uint(DEFAULT_DURATION)
+    if track_type == "video":
+        width, height = uint(PIXEL_WIDTH, 0), uint(PIXEL_HEIGHT, 0)
+        properties["pixel_dimensions"] = f"{width}x{height}"
+        properties["display_dimensions"] = f"{uint(DISPLAY_WIDTH, width)}x{uint(DISPLAY_HEIGHT, height)}"
+    elif track_type == "audio":
+        properties["audio_channels"] = uint(CHANNELS, 1)
+        properties["audio_sampling_frequency"] = int(read_float(data, *values[SAMPLING_FREQUENCY])) if SAMPLING_FREQUENCY in values else 8000
+        if BIT_DEPTH in values:
+            properties["audio_bits_per_sample"] = uint(BIT_DEPTH)
+    elif codec_id.startswith("S_TEXT/"):
+        properties["text_subtitles"] = True
+    return {"id": track_id, "type": track_type, "codec": CODEC_NAMES[codec_id], "properties": properties}
+
+
+def parse_tracks(data):
+    """Tracks of the Tracks element body, ids numbered in file order like mkvmerge."""
+    tracks = []
+    for element_id, start, end in iter_children(data, 0, len(data)):
+        if element_id == TRACK_ENTRY:
+            tracks.append(_parse_track(data, start, end, len(tracks)))
+    return tracks
+
+
+def parse_track_tags(data):
+    """{track UID: {tag name: value}} of the Tags element body (the global tags are skipped)."""
+    tags = {}
+    for element_id, start, end in iter_children(data, 0, len(data)):
+        if element_id != TAG:
+            continue
+        track_uids = []
+        simple_tags = {}
+        for child_id, child_start, child_end in iter_children(data, start, end):
+            if child_id == TARGETS:
+                track_uids += [read_uint(data, s, e) for target_id, s, e in iter_children(data, child_start, child_end)
+                               if target_id == TAG_TRACK_UID]
+            elif child_id == SIMPLE_TAG:
+                name = value = None
+                for tag_id, s, e in iter_children(data, child_start, child_end):
+                    if tag_id == TAG_NAME:
+                        name = read_string(data, s, e)
+                    elif tag_id == TAG_STRING:
+                        value = read_string(data, s, e)
+                if name is not None and value is not None:
+                    simple_tags[name] = value
+        for uid in track_uids:
+            tags.setdefault(uid, {}).update(simple_tags)
+    return tags
+
+
+def read_mkv_info(mkv_file):
+    """
+    `mkvmerge -J` shaped information of a Matroska file, read from its headers only.
+
+    Returns:
+        dict or None: None when the file needs mkvmerge (not Matroska, live file, no SeekHead
+        entry for Tracks/Tags, unknown track type or codec, damaged element...).
+    """
+    try:
+        with open(mkv_file, "rb") as f:
+            file_size = os.fstat(f.fileno()).st_size
+            head = f.read(HEAD_READ_SIZE)
+            segment_start, segment_end, positions = locate_segment(f, head, file_size)
+            if TRACKS not in positions or TAGS not in positions:
+                raise UnsupportedFile("Tracks or Tags not indexed")
+            tracks = parse_tracks(read_element(f, positions[TRACKS], TRACKS, segment_end, head))
+            track_tags = parse_track_tags(read_element(f, positions[TAGS], TAGS, segment_end, head))
+    except (UnsupportedFile, OSError, UnicodeDecodeError, struct.error):
+        return None
+
+    for track in tracks:
+        for name, value in track_tags.get(track["properties"]["uid"], {}).items():
+            track["properties"]["tag_" + name.lower()] = value
+    return {
+        "container": {"recognized": True, "supported": True, "type": "Matroska"},
+        "errors": [],
+        "warnings": [],
+        "file_name": mkv_file,
+        "tracks": tracks,
+    }
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+Native in-place edit of the track names and languages of a MKV file.
+
+The edited TrackEntry elements are written again inside the space of the Tracks element, using
+the EBML Void padding it holds or that directly follows it, so no other element moves (the
+SeekHead and Cues stay valid). Only the span of bytes that changed is written, with a single
+pwrite and fsync, then the header is read back to check it. Anything else than `--set name=`
+and `--set language=`, or a change that does not fit, is left to mkvpropedit.
+"""
+
+import os
+import zlib
+
+import MkvEbml
+from MkvEbml import UnsupportedFile, encode_element, iter_elements, read_element_header, read_uint
+
+# MKV_NATIVE_EDIT=0 to always run mkvpropedit
+NATIVE_EDIT = os.environ.get("MKV_NATIVE_EDIT", "1") == "1"
+
+# mkvpropedit properties handled natively
+EDITABLE = {"name": MkvEbml.NAME, "language": MkvEbml.LANGUAGE}
+TYPE_LETTERS = {"v": 1, "a": 2, "s": 0x11}
+
+
+def parse_edits(commands):
+    """
+    Track edits of mkvpropedit arguments (["--edit", "track:a1", "--set", "name=JP AAC 2.0", ...]).
+
+    Returns:
+        list: [(track selector, element ID, value)], None when an argument is not handled natively.
+    """
+    edits = []
+    selector = None
+    for option, value in zip(commands[::2], commands[1::2]):
+        if option == "--edit" and value.startswith("track:"):
+            selector = value[len("track:"):]
+        elif option == "--set" and selector is not None and value.partition("=")[0] in EDITABLE:
+            key, _, text = value.partition("=")
+            edits.append((selector, EDITABLE[key], text))
+        else:
+            return None
+    return edits if len(commands) % 2 == 0 else None
+
+
+def select_track(entries, selector):
+    """
+    Index of the TrackEntry designated by a mkvpropedit selector: "3" (third track), "a1" (first
+    audio track), "@2" (TrackNumber 2) or "=UID".
+    """
+    if selector[:1] in ("@", "="):
+        key = 0 if selector[0] == "@" else 1
+        matches = [index for index, entry in enumerate(entries) if entry[key] == int(selector[1:])]
+    elif selector[:1] in TYPE_LETTERS:
+        matches = [index for index, entry in enumerate(entries) if entry[2] == TYPE_LETTERS[selector[0]]]
+        matches = matches[int(selector[1:]) - 1:int(selector[1:])] if int(selector[1:]) > 0 else []
+    else:
+        matches = [int(selector) - 1] if 0 < int(selector) <= len(entries) else []
+    if len(matches) != 1:
+        raise UnsupportedFile(f"no track {selector}")
+    return matches[0]
+
+
+def _with_crc(children, padding=b""):
+    """
+    Body of a master element from its child elements and trailing Void padding, with its CRC-32
+    computed again if it had one (it covers everything after it, padding included).
+    """
+    if children and children[0][0] == MkvEbml.CRC32:
+        rest = b"".join(raw for _, raw in children[1:]) + padding
+        return encode_element(MkvEbml.CRC32, zlib.crc32(rest).to_bytes(4, "little")) + rest
+    return b"".join(raw for _, raw in children) + padding
+
+
+def _crc_matches(data, start, end):
+    """False when the master element body data[start:end] starts with a CRC-32 that does not match it."""
+    children = iter_elements(data, start, end)
+    element_id, _, body_start, body_end = next(children, (None, None, None, None))
+    if element_id != MkvEbml.CRC32:
+        return True
+    return data[body_start:body_end] == zlib.crc32(data[body_end:end]).to_bytes(4, "little")
+
+
+def rewrite_entry(data, start, end, fields):
+    """TrackEntry body with the {element ID: value} fields set, its Void padding dropped."""
+    children = []
+    for element_id, element_start, body_start, body_end in iter_elements(data, start, end):
+        if element_id == MkvEbml.LANGUAGE_BCP47 and MkvEbml.LANGUAGE in fields:
+            # mkvpropedit keeps the BCP 47 language in line with the legacy one
+            raise UnsupportedFile("track with a BCP 47 language")
+        if element_id == MkvEbml.VOID or element_id in fields:
+            continue
+        children.append((element_id, bytes(data[element_start:body_end])))
+    for element_id, value in fields.items():
+        children.append((element_id, encode_element(element_id, value.encode("utf-8"))))
+    return _with_crc(children)
+
+
+def _track_summary(data, start, end):
+    values = {element_id: (s, e) for element_id, _, s, e in iter_elements(data, start, end)}
+    return tuple(read_uint(data, *values[element_id]) if element_id in values else None
+                 for element_id in (MkvEbml.TRACK_NUMBER, MkvEbml.TRACK_UID, MkvEbml.TRACK_TYPE))
+
+
+def plan_region(region, tracks_header_length, tracks_size, edits):
+    """
+    New bytes of the region made of the Tracks element and the Void elements following it.
+
+    Args:
+        region (bytes): Current bytes of the region.
+        tracks_header_length (int): Length of the ID and size of the Tracks element.
+        tracks_size (int): Size of its body.
+        edits (list): [(track selector, element ID, value)] from parse_edits.
+
+    Returns:
+        tuple: (new region bytes of the same length, {entry index: {element ID: value}}).
+    """
+    tracks = region[tracks_header_length:tracks_header_length + tracks_size]
+    region_length = len(region)
+    elements = list(iter_elements(tracks, 0, len(tracks)))
+    entries = [(index, element) for index, element in enumerate(elements) if element[0] == MkvEbml.TRACK_ENTRY]
+    summaries = [_track_summary(tracks, body_start, body_end) for _, (_, _, body_start, body_end) in entries]
+    fields = {}
+    for selector, element_id, value in edits:
+        fields.setdefault(select_track(summaries, selector), {})[element_id] = value
+
+    children = []
+    for element_index, (element_id, element_start, body_start, body_end) in enumerate(elements):
+        if element_id == MkvEbml.VOID:
+            continue
+        raw = bytes(tracks[element_start:body_end])
+        entry_index = next((n for n, (index, _) in enumerate(entries) if index == element_index), None)
+        if entry_index in fields:
+            size_length = body_start - element_start - (element_id.bit_length() + 7) // 8
+            body = rewrite_entry(tracks, body_start, body_end, fields[entry_index])
+            try:
+                raw = encode_element(element_id, body, size_length)
+            except UnsupportedFile:
+                raw = encode_element(element_id, body)
+        children.append((element_id, raw))
+    body_length = len(_with_crc(children))
+
+    # The Tracks keeps its size when the entries still fit (Void inside it, the padding after it is left as is),
+    # else it grows into the Void following it
+    size_length = tracks_header_length - 4
+    tail = region[tracks_header_length + tracks_size:]
+    if body_length <= tracks_size:
+        inner_void = b"" if body_length == tracks_size else MkvEbml.void_element(tracks_size - body_length)
+        if inner_void is not None:
+            return encode_element(MkvEbml.TRACKS, _with_crc(children, inner_void), size_length) + tail, fields
+    layouts = [(region_length - tracks_header_length, size_length), (body_length, size_length), (body_length, size_length + 1)]
+    for new_size, length in layouts:
+        outer = region_length - 4 - length - new_size
+        inner = new_size - body_length
+        if inner < 0 or outer < 0:
+            continue
+        inner_void = b"" if inner == 0 else MkvEbml.void_element(inner)
+        outer_void = b"" if outer == 0 else MkvEbml.void_element(outer)
+        if inner_void is None or outer_void is None:
+            continue
+        try:
+            return encode_element(MkvEbml.TRACKS, _with_crc(children, inner_void), length) + outer_void, fields
+        except UnsupportedFile:
+            continue
+    raise UnsupportedFile("the edited tracks do not fit in the Tracks element and its padding")
+
+
+def _write_at(f, offset, data):
+    if hasattr(os, "pwrite"):
+        written = os.pwrite(f.fileno(), data, offset)
+    else:
+        f.seek(offset)
+        written = f.write(data)
+        f.flush()
+    if written != len(data):
+        raise OSError(f"short write ({written} of {len(data)} bytes)")
+    os.fsync(f.fileno())
+
+
+def _check(region, fields):
+    """True when the re-read region holds the expected names and languages, and its CRC-32 elements match."""
+    element_id, size, body_start = read_element_header(region, 0)
+    if element_id != MkvEbml.TRACKS or size is None:
+        return False
+    body_end = body_start + size
+    if not _crc_matches(region, body_start, body_end) or not all(
+            _crc_matches(region, entry_start, entry_end)
+            for entry_id, _, entry_start, entry_end in iter_elements(region, body_start, body_end) if entry_id == MkvEbml.TRACK_ENTRY):
+        return False
+    tracks = MkvEbml.parse_tracks(region[body_start:body_start + size])
+    keys = {MkvEbml.NAME: "track_name", MkvEbml.LANGUAGE: "language"}
+    return all(tracks[index]["properties"].get(keys[element_id]) == value
+               for index, values in fields.items() for element_id, value in values.items())
+
+
+def edit_track_headers(mkv_file, commands):
+    """
+    Applies mkvpropedit track edits (name and language) in place without mkvpropedit.
+
+    Args:
+        mkv_file (str): Path of the MKV file.
+        commands (list): mkvpropedit arguments after the file name.
+
+    Returns:
+        bool: True when the file was edited, False when mkvpropedit has to do it (the file is unchanged).
+    """
+    edits = parse_edits(commands) if NATIVE_EDIT else None
+    if edits is None:
+        return False
+    if not edits:
+        return True
+    try:
+        with open(mkv_file, "r+b") as f:
+            file_size = os.fstat(f.fileno()).st_size
+            head = f.read(MkvEbml.HEAD_READ_SIZE)
+            segment_start, segment_end, positions = MkvEbml.locate_segment(f, head, file_size)
+            if MkvEbml.TRACKS not in positions:
+                raise UnsupportedFile("Tracks not indexed")
+            tracks_offset = positions[MkvEbml.TRACKS]
+            header = MkvEbml.read_at(f, tracks_offset, MkvEbml.MAX_HEADER_SIZE)
+            _, tracks_size, tracks_header_length = read_element_header(header, 0)
+            if tracks_size is None or tracks_size > MkvEbml.MAX_ELEMENT_SIZE:
+                raise UnsupportedFile("Tracks of unknown or large size")
+
+            # Void elements directly after the Tracks element
+            region_end = tracks_offset + tracks_header_length + tracks_size
+            while region_end + 2 <= segment_end:
+                element_id, size, body_start = read_element_header(MkvEbml.read_at(f, region_end, MkvEbml.MAX_HEADER_SIZE), 0)
+                if element_id != MkvEbml.VOID or size is None or region_end + body_start + size > segment_end:
+                    break
+                region_end += body_start + size
+
+            old = MkvEbml.read_at(f, tracks_offset, region_end - tracks_offset)
+            new, fields = plan_region(old, tracks_header_length, tracks_size, edits)
+            changed = [index for index in range(len(old)) if old[index] != new[index]]
+            if not changed:
+                return True
+            first, last = changed[0], changed[-1] + 1
+            _write_at(f, tracks_offset + first, new[first:last])
+
+            # Header read back, the old bytes are put back if it is not the expected one
+            try:
+                verified = _check(MkvEbml.read_at(f, tracks_offset, len(old)), fields)
+            except (UnsupportedFile, UnicodeDecodeError, IndexError):
+                verified = False
+            if not verified:
+                _write_at(f, tracks_offset + first, old[first:last])
+            return verified
+    except (UnsupportedFile, OSError, UnicodeDecodeError, ValueError, IndexError):
+        return False
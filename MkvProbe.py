@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Shared probe layer for the MKV tools: returns the parsed `mkvmerge -J` output of a file
+and keeps it in an on-disk SQLite cache so unchanged files are never probed twice.
+The headers are read natively (MkvEbml) when possible, mkvmerge only runs for unusual files.
+
+The cache key is the absolute path + size + mtime (and optionally a hash of the first
+and last MiB of the file). Any change of those values invalidates the entry automatically.
+"""
+
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+import subprocess
+from MkvToolNix import tool_path
+from MkvEbml import read_mkv_info
+
+# Directory from MKVTOOLNIX_DIR (see MkvToolNix)
+MKVMERGE_PATH = tool_path("mkvmerge")
+
+# Cache location, can be overridden with the MKV_PROBE_CACHE environment variable
+CACHE_FILE = os.environ.get(
+    "MKV_PROBE_CACHE",
+    os.path.join(os.path.expanduser("~"), ".mkv_probe_cache.sqlite")
+)
+
+# Also hash the first/last MiB of the file (slower, but detects in-place edits keeping size and mtime)
+HASH_EDGES = os.environ.get("MKV_PROBE_HASH", "0") == "1"
+EDGE_SIZE = 1024 * 1024
+
+# Read the Tracks/Tags natively instead of forking mkvmerge (MKV_PROBE_NATIVE=0 to always run mkvmerge)
+NATIVE_PROBE = os.environ.get("MKV_PROBE_NATIVE", "1") == "1"
+
+_lock = threading.Lock()
+_connection = None
+_stats = {"hits": 0, "misses": 0, "native": 0}
+
+
+def _get_connection():
+    global _connection
+    if _connection is None:
+        _connection = sqlite3.connect(CACHE_FILE, check_same_thread=False)
+        _connection.execute(
+            "CREATE TABLE IF NOT EXISTS probes ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, edge_hash TEXT, info TEXT)"
+        )
+        _connection.commit()
+    return _connection
+
+
+def partial_hash(file_path, edge_size=EDGE_SIZE):
+    """Hash of the first and last `edge_size` bytes of a file (cheap fingerprint for large MKV)."""
+    digest = hashlib.blake2b(digest_size=16)
+    size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        digest.update(f.read(edge_size))
+        if size > edge_size:
+            f.seek(max(size - edge_size, edge_size))
+            digest.update(f.read(edge_size))
+    digest.update(str(size).encode())
+    return digest.hexdigest()
+
+
+def run_mkvmerge_identify(mkv_file):
+    """Run `mkvmerge -J` on a file and return the parsed JSON (no cache)."""
+    result = subprocess.run([MKVMERGE_PATH, '-J', mkv_file], capture_output=True, text=True, check=True, encoding='utf-8')
+    return json.loads(result.stdout)
+
+
+def read_native_info(mkv_file):
+    """Native probe of a file, or None when mkvmerge has to read it (counted in the stats)."""
+    if not NATIVE_PROBE:
+        return None
+    info = read_mkv_info(mkv_file)
+    if info is not None:
+        with _lock:
+            _stats["native"] += 1
+    return info
+
+
+def file_key(mkv_file, use_hash=HASH_EDGES):
+    """Cache key of a file: (absolute path, size, mtime_ns, edge hash or "")."""
+    path = os.path.abspath(mkv_file)
+    stat = os.stat(path)
+    edge_hash = partial_hash(path) if use_hash else ""
+    return path, stat.st_size, stat.st_mtime_ns, edge_hash
+
+
+def get_cached_info(key):
+    """Cached probe for a key from file_key(), or None when the file changed (counted as hit/miss)."""
+    path, size, mtime_ns, edge_hash = key
+    with _lock:
+        row = _get_connection().execute(
+            "SELECT size, mtime_ns, edge_hash, info FROM probes WHERE path = ?", (path,)
+        ).fetchone()
+        if row and row[0] == size and row[1] == mtime_ns and (not edge_hash or row[2] == edge_hash):
+            _stats["hits"] += 1
+            return json.loads(row[3])
+        _stats["misses"] += 1
+    return None
+
+
+def store_info(key, info):
+    """Stores the probe of a file under its key from file_key()."""
+    with _lock:
+        connection = _get_connection()
+        connection.execute(
+            "INSERT OR REPLACE INTO probes (path, size, mtime_ns, edge_hash, info) VALUES (?, ?, ?, ?, ?)",
+            key + (json.dumps(info),)
+        )
+        connection.commit()
+
+
+def get_mkv_info(mkv_file, use_hash=HASH_EDGES):
+    """
+    Return the `mkvmerge -J` information of an MKV file, using the on-disk cache when the file did not change.
+
+    Args:
+        mkv_file (str): Path of the MKV file.
+        use_hash (bool): Also compare a hash of the first/last MiB of the file.
+
+    Returns:
+        dict: The parsed JSON, same shape as `mkvmerge -J`.
+    """
+    key = file_key(mkv_file, use_hash)
+    info = get_cached_info(key)
+    if info is None:
+        info = read_native_info(key[0])
+        if info is None:
+            info = run_mkvmerge_identify(key[0])
+        store_info(key, info)
+    return info
+
+
+def forget(mkv_file):
+    """Drop the cached entry of a file (e.g. after editing it in place)."""
+    with _lock:
+        connection = _get_connection()
+        connection.execute("DELETE FROM probes WHERE path = ?", (os.path.abspath(mkv_file),))
+        connection.commit()
+
+
+def get_probe_stats():
+    with _lock:
+        return dict(_stats)
+
+
+def print_probe_stats():
+    stats = get_probe_stats()
+    total = stats["hits"] + stats["misses"]
+    ratio = (stats["hits"] / total * 100) if total else 0.0
+    print(f"Probe cache: {stats['hits']} hits, {stats['misses']} misses ({ratio:.1f}% hit rate), "
+          f"{stats['native']} read natively")
@@ -0,0 +1,672 @@
+# -*- coding: utf-8 -*-
+"""
+Native remux of a MKV file when only its subtitles change.
+
+Same result as `mkvmerge -o output --no-subtitles --title '' input subtitles.ass... --attach-file
+font...`: the subtitle tracks of the input are replaced by ASS files and fonts are attached. The
+video and audio blocks do not change, so they do not go through user space: the new headers,
+attachments, cluster headers, subtitle blocks, Cues and Tags are written, and the byte ranges of
+the clusters between them are copied by the kernel (os.copy_file_range, which shares the extents
+on filesystems with reflinks, else os.sendfile, else read/write on Windows).
+
+The old subtitle blocks are located through the Cues and each new subtitle block is merged, in
+timestamp order, with the blocks of the cluster holding its start time. The output is checked by
+reading its Cues back (each one must point to a cluster and to a block of its track, each
+subtitle track must have as many blocks as its NUMBER_OF_FRAMES tag) and with `mkvmerge -J`; a
+file with anything unusual, or an output failing the checks, is left to mkvmerge.
+"""
+
+import os
+import json
+import bisect
+import errno
+import subprocess
+
+import MkvEbml
+import MkvProbe
+import DeviceLimits
+from MkvEbml import UnsupportedFile, encode_element, encode_id, encode_uint, encode_vint, iter_elements, read_element_header, read_uint
+from MkvHeaderEdit import EDITABLE, rewrite_entry
+from MkvSubtitleExtract import read_ranges
+
+# MKV_NATIVE_REMUX=0 to always remux with mkvmerge
+NATIVE_REMUX = os.environ.get("MKV_NATIVE_REMUX", "1") == "1"
+
+# Void left after the Tracks element, so the names and languages can later be edited in place
+TRACKS_PADDING = 1024
+# Read at the start of every level 1 element: its header and, for a cluster, the Timestamp following it
+ELEMENT_WINDOW = 64
+# Read at an old subtitle block: BlockGroup, Block, track number and timestamp
+BLOCK_HEADER_WINDOW = 32
+# Read while walking the blocks of a cluster to find where a new subtitle block goes
+BLOCK_WALK_WINDOW = 4096
+# Chunk of the read/write copy, when the kernel cannot copy
+COPY_CHUNK = 1024 * 1024
+# Best first; errors of a method not supported by the system or filesystem switch to the next one
+COPY_METHODS = [method for method in ("copy_file_range", "sendfile") if hasattr(os, method)] + ["read"]
+UNSUPPORTED_COPY_ERRORS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.ENOTSOCK}
+
+EVENT_FORMAT = ["layer", "start", "end", "style", "name", "marginl", "marginr", "marginv", "effect", "text"]
+FONT_MIME_TYPES = {".ttf": "font/ttf", ".otf": "font/otf", ".ttc": "font/collection"}
+SEGMENT_CHILDREN = (MkvEbml.INFO, MkvEbml.TRACKS, MkvEbml.ATTACHMENTS, MkvEbml.CHAPTERS, MkvEbml.CUES, MkvEbml.TAGS)
+
+EBML_HEADER = encode_element(MkvEbml.EBML_HEADER, encode_uint(MkvEbml.EBML_VERSION, 1) + encode_uint(MkvEbml.EBML_READ_VERSION, 1)
+                             + encode_uint(MkvEbml.EBML_MAX_ID_LENGTH, 4) + encode_uint(MkvEbml.EBML_MAX_SIZE_LENGTH, 8)
+                             + encode_element(MkvEbml.DOC_TYPE, b"matroska") + encode_uint(MkvEbml.DOC_TYPE_VERSION, 4)
+                             + encode_uint(MkvEbml.DOC_TYPE_READ_VERSION, 2))
+
+
+def _parse_time(text):
+    """Nanoseconds of an ASS timestamp H:MM:SS.cc."""
+    hours, minutes, seconds = text.strip().split(":")
+    seconds, _, fraction = seconds.partition(".")
+    return ((int(hours) * 60 + int(minutes)) * 60 + int(seconds)) * 1_000_000_000 + int((fraction + "000000000")[:9])
+
+
+def read_ass(subtitle_file):
+    """
+    CodecPrivate and events of an ASS file, as mkvmerge stores them.
+
+    Returns:
+        tuple: (CodecPrivate, [(start ns, end ns, block payload)]) where the payload is
+        "ReadOrder,Layer,Style,Name,MarginL,MarginR,MarginV,Effect,Text".
+    """
+    with open(subtitle_file, encoding="utf-8-sig") as f:
+        lines = f.read().splitlines()
+    header = []
+    events = []
+    section = None
+    event_format = None
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith("[") and stripped.endswith("]"):
+            section = stripped.lower()
+            if section in ("[fonts]", "[graphics]"):
+                # mkvmerge turns them into attachments
+                raise UnsupportedFile(f"{stripped} section")
+            if section == "[events]":
+                continue
+        if section != "[events]":
+            header.append(line)
+        elif stripped.lower().startswith("format:"):
+            event_format = stripped
+        elif stripped.startswith("Dialogue:"):
+            if event_format is None or [field.strip().lower() for field in event_format[7:].split(",")] != EVENT_FORMAT:
+                raise UnsupportedFile(f"events format {event_format!r}")
+            fields = line.lstrip()[len("Dialogue:"):].lstrip().split(",", 9)
+            if len(fields) != 10:
+                raise UnsupportedFile("malformed Dialogue line")
+            payload = ",".join([str(len(events)), fields[0]] + fields[3:])
+            events.append((_parse_time(fields[1]), _parse_time(fields[2]), payload.encode("utf-8")))
+    if event_format is None:
+        raise UnsupportedFile("no [Events] format")
+    while header and not header[-1].strip():
+        header.pop()
+    private = "\r\n".join(header + ["", "[Events]", event_format]) + "\r\n"
+    return private.encode("utf-8"), events
+
+
+def _scan_segment(f, head, file_size):
+    """
+    Level 1 elements of the segment, read header by header.
+
+    Returns:
+        tuple: (segment data start, {element ID: (offset, header length, size)}, clusters as
+        [(offset, header length, size, Timestamp element, timestamp)]).
+    """
+    segment_start, segment_end, _ = MkvEbml.locate_segment(f, head, file_size)
+    elements = {}
+    clusters = []
+    pos = segment_start
+    while pos < segment_end:
+        window = head[pos:pos + ELEMENT_WINDOW] if pos + ELEMENT_WINDOW <= len(head) else MkvEbml.read_at(f, pos, ELEMENT_WINDOW)
+        element_id, size, body = read_element_header(window, 0)
+        if size is None or pos + body + size > segment_end:
+            raise UnsupportedFile(f"element {element_id:#x} of unknown size at {pos}")
+        if element_id == MkvEbml.CLUSTER:
+            timestamp_id, timestamp_size, timestamp_start = read_element_header(window, body)
+            timestamp_end = timestamp_start + timestamp_size
+            if timestamp_id != MkvEbml.CLUSTER_TIMESTAMP or timestamp_end >= len(window) or timestamp_end - body > size:
+                raise UnsupportedFile(f"cluster at {pos} not starting with its Timestamp")
+            if timestamp_end - body < size and read_element_header(window, timestamp_end)[0] not in (MkvEbml.SIMPLE_BLOCK, MkvEbml.BLOCK_GROUP):
+                # Position, PrevSize... would be wrong once the clusters move
+                raise UnsupportedFile(f"cluster at {pos} holding other elements than blocks")
+            clusters.append((pos, body, size, bytes(window[body:timestamp_end]), read_uint(window, timestamp_start, timestamp_end)))
+        elif element_id in SEGMENT_CHILDREN:
+            if element_id in elements:
+                raise UnsupportedFile(f"several elements {element_id:#x}")
+            elements[element_id] = (pos, body, size)
+        elif element_id not in (MkvEbml.SEEK_HEAD, MkvEbml.VOID):
+            raise UnsupportedFile(f"level 1 element {element_id:#x}")
+        pos += body + size
+    return segment_start, elements, clusters
+
+
+def _parse_cues(data):
+    """[(time, [(track number, cluster position, relative position or None, duration or None)])] of the Cues body."""
+    cue_points = []
+    for element_id, start, end in MkvEbml.iter_children(data, 0, len(data)):
+        if element_id != MkvEbml.CUE_POINT:
+            continue
+        time = None
+        positions = []
+        for child_id, child_start, child_end in MkvEbml.iter_children(data, start, end):
+            if child_id == MkvEbml.CUE_TIME:
+                time = read_uint(data, child_start, child_end)
+            elif child_id == MkvEbml.CUE_TRACK_POSITIONS:
+                cue = {cue_id: read_uint(data, s, e) for cue_id, s, e in MkvEbml.iter_children(data, child_start, child_end)}
+                if MkvEbml.CUE_CODEC_STATE in cue or MkvEbml.CUE_REFERENCE in cue:
+                    raise UnsupportedFile("cue with a codec state or references")
+                positions.append((cue[MkvEbml.CUE_TRACK], cue[MkvEbml.CUE_CLUSTER_POSITION],
+                                  cue.get(MkvEbml.CUE_RELATIVE_POSITION), cue.get(MkvEbml.CUE_DURATION)))
+        if time is None:
+            raise UnsupportedFile("cue point without time")
+        cue_points.append((time, positions))
+    return cue_points
+
+
+def _cue_point(time, positions):
+    """CuePoint element of (track number, cluster position, relative position or None, duration or None) positions."""
+    body = encode_uint(MkvEbml.CUE_TIME, time)
+    for track, cluster_position, relative, duration in positions:
+        fields = encode_uint(MkvEbml.CUE_TRACK, track) + encode_uint(MkvEbml.CUE_CLUSTER_POSITION, cluster_position)
+        if relative is not None:
+            fields += encode_uint(MkvEbml.CUE_RELATIVE_POSITION, relative)
+        if duration is not None:
+            fields += encode_uint(MkvEbml.CUE_DURATION, duration)
+        body += encode_element(MkvEbml.CUE_TRACK_POSITIONS, fields)
+    return encode_element(MkvEbml.CUE_POINT, body)
+
+
+def _block_header(window, pos):
+    """
+    (element end, track number, relative timestamp) of the SimpleBlock or BlockGroup at `pos` of a
+    window; the end is a position in the window.
+    """
+    element_id, size, body = read_element_header(window, pos)
+    block_start = body
+    if element_id == MkvEbml.BLOCK_GROUP:
+        child_id, _, block_start = read_element_header(window, body)
+        if child_id != MkvEbml.BLOCK:
+            raise UnsupportedFile("BlockGroup not starting with its Block")
+    elif element_id != MkvEbml.SIMPLE_BLOCK:
+        raise UnsupportedFile(f"element {element_id:#x} instead of a block")
+    if size is None:
+        raise UnsupportedFile("block of unknown size")
+    track, track_length = MkvEbml.read_vint(window, block_start)
+    timestamp_start = block_start + track_length
+    if timestamp_start + 2 > len(window):
+        raise UnsupportedFile("truncated block header")
+    return body + size, track, int.from_bytes(window[timestamp_start:timestamp_start + 2], "big", signed=True)
+
+
+def _block_positions(f, cluster, until):
+    """
+    (position in the cluster body, relative timestamp) of the blocks of a cluster, read header by
+    header up to the first block after the relative timestamp `until`.
+    """
+    offset, header_length, size, timestamp, _ = cluster
+    positions = []
+    pos = len(timestamp)
+    window_start, window = pos, b""
+    while pos < size:
+        if pos + BLOCK_HEADER_WINDOW > window_start + len(window):
+            window_start, window = pos, MkvEbml.read_at(f, offset + header_length + pos, BLOCK_WALK_WINDOW)
+        end, _, relative = _block_header(window, pos - window_start)
+        positions.append((pos, relative))
+        if relative > until:
+            break
+        pos = window_start + end
+    if pos > size:
+        raise UnsupportedFile("block overflowing its cluster")
+    return positions
+
+
+def _kept_ranges(start, end, removed_blocks):
+    """(start, end) ranges of [start, end) outside of the sorted removed blocks."""
+    ranges = []
+    for removed_start, removed_end in removed_blocks:
+        if removed_end <= start:
+            continue
+        if removed_start >= end:
+            break
+        if removed_start > start:
+            ranges.append((start, removed_start))
+        start = removed_end
+    if start < end:
+        ranges.append((start, end))
+    return ranges
+
+
+def _tag_track_uids(data, start, end):
+    return [read_uint(data, s, e) for element_id, child_start, child_end in MkvEbml.iter_children(data, start, end)
+            if element_id == MkvEbml.TARGETS
+            for target_id, s, e in MkvEbml.iter_children(data, child_start, child_end) if target_id == MkvEbml.TAG_TRACK_UID]
+
+
+def _statistics_tag(uid, frames, size, duration):
+    """Tag with the statistics mkvmerge writes for a track (duration in nanoseconds)."""
+    seconds, nanoseconds = divmod(duration, 1_000_000_000)
+    hours, seconds = divmod(seconds, 3600)
+    values = {
+        "BPS": str(size * 8 * 1_000_000_000 // duration if duration else 0),
+        "DURATION": f"{hours:02d}:{seconds // 60:02d}:{seconds % 60:02d}.{nanoseconds:09d}",
+        "NUMBER_OF_FRAMES": str(frames),
+        "NUMBER_OF_BYTES": str(size),
+        "_STATISTICS_TAGS": "BPS DURATION NUMBER_OF_FRAMES NUMBER_OF_BYTES",
+    }
+    targets = encode_element(MkvEbml.TARGETS, encode_uint(MkvEbml.TARGET_TYPE_VALUE, 50) + encode_uint(MkvEbml.TAG_TRACK_UID, uid))
+    simple_tags = b"".join(encode_element(MkvEbml.SIMPLE_TAG, encode_element(MkvEbml.TAG_NAME, name.encode("utf-8"))
+                                         + encode_element(MkvEbml.TAG_STRING, value.encode("utf-8")))
+                           for name, value in values.items())
+    return encode_element(MkvEbml.TAG, targets + simple_tags)
+
+
+def _new_uid():
+    return int.from_bytes(os.urandom(8), "big") >> 1 or 1
+
+
+def _length(piece):
+    return len(piece) if isinstance(piece, bytes) else piece[2]
+
+
+def _plan(f, input_file, subtitles, attachment_files, track_edits):
+    """
+    Output of the remux, as bytes to write and (file, offset, length) ranges to copy.
+
+    Returns:
+        tuple: (pieces, tracks the output must have for `mkvmerge -J`)
+    """
+    file_size = os.fstat(f.fileno()).st_size
+    head = f.read(MkvEbml.HEAD_READ_SIZE)
+    segment_start, elements, clusters = _scan_segment(f, head, file_size)
+    if any(element_id not in elements for element_id in (MkvEbml.INFO, MkvEbml.TRACKS, MkvEbml.CUES)) or not clusters:
+        raise UnsupportedFile("no Info, Tracks, Cues or Cluster")
+    timestamps = [cluster[4] for cluster in clusters]
+    if timestamps != sorted(timestamps):
+        raise UnsupportedFile("clusters out of order")
+    ranges = {element_id: (offset + header_length, size) for element_id, (offset, header_length, size) in elements.items()
+              if element_id in (MkvEbml.INFO, MkvEbml.TRACKS, MkvEbml.CUES, MkvEbml.TAGS)}
+    if any(size > MkvEbml.MAX_ELEMENT_SIZE for _, size in ranges.values()):
+        raise UnsupportedFile("large header element")
+    windows = read_ranges(f, ranges.values())
+    bodies = {element_id: windows[element_range] for element_id, element_range in ranges.items()}
+
+    # Info without the title (--title '') and with a new SegmentUID
+    info = bodies[MkvEbml.INFO]
+    timestamp_scale = 1_000_000
+    info_body = encode_element(MkvEbml.SEGMENT_UID, os.urandom(16))
+    for element_id, element_start, body_start, body_end in iter_elements(info, 0, len(info)):
+        if element_id == MkvEbml.TIMESTAMP_SCALE:
+            timestamp_scale = read_uint(info, body_start, body_end)
+        if element_id not in (MkvEbml.TITLE, MkvEbml.SEGMENT_UID, MkvEbml.VOID, MkvEbml.CRC32):
+            info_body += info[element_start:body_end]
+
+    # Tracks: the subtitle tracks dropped (--no-subtitles), the edits of the others applied, the ASS files added
+    tracks = bodies[MkvEbml.TRACKS]
+    entries = [element for element in iter_elements(tracks, 0, len(tracks)) if element[0] == MkvEbml.TRACK_ENTRY]
+    kept = []
+    numbers = []
+    removed = {}
+    for track_id, (_, element_start, body_start, body_end) in enumerate(entries):
+        values = {element_id: read_uint(tracks, s, e) for element_id, _, s, e in iter_elements(tracks, body_start, body_end)
+                  if element_id in (MkvEbml.TRACK_NUMBER, MkvEbml.TRACK_UID, MkvEbml.TRACK_TYPE)}
+        number, uid, track_type = (values.get(element_id) for element_id in (MkvEbml.TRACK_NUMBER, MkvEbml.TRACK_UID, MkvEbml.TRACK_TYPE))
+        if number is None or uid is None:
+            raise UnsupportedFile("track without number or UID")
+        numbers.append(number)
+        if track_type == 0x11:
+            removed[number] = uid
+        elif track_type in (1, 2):
+            if track_id in track_edits:
+                fields = {EDITABLE[key]: value for key, value in track_edits[track_id].items()}
+                kept.append(encode_element(MkvEbml.TRACK_ENTRY, rewrite_entry(tracks, body_start, body_end, fields)))
+            else:
+                kept.append(bytes(tracks[element_start:body_end]))
+        else:
+            raise UnsupportedFile(f"track type {track_type}")
+
+    new_tracks = []
+    for number, (subtitle_file, properties) in enumerate(subtitles, max(numbers) + 1):
+        private, events = read_ass(subtitle_file)
+        uid = _new_uid()
+        entry = (encode_uint(MkvEbml.TRACK_NUMBER, number) + encode_uint(MkvEbml.TRACK_UID, uid) + encode_uint(MkvEbml.TRACK_TYPE, 0x11)
+                 + encode_uint(MkvEbml.FLAG_DEFAULT, int(properties["default"])) + encode_uint(MkvEbml.FLAG_FORCED, int(properties["forced"]))
+                 + encode_uint(MkvEbml.FLAG_LACING, 0) + encode_element(MkvEbml.LANGUAGE, properties["language"].encode("ascii")))
+        if properties.get("name"):
+            entry += encode_element(MkvEbml.NAME, properties["name"].encode("utf-8"))
+        entry += encode_element(MkvEbml.CODEC_ID, b"S_TEXT/ASS") + encode_element(MkvEbml.CODEC_PRIVATE, private)
+        kept.append(encode_element(MkvEbml.TRACK_ENTRY, entry))
+        new_tracks.append((number, uid, events))
+    tracks_body = b"".join(kept)
+    expected = MkvEbml.parse_tracks(tracks_body)
+
+    # Old subtitle blocks, all referenced by the Cues (checked against their NUMBER_OF_FRAMES tag)
+    cue_points = _parse_cues(bodies[MkvEbml.CUES])
+    track_tags = MkvEbml.parse_track_tags(bodies[MkvEbml.TAGS]) if MkvEbml.TAGS in bodies else {}
+    cluster_index = {offset - segment_start: index for index, (offset, *_) in enumerate(clusters)}
+    old_blocks = {}
+    for _, positions in cue_points:
+        for track, cluster_position, relative, _ in positions:
+            if track in removed:
+                if relative is None or cluster_position not in cluster_index:
+                    raise UnsupportedFile(f"subtitle cue of track {track} without a block position")
+                old_blocks.setdefault(track, set()).add((cluster_index[cluster_position], relative))
+    for number, uid in removed.items():
+        frames = track_tags.get(uid, {}).get("NUMBER_OF_FRAMES")
+        if frames is None or int(frames) != len(old_blocks.get(number, ())):
+            raise UnsupportedFile(f"the Cues do not reference every block of track {number}")
+    located = {(index, relative, track) for track, blocks in old_blocks.items() for index, relative in blocks}
+    block_offsets = {(index, relative): clusters[index][0] + clusters[index][1] + relative for index, relative, _ in located}
+    windows = read_ranges(f, [(offset, BLOCK_HEADER_WINDOW) for offset in block_offsets.values()])
+    removed_ranges = [[] for _ in clusters]
+    for index, relative, track in located:
+        end, block_track, _ = _block_header(windows[(block_offsets[(index, relative)], BLOCK_HEADER_WINDOW)], 0)
+        if block_track != track:
+            raise UnsupportedFile("the Cues point to a block of another track")
+        if relative < len(clusters[index][3]) or relative + end > clusters[index][2]:
+            raise UnsupportedFile("subtitle block outside of its cluster")
+        removed_ranges[index].append((relative, relative + end))
+
+    # New subtitle blocks, in the cluster holding their start time
+    inserted = [[] for _ in clusters]
+    statistics = []
+    for number, uid, events in new_tracks:
+        for start, end, payload in events:
+            time = (start + timestamp_scale // 2) // timestamp_scale
+            duration = max(0, (end + timestamp_scale // 2) // timestamp_scale - time)
+            index = max(0, bisect.bisect_right(timestamps, time) - 1)
+            relative = time - timestamps[index]
+            if time < 0 or not -32768 <= relative <= 32767:
+                raise UnsupportedFile(f"subtitle at {time} too far from a cluster")
+            block = encode_element(MkvEbml.BLOCK, encode_vint(number) + relative.to_bytes(2, "big", signed=True) + b"\0" + payload)
+            group = encode_element(MkvEbml.BLOCK_GROUP, block + encode_uint(MkvEbml.BLOCK_DURATION, duration))
+            inserted[index].append((time, number, group, duration))
+        first = min((start for start, _, _ in events), default=0)
+        last = max((end for _, end, _ in events), default=0)
+        statistics.append(_statistics_tag(uid, len(events), sum(len(payload) for _, _, payload in events), max(0, last - first)))
+
+    # Header elements; the SeekHead positions are written on 8 bytes so its size is known before them
+    tracks_element = encode_element(MkvEbml.TRACKS, tracks_body) + MkvEbml.void_element(TRACKS_PADDING)
+    info_element = encode_element(MkvEbml.INFO, info_body)
+    attachments = []
+    if attachment_files or MkvEbml.ATTACHMENTS in elements:
+        if MkvEbml.ATTACHMENTS in elements:
+            offset, header_length, size = elements[MkvEbml.ATTACHMENTS]
+            attachments.append((input_file, offset + header_length, size))
+        for attachment_file in attachment_files:
+            name = os.path.basename(attachment_file)
+            mime_type = FONT_MIME_TYPES.get(os.path.splitext(name)[1].lower(), "application/octet-stream")
+            size = os.path.getsize(attachment_file)
+            fields = (encode_element(MkvEbml.FILE_NAME, name.encode("utf-8")) + encode_element(MkvEbml.FILE_MIME_TYPE, mime_type.encode("ascii"))
+                      + encode_uint(MkvEbml.FILE_UID, _new_uid()) + encode_id(MkvEbml.FILE_DATA) + encode_vint(size))
+            attachments.append(encode_id(MkvEbml.ATTACHED_FILE) + encode_vint(len(fields) + size) + fields)
+            attachments.append((attachment_file, 0, size))
+        attachments.insert(0, encode_id(MkvEbml.ATTACHMENTS) + encode_vint(sum(_length(piece) for piece in attachments)))
+    chapters = []
+    if MkvEbml.CHAPTERS in elements:
+        offset, header_length, size = elements[MkvEbml.CHAPTERS]
+        chapters.append((input_file, offset, header_length + size))
+    seek_ids = [MkvEbml.INFO, MkvEbml.TRACKS] + [MkvEbml.ATTACHMENTS] * bool(attachments) + [MkvEbml.CHAPTERS] * bool(chapters)
+    seek_ids += [MkvEbml.CUES, MkvEbml.TAGS]
+
+    def seek_head(positions):
+        return encode_element(MkvEbml.SEEK_HEAD, b"".join(
+            encode_element(MkvEbml.SEEK, encode_element(MkvEbml.SEEK_ID, encode_id(element_id))
+                           + encode_element(MkvEbml.SEEK_POSITION, positions.get(element_id, 0).to_bytes(8, "big")))
+            for element_id in seek_ids))
+
+    positions = {}
+    pos = len(seek_head(positions))
+    for element_id, pieces in ((MkvEbml.INFO, [info_element]), (MkvEbml.TRACKS, [tracks_element]),
+                               (MkvEbml.ATTACHMENTS, attachments), (MkvEbml.CHAPTERS, chapters)):
+        positions[element_id] = pos
+        pos += sum(_length(piece) for piece in pieces)
+
+    # Clusters: the old content without the subtitle blocks, the new subtitle blocks inserted before
+    # the first block with a later timestamp (blocks of the same time in track order)
+    cluster_pieces = []
+    cluster_positions = []
+    shifts = []
+    new_cues = []
+    for index, cluster in enumerate(clusters):
+        offset, header_length, size, timestamp, cluster_time = cluster
+        removed_blocks = sorted(removed_ranges[index])
+        if any(next_start < end for (_, end), (next_start, _) in zip(removed_blocks, removed_blocks[1:])):
+            raise UnsupportedFile("overlapping subtitle blocks")
+        insertions = []
+        blocks = sorted(inserted[index], key=lambda block: block[:2])
+        if blocks:
+            block_positions = _block_positions(f, cluster, blocks[-1][0] - cluster_time)
+            for time, number, group, duration in blocks:
+                at = next((position for position, relative in block_positions if relative > time - cluster_time), size)
+                insertions.append((at, time, number, group, duration))
+            insertions.sort(key=lambda insertion: insertion[0])
+        body = [timestamp]
+        body_size = len(timestamp)
+        start = len(timestamp)
+        for at, time, number, group, duration in insertions + [(size, None, None, None, None)]:
+            for kept_start, kept_end in _kept_ranges(start, at, removed_blocks):
+                body.append((input_file, offset + header_length + kept_start, kept_end - kept_start))
+                body_size += kept_end - kept_start
+            start = max(start, at)
+            if group is not None:
+                new_cues.append((time, [(number, pos, body_size, duration)]))
+                body.append(group)
+                body_size += len(group)
+        cluster_pieces.append(encode_id(MkvEbml.CLUSTER) + encode_vint(body_size, 8))
+        cluster_pieces.extend(body)
+        cluster_positions.append(pos)
+        shifts.append(([(at, len(group)) for at, _, _, group, _ in insertions], removed_blocks))
+        pos += 12 + body_size
+
+    def new_relative(index, relative):
+        insertions, removed_blocks = shifts[index]
+        if any(start <= relative < end for start, end in removed_blocks):
+            raise UnsupportedFile("cue pointing inside a subtitle block")
+        # A block inserted at the position of a kept block goes before it
+        return (relative + sum(length for at, length in insertions if at <= relative)
+                - sum(end - start for start, end in removed_blocks if end <= relative))
+
+    # Cues of the kept tracks moved with their clusters, plus one per new subtitle block
+    cue_elements = []
+    for time, cue_positions in cue_points:
+        moved = []
+        for track, cluster_position, relative, duration in cue_positions:
+            if track in removed:
+                continue
+            if cluster_position not in cluster_index:
+                raise UnsupportedFile(f"cue of track {track} outside of a cluster")
+            index = cluster_index[cluster_position]
+            moved.append((track, cluster_positions[index], None if relative is None else new_relative(index, relative), duration))
+        if moved:
+            cue_elements.append((time, 0, _cue_point(time, moved)))
+    cue_elements += [(time, 1, _cue_point(time, cue_positions)) for time, cue_positions in new_cues]
+    cue_elements.sort(key=lambda cue: cue[:2])
+    cues_element = encode_element(MkvEbml.CUES, b"".join(cue for _, _, cue in cue_elements))
+    positions[MkvEbml.CUES] = pos
+    pos += len(cues_element)
+
+    # Tags of the removed tracks dropped, statistics of the new ones added
+    tags_body = b""
+    if MkvEbml.TAGS in bodies:
+        tags = bodies[MkvEbml.TAGS]
+        for element_id, element_start, body_start, body_end in iter_elements(tags, 0, len(tags)):
+            uids = _tag_track_uids(tags, body_start, body_end)
+            if element_id == MkvEbml.TAG and not (uids and all(uid in removed.values() for uid in uids)):
+                tags_body += tags[element_start:body_end]
+    tags_element = encode_element(MkvEbml.TAGS, tags_body + b"".join(statistics))
+    positions[MkvEbml.TAGS] = pos
+    pos += len(tags_element)
+
+    pieces = [EBML_HEADER + encode_id(MkvEbml.SEGMENT) + encode_vint(pos, 8) + seek_head(positions), info_element, tracks_element]
+    pieces += attachments + chapters + cluster_pieces + [cues_element, tags_element]
+    return pieces, expected
+
+
+def _write_all(descriptor, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(descriptor, view):]
+    return len(data)
+
+
+def _copy_range(method, source, destination, offset, length):
+    """
+    Copies `length` bytes of `source` from `offset` at the position of `destination` (file descriptors).
+
+    Returns:
+        str: The copy method that worked, the next copies start with it.
+    """
+    while length > 0:
+        try:
+            if method == "copy_file_range":
+                copied = os.copy_file_range(source, destination, length, offset)
+            elif method == "sendfile":
+                copied = os.sendfile(destination, source, offset, length)
+            else:
+                os.lseek(source, offset, os.SEEK_SET)
+                copied = _write_all(destination, os.read(source, min(length, COPY_CHUNK)))
+        except OSError as e:
+            if method == "read" or e.errno not in UNSUPPORTED_COPY_ERRORS:
+                raise
+            method = COPY_METHODS[COPY_METHODS.index(method) + 1]
+            continue
+        if copied == 0:
+            raise UnsupportedFile("input shorter than its elements")
+        offset += copied
+        length -= copied
+    return method
+
+
+def _write_pieces(pieces, destination):
+    """Writes the bytes and copies the (file, offset, length) ranges of the plan, in order."""
+    method = COPY_METHODS[0]
+    sources = {}
+    pending = []
+    try:
+        for piece in pieces:
+            if isinstance(piece, bytes):
+                pending.append(piece)
+                continue
+            if pending:
+                _write_all(destination, b"".join(pending))
+                pending = []
+            source, offset, length = piece
+            if source not in sources:
+                sources[source] = os.open(source, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+            method = _copy_range(method, sources[source], destination, offset, length)
+        if pending:
+            _write_all(destination, b"".join(pending))
+    finally:
+        for descriptor in sources.values():
+            os.close(descriptor)
+
+
+def _summary(track):
+    properties = track["properties"]
+    return (track["type"], properties.get("number"), properties.get("codec_id"), properties.get("language"),
+            properties.get("track_name"), properties.get("default_track"), properties.get("forced_track"))
+
+
+def _cues_match_blocks(output_file):
+    """
+    True when every cue of the output points to a cluster (and, with a relative position, to a
+    block of its track at the cue time) and every subtitle track has as many blocks in the Cues as
+    its NUMBER_OF_FRAMES tag.
+    """
+    with open(output_file, "rb") as f:
+        head = f.read(MkvEbml.HEAD_READ_SIZE)
+        segment_start, elements, clusters = _scan_segment(f, head, os.fstat(f.fileno()).st_size)
+        if any(element_id not in elements for element_id in (MkvEbml.TRACKS, MkvEbml.CUES, MkvEbml.TAGS)):
+            return False
+        ranges = {element_id: (elements[element_id][0] + elements[element_id][1], elements[element_id][2])
+                  for element_id in (MkvEbml.TRACKS, MkvEbml.CUES, MkvEbml.TAGS)}
+        windows = read_ranges(f, ranges.values())
+        bodies = {element_id: windows[element_range] for element_id, element_range in ranges.items()}
+        clusters_by_position = {cluster[0] - segment_start: cluster for cluster in clusters}
+        block_cues = []
+        for time, positions in _parse_cues(bodies[MkvEbml.CUES]):
+            for track, cluster_position, relative, _ in positions:
+                if cluster_position not in clusters_by_position:
+                    return False
+                if relative is not None:
+                    cluster = clusters_by_position[cluster_position]
+                    block_cues.append((time, track, cluster, cluster[0] + cluster[1] + relative))
+        windows = read_ranges(f, [(block_offset, BLOCK_HEADER_WINDOW) for _, _, _, block_offset in block_cues])
+    blocks = {}
+    for time, track, cluster, block_offset in block_cues:
+        _, block_track, relative = _block_header(windows[(block_offset, BLOCK_HEADER_WINDOW)], 0)
+        if block_track != track or cluster[4] + relative != time:
+            return False
+        blocks.setdefault(track, set()).add(block_offset)
+    tags = MkvEbml.parse_track_tags(bodies[MkvEbml.TAGS])
+    tracks = bodies[MkvEbml.TRACKS]
+    for element_id, _, body_start, body_end in iter_elements(tracks, 0, len(tracks)):
+        if element_id != MkvEbml.TRACK_ENTRY:
+            continue
+        values = {element_id: read_uint(tracks, s, e) for element_id, _, s, e in iter_elements(tracks, body_start, body_end)
+                  if element_id in (MkvEbml.TRACK_NUMBER, MkvEbml.TRACK_UID, MkvEbml.TRACK_TYPE)}
+        if values.get(MkvEbml.TRACK_TYPE) == 0x11:
+            frames = tags.get(values.get(MkvEbml.TRACK_UID), {}).get("NUMBER_OF_FRAMES")
+            if frames is None or int(frames) != len(blocks.get(values.get(MkvEbml.TRACK_NUMBER), ())):
+                return False
+    return True
+
+
+def _identify(output_file):
+    """`mkvmerge -J` of the output, run through DeviceLimits so its CPU time counts in the mux stage."""
+    # No disk slot: the caller of remux_subtitles already holds them
+    result = DeviceLimits.run_limited([MkvProbe.MKVMERGE_PATH, "-J", output_file], stdout=subprocess.PIPE,
+                                      text=True, encoding="utf-8")
+    return json.loads(result.stdout)
+
+
+def _check(output_file, expected):
+    """True when the Cues of the output match its blocks and `mkvmerge -J` reads it without error with the expected tracks."""
+    if not _cues_match_blocks(output_file):
+        return False
+    try:
+        info = _identify(output_file)
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return False
+    if not info.get("container", {}).get("recognized") or info.get("errors"):
+        return False
+    return [_summary(track) for track in info.get("tracks", [])] == [_summary(track) for track in expected]
+
+
+def remux_subtitles(input_file, output_file, subtitles, attachment_files=(), track_edits=None):
+    """
+    Writes `output_file`: `input_file` with its subtitle tracks replaced, without mkvmerge.
+
+    Args:
+        input_file (str): Source MKV file.
+        output_file (str): MKV file to write.
+        subtitles (list): [(ASS file, {"name", "language", "default", "forced"})] in track order.
+        attachment_files (list): Files to attach (fonts).
+        track_edits (dict): {mkvmerge track id: {"name": ..., "language": ...}} for the kept tracks.
+
+    Returns:
+        bool: True when the output was written and checked, False when mkvmerge has to do the
+        remux (nothing is left at `output_file`).
+    """
+    if not NATIVE_REMUX:
+        return False
+    # Written next to the output and renamed once checked, with the permissions mkvmerge would give it
+    partial_file = output_file + ".part"
+    try:
+        with open(input_file, "rb") as f:
+            pieces, expected = _plan(f, input_file, subtitles, attachment_files, track_edits or {})
+        descriptor = os.open(partial_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o666)
+        try:
+            _write_pieces(pieces, descriptor)
+        finally:
+            os.close(descriptor)
+        if not _check(partial_file, expected):
+            raise UnsupportedFile("the output fails the Cues or mkvmerge -J check")
+        os.replace(partial_file, output_file)
+        return True
+    except (UnsupportedFile, OSError, UnicodeDecodeError, ValueError, KeyError, IndexError):
+        if os.path.exists(partial_file):
+            os.remove(partial_file)
+        return False
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+Native extraction of the ASS subtitle tracks of a MKV file.
+
+The Cues give the cluster and the position in the cluster of every subtitle block, so only
+those blocks are read (close ranges merged in one positioned read) instead of the whole file
+as mkvextract does. The ASS file is rebuilt from the CodecPrivate (script header and styles)
+and the block payloads sorted by ReadOrder, like mkvextract writes it.
+
+A track is left to mkvextract when the Cues do not reference all of its blocks (checked
+against its NUMBER_OF_FRAMES statistics tag), or when it uses lacing, encryption, SimpleBlocks
+or a codec other than ASS.
+"""
+
+import os
+import zlib
+
+import MkvEbml
+from MkvEbml import UnsupportedFile, iter_children, read_element, read_element_header, read_uint, read_vint
+
+# MKV_NATIVE_EXTRACT=0 to always run mkvextract
+NATIVE_EXTRACT = os.environ.get("MKV_NATIVE_EXTRACT", "1") == "1"
+
+# Ranges closer than this are read in a single call, the gap is read and dropped
+MERGE_GAP = 64 * 1024
+# First read of a cluster (header and Timestamp) and of a block (usually the whole subtitle block)
+CLUSTER_WINDOW = 32
+BLOCK_WINDOW = 4096
+
+EVENTS_HEADER = "[Events]\nFormat: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\n"
+
+
+def read_ranges(f, ranges, stats=None):
+    """
+    Reads the (offset, length) ranges of a file, the close ones with a single positioned read.
+
+    Args:
+        stats (dict): "bytes_read" is increased by the bytes actually read (gaps included).
+
+    Returns:
+        dict: {(offset, length): bytes}, shorter than asked at the end of the file.
+    """
+    results = {}
+    ordered = sorted(set(ranges))
+    i = 0
+    while i < len(ordered):
+        start, end = ordered[i][0], ordered[i][0] + ordered[i][1]
+        group = [ordered[i]]
+        i += 1
+        while i < len(ordered) and ordered[i][0] <= end + MERGE_GAP:
+            group.append(ordered[i])
+            end = max(end, ordered[i][0] + ordered[i][1])
+            i += 1
+        data = MkvEbml.read_at(f, start, end - start)
+        if stats is not None:
+            stats["bytes_read"] = stats.get("bytes_read", 0) + len(data)
+        for offset, length in group:
+            results[(offset, length)] = data[offset - start:offset - start + length]
+    return results
+
+
+def _children(data, start, end):
+    """{element ID: (body start, body end)} of the first occurrence of each child."""
+    children = {}
+    for element_id, child_start, child_end in iter_children(data, start, end):
+        children.setdefault(element_id, (child_start, child_end))
+    return children
+
+
+def _content_encoding(data, start, end):
+    """
+    (decode function, scope) of the ContentEncodings of a track.
+    Only a single zlib or header stripping compression is handled.
+    """
+    encodings = [(s, e) for element_id, s, e in iter_children(data, start, end) if element_id == MkvEbml.CONTENT_ENCODING]
+    if len(encodings) != 1:
+        raise UnsupportedFile("several content encodings")
+    encoding = _children(data, *encodings[0])
+    if MkvEbml.CONTENT_ENCODING_TYPE in encoding and read_uint(data, *encoding[MkvEbml.CONTENT_ENCODING_TYPE]) != 0:
+        raise UnsupportedFile("encrypted track")
+    scope = read_uint(data, *encoding[MkvEbml.CONTENT_ENCODING_SCOPE]) if MkvEbml.CONTENT_ENCODING_SCOPE in encoding else 1
+    if MkvEbml.CONTENT_COMPRESSION not in encoding:
+        raise UnsupportedFile("content encoding without compression")
+    compression = _children(data, *encoding[MkvEbml.CONTENT_COMPRESSION])
+    algorithm = read_uint(data, *compression[MkvEbml.CONTENT_COMP_ALGO]) if MkvEbml.CONTENT_COMP_ALGO in compression else 0
+    if algorithm == 0:
+        return zlib.decompress, scope
+    if algorithm == 3:
+        stripped = bytes(data[slice(*compression[MkvEbml.CONTENT_COMP_SETTINGS])]) if MkvEbml.CONTENT_COMP_SETTINGS in compression else b""
+        return lambda payload: stripped + payload, scope
+    raise UnsupportedFile(f"compression algorithm {algorithm}")
+
+
+def _track_entries(data):
+    """(track number, codec ID, CodecPrivate, decode function or None) of every TrackEntry, in file order."""
+    entries = []
+    for element_id, start, end in iter_children(data, 0, len(data)):
+        if element_id != MkvEbml.TRACK_ENTRY:
+            continue
+        children = _children(data, start, end)
+        codec_id = MkvEbml.read_string(data, *children[MkvEbml.CODEC_ID]) if MkvEbml.CODEC_ID in children else None
+        decode, scope = None, 0
+        private = bytes(data[slice(*children[MkvEbml.CODEC_PRIVATE])]) if MkvEbml.CODEC_PRIVATE in children else b""
+        if MkvEbml.CONTENT_ENCODINGS in children:
+            try:
+                decode, scope = _content_encoding(data, *children[MkvEbml.CONTENT_ENCODINGS])
+            except UnsupportedFile:
+                codec_id = None
+        if decode is not None and scope & 2 and private:
+            private = decode(private)
+        entries.append((read_uint(data, *children[MkvEbml.TRACK_NUMBER]), codec_id, private,
+                        decode if scope & 1 else None))
+    return entries
+
+
+def _cue_positions(data):
+    """{track number: {(cluster position, relative position or None)}} of the Cues element body."""
+    positions = {}
+    for element_id, start, end in iter_children(data, 0, len(data)):
+        if element_id != MkvEbml.CUE_POINT:
+            continue
+        for child_id, child_start, child_end in iter_children(data, start, end):
+            if child_id != MkvEbml.CUE_TRACK_POSITIONS:
+                continue
+            cue = _children(data, child_start, child_end)
+            if MkvEbml.CUE_TRACK not in cue or MkvEbml.CUE_CLUSTER_POSITION not in cue:
+                continue
+            relative = read_uint(data, *cue[MkvEbml.CUE_RELATIVE_POSITION]) if MkvEbml.CUE_RELATIVE_POSITION in cue else None
+            positions.setdefault(read_uint(data, *cue[MkvEbml.CUE_TRACK]), set()).add(
+                (read_uint(data, *cue[MkvEbml.CUE_CLUSTER_POSITION]), relative))
+    return positions
+
+
+def _parse_block(data, track_number, decode):
+    """(relative timestamp, BlockDuration, payload) of a BlockGroup body."""
+    group = _children(data, 0, len(data))
+    if MkvEbml.BLOCK not in group or MkvEbml.BLOCK_DURATION not in group:
+        raise UnsupportedFile("block without duration")
+    start, end = group[MkvEbml.BLOCK]
+    number, length = read_vint(data, start)
+    if number != track_number:
+        raise UnsupportedFile("the Cues point to a block of another track")
+    relative = int.from_bytes(data[start + length:start + length + 2], "big", signed=True)
+    flags = data[start + length + 2]
+    if flags & 0x06:
+        raise UnsupportedFile("laced subtitle block")
+    payload = bytes(data[start + length + 3:end])
+    return relative, read_uint(data, *group[MkvEbml.BLOCK_DURATION]), decode(payload) if decode else payload
+
+
+def format_timestamp(nanoseconds):
+    """ASS timestamp H:MM:SS.cc of a time in nanoseconds (rounded to the centisecond)."""
+    centiseconds = (nanoseconds + 5_000_000) // 10_000_000
+    hours, rest = divmod(centiseconds, 360000)
+    minutes, rest = divmod(rest, 6000)
+    seconds, centis = divmod(rest, 100)
+    return f"{hours}:{minutes:02d}:{seconds:02d}.{centis:02d}"
+
+
+def write_ass(output_file, private, events):
+    """Writes the CodecPrivate and the (ReadOrder, start ns, end ns, payload) events as an ASS file."""
+    header = private.decode("utf-8-sig")
+    newline = "\r\n" if "\r\n" in header else "\n"
+    if not header.endswith("\n"):
+        header += newline
+    if "[Events]" not in header:
+        header += newline + EVENTS_HEADER.replace("\n", newline)
+    lines = []
+    for read_order, start, end, payload in sorted(events, key=lambda event: event[0]):
+        fields = payload.decode("utf-8").split(",", 8)
+        if len(fields) != 9:
+            raise UnsupportedFile("malformed ASS block")
+        layer, rest = fields[1], ",".join(fields[2:])
+        lines.append(f"Dialogue: {layer},{format_timestamp(start)},{format_timestamp(end)},{rest}{newline}")
+    with open(output_file, "w", encoding="utf-8-sig", newline="") as f:
+        f.write(header + "".join(lines))
+
+
+def extract_ass_tracks(mkv_file, outputs, tracks_info, stats=None):
+    """
+    Writes the ASS tracks {mkvmerge track id: output file} of a MKV file, reading only their blocks.
+
+    Args:
+        mkv_file (str): Path of the MKV file.
+        outputs (dict): Output file of each track id (ids of `mkvmerge -J`).
+        tracks_info (dict): Probe of the file (for the NUMBER_OF_FRAMES statistics).
+        stats (dict): "bytes_read" is increased by the bytes read from the MKV file.
+
+    Returns:
+        list: Ids of the tracks not extracted, to give to mkvextract.
+    """
+    if not NATIVE_EXTRACT or not outputs:
+        return list(outputs)
+    if stats is None:
+        stats = {}
+    try:
+        with open(mkv_file, "rb") as f:
+            return _extract(f, outputs, tracks_info, stats)
+    except (UnsupportedFile, OSError, UnicodeDecodeError, zlib.error, IndexError, KeyError, ValueError):
+        return list(outputs)
+
+
+def _extract(f, outputs, tracks_info, stats):
+    file_size = os.fstat(f.fileno()).st_size
+    head = f.read(MkvEbml.HEAD_READ_SIZE)
+    stats["bytes_read"] = stats.get("bytes_read", 0) + len(head)
+    segment_start, segment_end, positions = MkvEbml.locate_segment(f, head, file_size)
+    if MkvEbml.CUES not in positions or MkvEbml.TRACKS not in positions:
+        raise UnsupportedFile("no Cues")
+
+    def element(element_id):
+        data = read_element(f, positions[element_id], element_id, segment_end, head)
+        if positions[element_id] + MkvEbml.MAX_HEADER_SIZE + len(data) > len(head):
+            stats["bytes_read"] += len(data)
+        return data
+
+    timestamp_scale = 1_000_000
+    if MkvEbml.INFO in positions:
+        info = element(MkvEbml.INFO)
+        for element_id, start, end in iter_children(info, 0, len(info)):
+            if element_id == MkvEbml.TIMESTAMP_SCALE:
+                timestamp_scale = read_uint(info, start, end)
+    entries = _track_entries(element(MkvEbml.TRACKS))
+    cues = _cue_positions(element(MkvEbml.CUES))
+    probed = {track["id"]: track["properties"] for track in tracks_info["tracks"]}
+
+    left = []
+    selected = {}
+    for track_id in outputs:
+        number, codec_id, private, decode = entries[track_id] if track_id < len(entries) else (None, None, b"", None)
+        properties = probed.get(track_id, {})
+        blocks = cues.get(number, set())
+        frames = properties.get("tag_number_of_frames")
+        if (codec_id != "S_TEXT/ASS" or properties.get("number") != number or frames is None
+                or len(blocks) != int(frames) or any(relative is None for _, relative in blocks)):
+            left.append(track_id)
+            continue
+        selected[track_id] = (number, private, decode, blocks)
+
+    # Cluster headers: start of the data and timestamp of every cluster holding a selected block
+    cluster_offsets = {segment_start + cluster for *_, blocks in selected.values() for cluster, _ in blocks}
+    windows = read_ranges(f, [(offset, CLUSTER_WINDOW) for offset in cluster_offsets], stats)
+    clusters = {}
+    for offset in cluster_offsets:
+        data = windows[(offset, CLUSTER_WINDOW)]
+        element_id, _, body = read_element_header(data, 0)
+        timestamp_id, size, timestamp_start = read_element_header(data, body)
+        if element_id != MkvEbml.CLUSTER or timestamp_id != MkvEbml.CLUSTER_TIMESTAMP or timestamp_start + size > len(data):
+            raise UnsupportedFile(f"no cluster timestamp at {offset}")
+        clusters[offset] = (offset + body, read_uint(data, timestamp_start, timestamp_start + size))
+
+    # Blocks: a first window, then the rest of the few blocks larger than it
+    located = {offset: clusters[segment_start + cluster][1] for *_, blocks in selected.values()
+               for cluster, relative in blocks for offset in [clusters[segment_start + cluster][0] + relative]}
+    ranges = {offset: (offset, min(BLOCK_WINDOW, segment_end - offset)) for offset in located}
+    windows = read_ranges(f, ranges.values(), stats)
+    block_data = {}
+    larger = {}
+    for offset, window in ranges.items():
+        data = windows[window]
+        element_id, size, body = read_element_header(data, 0)
+        if element_id != MkvEbml.BLOCK_GROUP or size is None:
+            block_data[offset] = None
+        elif body + size <= len(data):
+            block_data[offset] = data[body:body + size]
+        else:
+            larger[offset] = (offset + body, size)
+    windows = read_ranges(f, larger.values(), stats)
+    for offset, block_range in larger.items():
+        block_data[offset] = windows[block_range]
+
+    for track_id, (number, private, decode, blocks) in selected.items():
+        try:
+            events = []
+            for cluster, relative in blocks:
+                offset = clusters[segment_start + cluster][0] + relative
+                if block_data[offset] is None:
+                    raise UnsupportedFile(f"no BlockGroup at {offset}")
+                relative_timestamp, duration, payload = _parse_block(block_data[offset], number, decode)
+                start = (located[offset] + relative_timestamp) * timestamp_scale
+                events.append((int(payload.split(b",", 1)[0]), start, start + duration * timestamp_scale, payload))
+            write_ass(outputs[track_id], private, events)
+        except (UnsupportedFile, UnicodeDecodeError, zlib.error, IndexError, ValueError):
+            left.append(track_id)
+    return left
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""
+Location of the MKVToolNix executables.
+
+The directory comes from the MKVTOOLNIX_DIR environment variable. Without it, the default
+installation directory is used on Windows and the tools are looked up in the PATH elsewhere.
+"""
+
+import os
+import shutil
+
+DEFAULT_WINDOWS_DIR = r"C:\Program Files\MKVToolNix"
+
+
+def tool_path(name):
+    """Path of mkvmerge, mkvextract or mkvpropedit."""
+    directory = os.environ.get("MKVTOOLNIX_DIR")
+    if directory is None:
+        if os.name != "nt":
+            return shutil.which(name) or name
+        directory = DEFAULT_WINDOWS_DIR
+    candidates = [name + ".exe", name + ".cmd", name + ".bat"] if os.name == "nt" else [name]
+    for candidate in candidates:
+        path = os.path.join(directory, candidate)
+        if os.path.isfile(path):
+            return path
+    return os.path.join(directory, candidates[0])
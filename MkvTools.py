@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Command-line entry point of the MKV tools, usable headless (cron, transcode box).
+
+    python MkvTools.py mux "D:/Anime/Season 1" "E:/Films/*.mkv"
+    python MkvTools.py mux-fr --mux-workers 2 /srv/library/Show
+    python MkvTools.py mux --target default --target fr /srv/library/Show
+    python MkvTools.py rename-audio --asyncio "/srv/library/*"
+    python MkvTools.py rename-subs --parallel /srv/library/Show
+    python MkvTools.py make-forced --dry-run /srv/library/Show/Output/Sous-titres
+    python MkvTools.py mux --gui
+
+Arguments are directories, files or glob patterns. Each subcommand only imports the tool it
+runs: Tk is loaded with --gui only and pysubs2 only by the restyle stage of the muxing.
+"""
+
+import os
+import sys
+import glob
+import time
+import argparse
+import functools
+import importlib
+
+_START = time.perf_counter()
+
+
+def expand_targets(patterns, extension):
+    """
+    Expands directory, file and glob arguments.
+
+    Returns:
+        dict: {directory: None for the whole directory, or the list of selected files}
+    """
+    targets = {}
+    for pattern in patterns:
+        matches = glob.glob(pattern) if any(c in pattern for c in "*?[") else [pattern]
+        if not matches:
+            print(f"No match for {pattern}")
+        for path in sorted(matches):
+            path = os.path.abspath(path)
+            if os.path.isdir(path):
+                targets[path] = None
+            elif os.path.isfile(path) and path.lower().endswith(extension):
+                directory = os.path.dirname(path)
+                if directory not in targets:
+                    targets[directory] = []
+                if targets[directory] is not None:
+                    targets[directory].append(path)
+            else:
+                print(f"Skipped {path}")
+    return targets
+
+
+def get_targets(args, module, extension, select_folder="select_mkv_folder"):
+    if args.gui or not args.paths:
+        if not args.gui:
+            sys.exit("No directory given (pass paths, globs or --gui)")
+        directory = getattr(module, select_folder)()
+        return {directory: None} if directory else {}
+    return expand_targets(args.paths, extension)
+
+
+def report_first_job():
+    """Prints the startup cost (interpreter excluded) once, before the first job starts."""
+    if not getattr(report_first_job, "done", False):
+        report_first_job.done = True
+        print(f"Time to first job: {(time.perf_counter() - _START) * 1000:.1f} ms")
+
+
+def workers_type(value):
+    return value if value == "auto" else int(value)
+
+
+def run_mux(args, module_name):
+    module = importlib.import_module(module_name)
+    # mux-fr runs the same pipeline with the fr output profile only
+    options = {"subtitles_in_ram": args.subtitles_in_ram, "ram_limit": args.ram_limit * 1024 * 1024,
+               "keep_subtitles": args.keep_subtitles, "order": None if args.order == "listed" else args.order,
+               "dry_run": args.dry_run, "report": not args.no_report, "prometheus_file": args.prometheus_file,
+               "trace_file": args.trace_file, "verbosity": args.verbosity, "log_to_file": not args.no_log_file}
+    if module_name == "MuxingNoPlayRes" and args.targets:
+        options["targets"] = tuple(args.targets)
+    for directory, mkv_files in get_targets(args, module, ".mkv").items():
+        report_first_job()
+        module.process_all_mkv_files_in_directory(
+            directory,
+            extract_workers=args.extract_workers,
+            restyle_workers=args.restyle_workers,
+            mux_workers=args.mux_workers,
+            queue_size=args.queue_size,
+            read_limit=args.read_limit,
+            write_limit=args.write_limit,
+            low_priority=args.low_priority,
+            mkv_files=mkv_files,
+            incremental=not args.full,
+            rename_audio=not args.keep_audio_names,
+            **options
+        )
+
+
+def run_rename_audio(args):
+    module = importlib.import_module("ChangeAudioTracksDynamic")
+    for directory, mkv_files in get_targets(args, module, ".mkv").items():
+        report_first_job()
+        module.process_all_mkv_files_in_directory(
+            directory, use_asyncio=args.asyncio, concurrency=args.concurrency, mkv_files=mkv_files
+        )
+
+
+def run_rename_subs(args):
+    module = importlib.import_module("ChangeSubTracksDynamic")
+    for directory, mkv_files in get_targets(args, module, ".mkv").items():
+        report_first_job()
+        module.process_all_mkv_files_in_directory(
+            directory, parallel=args.parallel, max_workers=args.max_workers,
+            use_asyncio=args.asyncio, concurrency=args.concurrency, mkv_files=mkv_files
+        )
+
+
+def run_make_forced(args):
+    module = importlib.import_module("MakeForcedSub")
+    for directory, ass_files in get_targets(args, module, ".ass", select_folder="select_folder").items():
+        report_first_job()
+        module.process_folder(directory, dry_run=args.dry_run, max_workers=args.max_workers,
+                              gui=args.gui, file_paths=ass_files)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Batch tools for MKV subtitles and track names.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_command(name, help_text):
+        subparser = subparsers.add_parser(name, help=help_text)
+        subparser.add_argument("paths", nargs="*", help="Directories, files or glob patterns")
+        subparser.add_argument("--gui", action="store_true", help="Choose the directory with a Tk dialog")
+        return subparser
+
+    for name, module_name, help_text in (
+            ("mux", "MuxingNoPlayRes", "Restyle the subtitles and remux"),
+            ("mux-fr", "MuxingNoPlayResFR", "Same, with the fr output profile only (like --target fr)")):
+        mux = add_command(name, help_text)
+        mux.add_argument("--extract-workers", type=int, default=4)
+        mux.add_argument("--restyle-workers", type=int, default=None, help="Default: number of CPUs")
+        mux.add_argument("--mux-workers", type=workers_type, default="auto", help='Integer or "auto" (default)')
+        mux.add_argument("--queue-size", type=int, default=2)
+        mux.add_argument("--read-limit", type=int, default=None, help="Concurrent reads per disk")
+        mux.add_argument("--write-limit", type=int, default=None, help="Concurrent writes per disk")
+        mux.add_argument("--low-priority", action="store_true", help="Run the muxes with a low CPU/IO priority")
+        mux.add_argument("--keep-audio-names", action="store_true", help="Do not rename the audio tracks during the mux")
+        mux.add_argument("--full", action="store_true", help="Ignore the Output manifest and process every file")
+        mux.add_argument("--subtitles-in-ram", action="store_true", help="Keep the intermediate subtitles in tmpfs")
+        mux.add_argument("--ram-limit", type=int, default=512, help="RAM for the subtitles in MB (default: 512)")
+        mux.add_argument("--keep-subtitles", action="store_true", help="Also save the RAM subtitles to Sous-titres")
+        mux.add_argument("--order", choices=("lpt", "spt", "listed"), default="lpt",
+                         help="lpt: largest files first (default), spt: shortest first, listed: directory order")
+        mux.add_argument("--dry-run", action="store_true", help="Print the planned order and predicted makespan only")
+        mux.add_argument("--no-report", action="store_true", help="Do not write mux_report.jsonl in the output directory")
+        mux.add_argument("--prometheus-file", default=None, help="Also write the metrics to this Prometheus textfile")
+        mux.add_argument("--trace", dest="trace_file", default=None, help="Write a Chrome trace of the workers to this file")
+        mux.add_argument("--verbosity", choices=("quiet", "info", "debug"), default="info",
+                         help="debug also logs every applied style")
+        mux.add_argument("--no-log-file", action="store_true", help="Do not write mux.log in the output directory")
+        if name == "mux":
+            mux.add_argument("--target", dest="targets", action="append", choices=("default", "fr"),
+                             help="Output profile to produce, repeat it for several (default: default)")
+        mux.set_defaults(handler=functools.partial(run_mux, module_name=module_name))
+
+    rename_audio = add_command("rename-audio", "Name the audio tracks from language/codec/channels")
+    rename_audio.add_argument("--asyncio", action="store_true", help="Probe and edit the files concurrently")
+    rename_audio.add_argument("--concurrency", type=int, default=None, help="Default: 16")
+    rename_audio.set_defaults(handler=run_rename_audio)
+
+    rename_subs = add_command("rename-subs", "Name the subtitle tracks Français / Français (forcé)")
+    rename_subs.add_argument("--parallel", action="store_true", help="Use a thread pool")
+    rename_subs.add_argument("--max-workers", type=int, default=4)
+    rename_subs.add_argument("--asyncio", action="store_true", help="Probe and edit the files concurrently")
+    rename_subs.add_argument("--concurrency", type=int, default=None, help="Default: 16")
+    rename_subs.set_defaults(handler=run_rename_subs)
+
+    make_forced = add_command("make-forced", "Remove the full dialogue lines of .ass files")
+    make_forced.add_argument("--dry-run", action="store_true", help="Only count the lines to remove")
+    make_forced.add_argument("--max-workers", type=int, default=None)
+    make_forced.set_defaults(handler=run_make_forced)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Logging of the muxing batch.
+
+The workers only push records to a QueueHandler; a single QueueListener thread writes them to
+the console and to a rotating log file. The lines of a MKV are held until its last record and
+written as one block, so concurrent files never interleave. Per-style lines are DEBUG records,
+only built when the verbosity asks for them.
+"""
+
+import queue
+import logging
+import logging.handlers
+
+LOGGER_NAME = "mux"
+logger = logging.getLogger(LOGGER_NAME)
+
+VERBOSITY = {"quiet": logging.WARNING, "info": logging.INFO, "debug": logging.DEBUG}
+
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 3
+
+
+class GroupingHandler(logging.Handler):
+    """
+    Buffers the records carrying a `mkv` attribute until the record flagged `end`, then writes
+    the group with one write per target handler. Other records are written at once.
+    """
+
+    def __init__(self, targets):
+        super().__init__()
+        self.targets = targets
+        self.groups = {}
+
+    def emit(self, record):
+        mkv = getattr(record, "mkv", None)
+        if mkv is None:
+            record.mkv = "-"
+            self.write_group([record])
+            return
+        group = self.groups.setdefault(mkv, [])
+        group.append(record)
+        if getattr(record, "end", False):
+            self.write_group(self.groups.pop(mkv))
+
+    def write_group(self, records):
+        for target in self.targets:
+            selected = [record for record in records if record.levelno >= target.level]
+            if not selected:
+                continue
+            text = "".join(target.format(record) + target.terminator for record in selected)
+            target.acquire()
+            try:
+                if isinstance(target, logging.handlers.RotatingFileHandler) and target.shouldRollover(selected[0]):
+                    target.doRollover()
+                target.stream.write(text)
+                target.flush()
+            finally:
+                target.release()
+
+    def close(self):
+        # Files interrupted by an error of the batch
+        for mkv in list(self.groups):
+            self.write_group(self.groups.pop(mkv))
+        for target in self.targets:
+            target.close()
+        super().close()
+
+
+def start_logging(verbosity="info", log_file=None):
+    """
+    Routes the "mux" logger through a queue to the console (and `log_file`, rotated).
+
+    Returns:
+        tuple: (QueueListener, GroupingHandler, QueueHandler) to give to stop_logging.
+    """
+    level = VERBOSITY[verbosity]
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter("%(message)s"))
+    console.setLevel(level)
+    targets = [console]
+    if log_file:
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+        )
+        file_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(mkv)s] %(message)s"))
+        file_handler.setLevel(level)
+        targets.append(file_handler)
+    grouping = GroupingHandler(targets)
+    queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    logger.addHandler(queue_handler)
+    logger.setLevel(level)
+    logger.propagate = False
+    listener = logging.handlers.QueueListener(queue_handler.queue, grouping)
+    listener.start()
+    return listener, grouping, queue_handler
+
+
+def stop_logging(handle):
+    """Writes the pending records and detaches the queue from the logger."""
+    listener, grouping, queue_handler = handle
+    listener.stop()
+    logger.removeHandler(queue_handler)
+    grouping.close()
+
+
+def set_level(level):
+    """Pool initializer: the worker processes only build the records of the chosen verbosity."""
+    logger.setLevel(level)
+
+
+def debug_enabled():
+    return logger.isEnabledFor(logging.DEBUG)
+
+
+def log_records(mkv_file, records):
+    """Logs the (level, message) records of a MKV file, held until close_group."""
+    extra = {"mkv": mkv_file}
+    for level, message in records:
+        logger.log(level, message, extra=extra)
+
+
+def close_group(mkv_file, message, level=logging.INFO):
+    """Last record of a MKV file: its group is written. Sent whatever the verbosity, so the group is always closed."""
+    record = logger.makeRecord(logger.name, level, __name__, 0, message, None, None,
+                               extra={"mkv": mkv_file, "end": True})
+    logger.handle(record)
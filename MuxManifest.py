@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Manifest of the files already muxed into an Output directory, used to skip them on re-runs.
+
+For each input it records the size/mtime/partial hash of the MKV, the style-profile version,
+the attachment set and the size and edge hash (first and last MiB) of the output file. A file
+is up to date when all of them still match, so adding two episodes to a processed folder only
+muxes those two.
+
+The manifest is rewritten every SAVE_EVERY records or SAVE_INTERVAL seconds and by save() at
+the end of the run: an interrupted run only redoes the files recorded since the last save.
+"""
+
+import os
+import json
+import time
+import tempfile
+import threading
+from MkvProbe import partial_hash
+
+MANIFEST_NAME = "mux_manifest.json"
+SAVE_EVERY = 20
+SAVE_INTERVAL = 30.0
+
+
+def file_fingerprint(file_path):
+    """(size, mtime_ns, partial hash) of a file, None when it does not exist."""
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns, partial_hash(file_path)]
+
+
+def attachment_set(attachment_files):
+    """Name, size and mtime of every attachment (None for a missing file)."""
+    entries = []
+    for attachment_file in attachment_files:
+        try:
+            stat = os.stat(attachment_file)
+            entries.append([os.path.basename(attachment_file), stat.st_size, stat.st_mtime_ns])
+        except OSError:
+            entries.append([os.path.basename(attachment_file), None, None])
+    return sorted(entries)
+
+
+def fingerprint_matches(fingerprint, file_path):
+    """Whether a file still has a recorded fingerprint; size and mtime_ns are compared before hashing."""
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return False
+    if fingerprint is None or [stat.st_size, stat.st_mtime_ns] != fingerprint[:2]:
+        return False
+    return partial_hash(file_path) == fingerprint[2]
+
+
+class MuxManifest:
+    """The manifest of one Output directory, safe to update from the pipeline threads."""
+
+    def __init__(self, output_directory):
+        self.path = os.path.join(output_directory, MANIFEST_NAME)
+        self._lock = threading.Lock()
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+        self.entries = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def is_up_to_date(self, mkv_file, output_file, profile_version, attachments):
+        entry = self.entries.get(os.path.basename(mkv_file))
+        if not entry:
+            return False
+        if entry["profile_version"] != profile_version or entry["attachments"] != attachments:
+            return False
+        if not fingerprint_matches(entry["input"], mkv_file):
+            return False
+        # Inputs without subtitles have no output file
+        if entry["output_edge_hash"] is not None:
+            try:
+                if os.path.getsize(output_file) != entry["output_size"]:
+                    return False
+            except OSError:
+                return False
+            if partial_hash(output_file) != entry["output_edge_hash"]:
+                return False
+        return True
+
+    def record(self, mkv_file, output_file, profile_version, attachments):
+        """Records a successfully processed file, the manifest is saved in batches."""
+        output = file_fingerprint(output_file) if output_file else None
+        entry = {
+            "input": file_fingerprint(mkv_file),
+            "profile_version": profile_version,
+            "attachments": attachments,
+            # Edge hash only (first and last MiB + size), not a checksum of the whole output
+            "output_size": output[0] if output else None,
+            "output_edge_hash": output[2] if output else None,
+        }
+        with self._lock:
+            self.entries[os.path.basename(mkv_file)] = entry
+            self._unsaved += 1
+            if self._unsaved >= SAVE_EVERY or time.monotonic() - self._saved_at >= SAVE_INTERVAL:
+                self._save()
+
+    def save(self):
+        """Writes the records not saved yet, called once at the end of the run."""
+        with self._lock:
+            if self._unsaved:
+                self._save()
+
+    def _save(self):
+        # Atomic replace, an interrupted run never leaves a truncated manifest
+        directory = os.path.dirname(self.path)
+        fd, temp_path = tempfile.mkstemp(suffix=".tmp", dir=directory)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, indent=2, ensure_ascii=False)
+        os.replace(temp_path, self.path)
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
@@ -8,42 +8,133 @@ automatiquement par le lecteur (VLC fonctionne pour Nier Automata)
 """
 
 import os
-import subprocess
 import json
-import pysubs2
-from tkinter import Tk
-from tkinter.filedialog import askdirectory
-import concurrent.futures
+import logging
+import shutil
+import hashlib
+import functools
+from types import MappingProxyType
+from MkvProbe import get_mkv_info, print_probe_stats
+from MkvToolNix import tool_path
+from MkvSubtitleExtract import extract_ass_tracks
+from MkvRemux import remux_subtitles
+from MuxingPipeline import AdaptiveLimiter, Stage, order_by_cost, predict_makespan, run_staged_pipeline
+import DeviceLimits
+import TraceEvents
+import MuxLogging
+from MuxManifest import MuxManifest, attachment_set
+from ChangeAudioTracksDynamic import audio_track_edits, audio_track_options
+from StageMetrics import RunReport
+from SubtitleScratch import DEFAULT_MAX_BYTES, ScratchSpace, estimate_subtitle_bytes
+from AssStyleRewriter import UnsupportedScriptError, format_style_lines, restyle_file_streaming
+
+def select_subtitle_tracks(tracks_info):
+    """Returns the French/undefined subtitle tracks of the probe data."""
+    return [
+        track for track in tracks_info["tracks"]
+        if track["type"] == "subtitles" and track["properties"]["language"] in ["fre", "und"]
+    ]
+
+def extract_subtitles(mkv_file, output_subtitles_dir, tracks_info=None, stats=None):
+    """
+    Extracts the French/undefined subtitle tracks of a MKV file into `output_subtitles_dir`.
+
+    With `stats`, "bytes_read" gets the bytes read from the MKV: the subtitle blocks read
+    natively, plus the whole file when mkvextract has to extract the tracks left.
 
-def extract_subtitles(mkv_file, output_subtitles_dir):
+    Returns:
+        tuple: (extracted subtitle files, log records)
+    """
+    if stats is None:
+        stats = {}
+    stats["bytes_read"] = 0
     base_name = os.path.basename(mkv_file)
-    mkv_logs = [f"\n--- Processing MKV file: {base_name} ---"]
+    mkv_logs = [(logging.INFO, f"\n--- Processing MKV file: {base_name} ---")]
     
-    mkvextract_path = r"C:\Program Files\MKVToolNix\mkvextract.exe"
+    mkvextract_path = tool_path("mkvextract")
     output_subtitles_dir = os.path.abspath(output_subtitles_dir)
-    mkvmerge_path = r"C:\Program Files\MKVToolNix\mkvmerge.exe"
-    mkvmerge_output = subprocess.check_output([mkvmerge_path, "-J", mkv_file])
-    tracks_info = json.loads(mkvmerge_output)
+    if tracks_info is None:
+        tracks_info = get_mkv_info(mkv_file)
 
     mkv_base_name = os.path.splitext(base_name)[0]
     extracted_subtitle_tracks = []
+    outputs = {}
 
-    for track in tracks_info["tracks"]:
+    for track in select_subtitle_tracks(tracks_info):
         track_number = track["id"]
-        if track["type"] == "subtitles" and track["properties"]["language"] in ["fre", "und"]:
-            track_name = track["properties"].get("track_name", f"subtitle_track_{track_number}")
-            output_file = os.path.join(output_subtitles_dir, f"{mkv_base_name}_{track_name}.ass")
-            subprocess.run([mkvextract_path, "tracks", mkv_file, f"{track_number}:{output_file}"], check=True)
-            
-            # Process subtitle file and print `.ass` specific logs
-            ass_logs = change_style_in_file(output_file, mkv_file)
-            print("\n".join(ass_logs))
-            
-            mkv_logs.append(f"Subtitle extracted and styled: {os.path.basename(output_file)}")
-            extracted_subtitle_tracks.append(output_file)
+        track_name = track["properties"].get("track_name", f"subtitle_track_{track_number}")
+        # Empty tracks are skipped before extraction using the statistics tags
+        if track["properties"].get("tag_number_of_bytes") in (0, "0"):
+            mkv_logs.append((logging.INFO, f"Skipped empty subtitle track {track_number}: {track_name}"))
+            continue
+        output_file = os.path.join(output_subtitles_dir, f"{mkv_base_name}_{track_name}.ass")
+        outputs[track_number] = output_file
+        extracted_subtitle_tracks.append(output_file)
+
+    # Blocks read natively through the Cues, then a single mkvextract pass for the tracks left, so the MKV is read only once
+    if outputs:
+        with TraceEvents.span("extract tracks", tracks=list(outputs)):
+            with DeviceLimits.device_slots(read=[mkv_file], program="native extract"):
+                left = extract_ass_tracks(mkv_file, outputs, tracks_info, stats)
+            extract_specs = [f"{track_number}:{outputs[track_number]}" for track_number in left]
+            if extract_specs:
+                mkv_logs.append((logging.DEBUG, f"mkvextract used for tracks {left}"))
+                stats["bytes_read"] += os.path.getsize(mkv_file)
+                DeviceLimits.run_limited([mkvextract_path, "tracks", mkv_file] + extract_specs, read=[mkv_file], low_priority=False)
+
+    for output_file in extracted_subtitle_tracks:
+        mkv_logs.append((logging.INFO, f"Subtitle extracted: {os.path.basename(output_file)}"))
 
     return extracted_subtitle_tracks, mkv_logs
 
+def restyle_subtitles(subtitle_files, mkv_file, profile="default", scaled_border_and_shadow=True):
+    """Applies the predefined styles to every extracted subtitle of a MKV file and returns the logs."""
+    logs = []
+    for subtitle_file in subtitle_files:
+        logs.extend(change_style_in_file(subtitle_file, mkv_file, profile=profile,
+                                         scaled_border_and_shadow=scaled_border_and_shadow))
+        logs.append((logging.INFO, f"Subtitle styled: {os.path.basename(subtitle_file)}"))
+    return logs
+
+# Style aliases: style name found in the subtitle file -> predefined style applied to it
+STYLE_ALIASES = {
+    "Default": "Default",
+    "Waka Style 1080": "Default",
+    "Italique": "Italique",
+    "Default I": "Italique",
+    "TiretsDefault": "TiretsDefault",
+    "TiretsItalique": "TiretsItalique",
+    "Default top": "DefaultTop",
+    "DefaultUP": "DefaultTop",
+    "DefaultTop": "DefaultTop",
+    "ItaliqueUP": "ItaliqueUP",
+    "Default (Arial 1080p) - Copier": "DefaultTop",
+    "Overlap": "Overlap",
+    "Default - With margins": "Default - With margins",
+}
+# Table of MuxingNoPlayResFR: "Waka Style 1080" is left as is
+STYLE_ALIASES_FR = {alias: style for alias, style in STYLE_ALIASES.items() if alias != "Waka Style 1080"}
+STYLE_PROFILES = {"default": STYLE_ALIASES, "fr": STYLE_ALIASES_FR}
+
+# Output profiles (deliverables): style aliases, ScaledBorderAndShadow, subtitle marked as default
+# track ("full" or "forced") and output directory in the MKV folder, used when several profiles
+# are produced (a single one goes to `Output`). Several profiles produced in the same run share the
+# extraction, and the restyled files when their styles are the same.
+OUTPUT_PROFILES = {
+    "default": {"style_profile": "default", "scaled_border_and_shadow": True, "default_subtitle": "full", "output_dir": "Output"},
+    "fr": {"style_profile": "fr", "scaled_border_and_shadow": False, "default_subtitle": "forced", "output_dir": "Output FR"},
+}
+
+# Number of (PlayResX, PlayResY, profile) style tables kept in memory
+STYLE_CACHE_SIZE = 16
+
+# Rewrite only the [Script Info]/[V4+ Styles] headers of the ASS files and copy the events as is
+# (unusual scripts still go through pysubs2)
+STREAMING_RESTYLE = True
+
+# Name the audio tracks (ChangeAudioTracksDynamic rules) in the same mkvmerge write as the subtitles
+RENAME_AUDIO = True
+
 def calculate_style_properties(base_properties, base_resolution, target_resolution):
     """
     Calculate style properties dynamically based on resolution scaling.
@@ -56,6 +147,11 @@ def calculate_style_properties(base_properties, base_resolution, target_resoluti
     Returns:
         dict: The dynamically calculated style properties for the target resolution.
     """
+    return dict(_cached_style_properties(tuple(sorted(base_properties.items())), tuple(base_resolution), tuple(target_resolution)))
+
+@functools.lru_cache(maxsize=STYLE_CACHE_SIZE)
+def _cached_style_properties(base_items, base_resolution, target_resolution):
+    base_properties = dict(base_items)
     base_width, base_height = base_resolution
     target_width, target_height = target_resolution
 
@@ -74,16 +170,29 @@ def calculate_style_properties(base_properties, base_resolution, target_resoluti
         "marginv": int(base_properties["marginv"] / scaling_factor_y),
     }
 
-def create_dynamic_styles(original_resolution, base_resolution=(1920, 1080)):
-    """Creates predefined styles dynamically based on resolution scaling."""
+def create_dynamic_styles(original_resolution, base_resolution=(1920, 1080), profile="default"):
+    """
+    Creates predefined styles dynamically based on resolution scaling.
+
+    The table is cached per (PlayResX, PlayResY, profile) with LRU eviction: the returned
+    alias -> style mapping is read-only and its styles are shared between calls, copy() a
+    style before modifying it.
+    """
     # Parse original and base resolutions
     original_width, original_height = map(int, original_resolution.split('x'))
-    base_width, base_height = base_resolution
+    return _cached_style_table(original_width, original_height, tuple(base_resolution), profile)
 
-    # Calculate scaling factors
-    scaling_factor_x = base_width / original_width
-    scaling_factor_y = base_height / original_height
-    scaling_factor_font = (scaling_factor_x + scaling_factor_y) / 2
+def style_cache_info():
+    """Hit statistics of the style tables and style properties caches (per process)."""
+    return {
+        "styles": _cached_style_table.cache_info(),
+        "style_lines": get_style_lines.cache_info(),
+        "properties": _cached_style_properties.cache_info(),
+    }
+
+@functools.lru_cache(maxsize=STYLE_CACHE_SIZE)
+def _cached_style_table(original_width, original_height, base_resolution, profile):
+    import pysubs2  # Only loaded by the restyle stage
 
     # Define base properties for scaling
     base_properties = {
@@ -95,15 +204,10 @@ def create_dynamic_styles(original_resolution, base_resolution=(1920, 1080)):
         "marginv": 75,
     }
 
-    # Dynamically calculate properties based on scaling factors
-    scaled_properties = {
-        "fontsize": int(base_properties["fontsize"] / scaling_factor_font),
-        "outline": round(base_properties["outline"] / scaling_factor_font, 1),
-        "shadow": round(base_properties["shadow"] / scaling_factor_font, 1),
-        "marginl": int(base_properties["marginl"] / scaling_factor_x),
-        "marginr": int(base_properties["marginr"] / scaling_factor_x),
-        "marginv": int(base_properties["marginv"] / scaling_factor_y),
-    }
+    # Scaled through the properties cache: the factors are base / original, hence the order
+    scaled_properties = calculate_style_properties(base_properties, (original_width, original_height), base_resolution)
+    scaled_properties["outline"] = round(scaled_properties["outline"], 1)
+    scaled_properties["shadow"] = round(scaled_properties["shadow"], 1)
 
     # Default style
     default_style = pysubs2.SSAStyle()
@@ -156,85 +260,153 @@ def create_dynamic_styles(original_resolution, base_resolution=(1920, 1080)):
     tirets_italic_style.name = "TiretsItalique"
     tirets_italic_style.italic = True
 
-    # Return all styles as a dictionary
-    return {
-        "Default": default_style,
-        "Waka Style 1080": default_style,
-        "Italique": italic_style,
-        "Default I": italic_style,
-        "TiretsDefault": tirets_default_style,
-        "TiretsItalique": tirets_italic_style,
-        "Default top": default_top_style,
-        "DefaultUP": default_top_style,
-        "DefaultTop": default_top_style,
-        "ItaliqueUP": italic_top_style,
-        "Default (Arial 1080p) - Copier": default_top_style,
-        "Overlap": overlap_style,
-        "Default - With margins": defaultmargins_style,
+    # Alias name -> style lookup, computed once per table
+    styles_by_name = {
+        style.name: style
+        for style in (default_style, default_top_style, defaultmargins_style, overlap_style,
+                      italic_top_style, italic_style, tirets_default_style, tirets_italic_style)
+    }
+    return MappingProxyType({
+        alias: styles_by_name[style_name] for alias, style_name in STYLE_PROFILES[profile].items()
+    })
+
+
+@functools.lru_cache(maxsize=STYLE_CACHE_SIZE)
+def get_style_lines(play_res_x, play_res_y, profile="default"):
+    """"Style:" lines of the predefined styles for a script resolution, as pysubs2 writes them."""
+    return format_style_lines(create_dynamic_styles(f"{play_res_x}x{play_res_y}", profile=profile))
+
+# Script resolutions whose style tables make up the style-profile version
+PROFILE_RESOLUTIONS = ((1920, 1080), (1280, 720), (640, 480), (384, 288))
+
+def style_profile_version(target="default", rename_audio=RENAME_AUDIO):
+    """
+    Hash of what the restyle and the mux apply to a file (style tables, aliases, track flags and names).
+
+    Stored in the manifest of `Output`: changing a style parameter changes the version and the
+    files are processed again on the next run.
+    """
+    output_profile = OUTPUT_PROFILES[target]
+    profile = output_profile["style_profile"]
+    parameters = {
+        "aliases": STYLE_PROFILES[profile],
+        "styles": {f"{x}x{y}": get_style_lines(x, y, profile) for x, y in PROFILE_RESOLUTIONS},
+        "scaled_border_and_shadow": output_profile["scaled_border_and_shadow"],
+        "rename_audio": rename_audio,
+        "default_subtitle": output_profile["default_subtitle"],
     }
+    return hashlib.sha1(json.dumps(parameters, sort_keys=True).encode("utf-8")).hexdigest()
 
+def change_style_in_file(subtitle_file, mkv_file, streaming=STREAMING_RESTYLE, profile="default", scaled_border_and_shadow=True):
+    logs = [(logging.INFO, f"\n--- Changing style for subtitle file: {os.path.basename(subtitle_file)} ---")]
 
-def change_style_in_file(subtitle_file, mkv_file):
-    logs = [f"\n--- Changing style for subtitle file: {os.path.basename(subtitle_file)} ---"]
+    if streaming:
+        try:
+            result = restyle_file_streaming(subtitle_file, functools.partial(get_style_lines, profile=profile),
+                                            scaled_border_and_shadow=scaled_border_and_shadow)
+        except UnsupportedScriptError as e:
+            logs.append((logging.INFO, f"Streaming restyle not possible ({e}), using pysubs2."))
+        else:
+            if scaled_border_and_shadow:
+                logs.append((logging.INFO, "Enabled Scale border and shadow in subtitle properties."))
+            original_play_res_x, original_play_res_y = result["play_res"]
+            logs.append((logging.INFO, f"Original script resolution: {original_play_res_x}x{original_play_res_y}"))
+            logs.append((logging.INFO, "Retaining original PlayResX and PlayResY values. No changes made."))
+            logs.append((logging.INFO, "Applying predefined styles without rescaling:"))
+            # One line per style, only built in debug
+            if MuxLogging.debug_enabled():
+                for style_name, applied in result["styles"]:
+                    if applied:
+                        logs.append((logging.DEBUG, f"  - Applied predefined style: {style_name}"))
+                    else:
+                        logs.append((logging.DEBUG, f"  - Skipped non-predefined style: {style_name}"))
+            logs.append((logging.INFO, f"Updated subtitle file saved: {subtitle_file}"))
+            return logs
+
+    import pysubs2  # Only loaded by the restyle stage
     subs = pysubs2.load(subtitle_file)
     
     
     # Set ScaleBorderAndShadow property
-    subs.info["ScaledBorderAndShadow"] = "yes"
-    logs.append("Enabled Scale border and shadow in subtitle properties.")
+    if scaled_border_and_shadow:
+        subs.info["ScaledBorderAndShadow"] = "yes"
+        logs.append((logging.INFO, "Enabled Scale border and shadow in subtitle properties."))
     
     
     # Log the original script resolution
     original_play_res_x = int(subs.info.get("PlayResX", 1920))
     original_play_res_y = int(subs.info.get("PlayResY", 1080))
-    logs.append(f"Original script resolution: {original_play_res_x}x{original_play_res_y}")
+    logs.append((logging.INFO, f"Original script resolution: {original_play_res_x}x{original_play_res_y}"))
 
     # Do not modify PlayResX and PlayResY
-    logs.append("Retaining original PlayResX and PlayResY values. No changes made.")
+    logs.append((logging.INFO, "Retaining original PlayResX and PlayResY values. No changes made."))
 
     # Apply predefined styles without scaling
-    logs.append("Applying predefined styles without rescaling:")
-    predefined_styles = create_dynamic_styles(f"{original_play_res_x}x{original_play_res_y}")
+    logs.append((logging.INFO, "Applying predefined styles without rescaling:"))
+    predefined_styles = create_dynamic_styles(f"{original_play_res_x}x{original_play_res_y}", profile=profile)
+    debug = MuxLogging.debug_enabled()
     for style_name, style in subs.styles.items():
         if style_name in predefined_styles:
-            subs.styles[style_name] = predefined_styles[style_name]
-            logs.append(f"  - Applied predefined style: {style_name}")
-        else:
-            logs.append(f"  - Skipped non-predefined style: {style_name}")
+            # The cached styles are shared between files: the SSAFile gets its own copy
+            subs.styles[style_name] = predefined_styles[style_name].copy()
+            if debug:
+                logs.append((logging.DEBUG, f"  - Applied predefined style: {style_name}"))
+        elif debug:
+            logs.append((logging.DEBUG, f"  - Skipped non-predefined style: {style_name}"))
 
     # Save the updated subtitle file
     subs.save(subtitle_file)
-    logs.append(f"Updated subtitle file saved: {subtitle_file}")
+    logs.append((logging.INFO, f"Updated subtitle file saved: {subtitle_file}"))
     return logs
 
 def get_video_resolution(mkv_file):
-    mkvmerge_path = r"C:\Program Files\MKVToolNix\mkvmerge.exe"
-    result = subprocess.run([mkvmerge_path, '-J', mkv_file], capture_output=True, text=True, check=True)
-    info = json.loads(result.stdout)
+    info = get_mkv_info(mkv_file)
     for track in info['tracks']:
         if track["type"] == "video":
             return track["properties"]["pixel_dimensions"]
     print(f"Default resolution used for {mkv_file}")
     return "1920x1080"
 
-def create_final_mkv_with_subtitles(input_file, output_file, subtitle_files, attachment_files):
+def create_final_mkv_with_subtitles(input_file, output_file, subtitle_files, attachment_files, tracks_info=None,
+                                    default_subtitle="full"):
+    """
+    Writes the output MKV: the input without its subtitles, the restyled subtitles and the attachments.
+
+    The largest subtitle is the full one, `default_subtitle` ("full" or "forced") tells which
+    one is the default track.
+
+    With `tracks_info` (probe data of the input), the audio tracks are renamed in the same
+    write, so the episode does not need a mkvpropedit pass afterwards.
+
+    The clusters are copied as they are by MkvRemux, mkvmerge only remuxes the files it does not handle.
+
+    Returns:
+        list: The (level, message) log records.
+    """
     base_name = os.path.basename(input_file)
-    print(f"Creating final MKV for: {base_name}")
-    mkvmerge_path = r"C:\Program Files\MKVToolNix\mkvmerge.exe"
+    logs = [(logging.INFO, f"Creating final MKV for: {base_name}")]
+    mkvmerge_path = tool_path("mkvmerge")
     sorted_subtitle_files = sorted(subtitle_files, key=os.path.getsize, reverse=True)
     largest_subtitle_file = sorted_subtitle_files[0]
 
-    command = [mkvmerge_path, '-o', output_file, '--no-subtitles', '--title', '', input_file]
+    command = [mkvmerge_path, '-o', output_file, '--no-subtitles', '--title', '']
+    track_edits = {}
+    if tracks_info is not None:
+        track_edits, audio_logs = audio_track_edits(tracks_info)
+        command.extend(audio_track_options(track_edits))
+        logs.extend((logging.INFO, line) for line in audio_logs)
+    command.append(input_file)
 
     # Ajouter les fichiers de sous-titres modifiés à la commande de fusion
+    subtitle_tracks = []
     for subtitle_file in sorted_subtitle_files:
         if subtitle_file == largest_subtitle_file:
             track_name = "Français"
-            default_track = "yes"
+            default_track = "yes" if default_subtitle == "full" else "no"
             forced_track = "no"
         else:
             track_name = "Français (forcé)"
-            default_track = "no"
+            default_track = "yes" if default_subtitle == "forced" else "no"
             forced_track = "yes"
         options = [
             "--language", "0:fre",
@@ -244,29 +416,201 @@ def create_final_mkv_with_subtitles(input_file, output_file, subtitle_files, att
             subtitle_file
         ]
         command.extend(options)
+        subtitle_tracks.append((subtitle_file, {"name": track_name, "language": "fre",
+                                                "default": default_track == "yes", "forced": forced_track == "yes"}))
 
     for attachment_file in attachment_files:
         command.extend(["--attach-file", attachment_file])
 
-    subprocess.run(command, check=True)
+    # Only the subtitles change: headers and subtitle blocks written, the video/audio clusters copied by the kernel
+    with TraceEvents.span("native remux"):
+        with DeviceLimits.device_slots(read=[input_file], write=[output_file], program="native remux"):
+            remuxed = remux_subtitles(input_file, output_file, subtitle_tracks, attachment_files, track_edits)
+    if remuxed:
+        return logs
+    logs.append((logging.DEBUG, "mkvmerge used for the remux"))
+
+    # Bounded per disk: reading the source and writing the output at the same time
+    DeviceLimits.run_limited(command, read=[input_file], write=[output_file])
+    return logs
+
+def get_output_file(mkv_file, output_directory):
+    return os.path.join(output_directory, f"{os.path.splitext(os.path.basename(mkv_file))[0]}.mkv")
 
-def process_mkv_file(mkv_file, output_subtitles_dir, attachment_files, output_directory):
+def process_mkv_file(mkv_file, output_subtitles_dir, attachment_files, output_directory, target="default"):
+    output_profile = OUTPUT_PROFILES[target]
     extracted_subs, mkv_logs = extract_subtitles(mkv_file, output_subtitles_dir)
+    mkv_logs.extend(restyle_subtitles(extracted_subs, mkv_file, output_profile["style_profile"],
+                                      output_profile["scaled_border_and_shadow"]))
     
     if extracted_subs:
-        create_final_mkv_with_subtitles(mkv_file, os.path.join(output_directory, f"{os.path.splitext(os.path.basename(mkv_file))[0]}.mkv"), extracted_subs, attachment_files)
+        tracks_info = get_mkv_info(mkv_file) if RENAME_AUDIO else None
+        mkv_logs += create_final_mkv_with_subtitles(mkv_file, get_output_file(mkv_file, output_directory), extracted_subs,
+                                                    attachment_files, tracks_info, output_profile["default_subtitle"])
     
     # Print the MKV processing logs after all subtitles have been processed
-    print("\n".join(mkv_logs))
+    print("\n".join(message for _, message in mkv_logs))
+
+def style_key(target):
+    """Targets with the same key can share their restyled subtitle files."""
+    output_profile = OUTPUT_PROFILES[target]
+    return output_profile["style_profile"], output_profile["scaled_border_and_shadow"]
+
+# Cost of a subtitle track (extraction, restyle, mux) counted as this many bytes of video
+TRACK_COST_BYTES = 32 * 1024 * 1024
+# Mux throughput assumed by the makespan prediction of the dry-run
+ESTIMATED_MB_PER_SECOND = 120
+
+def estimate_job_cost(mkv_file, targets=1):
+    """Estimated cost of a file in bytes: its size and its selected subtitle tracks, for each target."""
+    size = os.path.getsize(mkv_file)
+    try:
+        tracks = select_subtitle_tracks(get_mkv_info(mkv_file))
+    except Exception:
+        # The probe error is reported by the pipeline
+        tracks = []
+    return (size + len(tracks) * TRACK_COST_BYTES) * targets
+
+def print_schedule(mkv_files, costs, workers):
+    """Prints the predicted order, worker and times of the batch (dry-run)."""
+    bytes_per_second = ESTIMATED_MB_PER_SECOND * 1024 * 1024
+    makespan, schedule = predict_makespan([costs[mkv_file] / bytes_per_second for mkv_file in mkv_files], workers)
+    for mkv_file, (worker, start, end) in zip(mkv_files, schedule):
+        print(f"{os.path.basename(mkv_file)}: worker {worker + 1}, {start:.0f}s -> {end:.0f}s "
+              f"({costs[mkv_file] / (1024 * 1024):.0f} MB)")
+    print(f"Predicted makespan: {makespan:.0f}s with {workers} mux worker(s) at {ESTIMATED_MB_PER_SECOND} MB/s each")
+
+# Pipeline stages, each one receives the job dict returned by the previous one
+def probe_stage(mkv_file, targets_by_file):
+    return {"mkv_file": mkv_file, "tracks_info": get_mkv_info(mkv_file), "targets": targets_by_file[mkv_file]}
+
+def extract_stage(job, subtitle_dirs, scratch=None):
+    """
+    Extracts the subtitles once, in the directory of the first target. The other targets get a
+    copy of the extracted files, unless they share the style key of a previous target.
 
-def process_all_mkv_files_in_directory(directory):
-    mkv_files = [os.path.join(directory, f) for f in os.listdir(directory) if f.endswith('.mkv')]
-    
-    output_directory = os.path.join(directory, "Output")
-    os.makedirs(output_directory, exist_ok=True)
+    With a `scratch` space, the files go to a RAM directory of the job when they fit in it.
+    """
+    targets = job["targets"]
+    job["scratch_dir"] = None
+    if scratch is not None:
+        copies = len({style_key(target) for target in targets})
+        nbytes = estimate_subtitle_bytes(select_subtitle_tracks(job["tracks_info"]), copies)
+        job["scratch_dir"] = scratch.reserve(job["mkv_file"], nbytes)
+    if job["scratch_dir"]:
+        subtitle_dirs = {target: os.path.join(job["scratch_dir"], target) for target in targets}
+        for subtitle_dir in subtitle_dirs.values():
+            os.makedirs(subtitle_dir)
+    elif scratch is not None:
+        # Job which does not fit in RAM: its subtitles go to Sous-titres, not created up front
+        for target in targets:
+            os.makedirs(subtitle_dirs[target], exist_ok=True)
+    job["extract_stats"] = {}
+    extracted, job["logs"] = extract_subtitles(job["mkv_file"], subtitle_dirs[targets[0]], job["tracks_info"], job["extract_stats"])
+    job["subtitles"] = {}
+    job["restyle"] = []
+    files_by_key = {}
+    for target in targets:
+        key = style_key(target)
+        if key not in files_by_key:
+            if files_by_key:
+                files = [os.path.join(subtitle_dirs[target], os.path.basename(f)) for f in extracted]
+                for source, destination in zip(extracted, files):
+                    shutil.copyfile(source, destination)
+            else:
+                files = extracted
+            files_by_key[key] = files
+            job["restyle"].append((files, key))
+        job["subtitles"][target] = files_by_key[key]
+    return job
+
+def restyle_stage(job):
+    # Runs in a worker process: pysubs2 parsing/saving is CPU bound
+    for files, (profile, scaled_border_and_shadow) in job["restyle"]:
+        job["logs"].extend(restyle_subtitles(files, job["mkv_file"], profile, scaled_border_and_shadow))
+    return job
+
+def mux_stage(job, attachment_files, output_dirs, rename_audio=RENAME_AUDIO, archive_dirs=None):
+    mkv_file = job["mkv_file"]
+    job["output_files"] = {}
+    for target in job["targets"]:
+        job["output_files"][target] = None
+        if job["subtitles"][target]:
+            job["output_files"][target] = get_output_file(mkv_file, output_dirs[target])
+            job["logs"] += create_final_mkv_with_subtitles(mkv_file, job["output_files"][target], job["subtitles"][target],
+                                                           attachment_files, job["tracks_info"] if rename_audio else None,
+                                                           OUTPUT_PROFILES[target]["default_subtitle"])
+    # Subtitles muxed from RAM are only kept on disk when asked
+    if job["scratch_dir"] and archive_dirs:
+        for target in job["targets"]:
+            for subtitle_file in job["subtitles"][target]:
+                shutil.copyfile(subtitle_file, os.path.join(archive_dirs[target], os.path.basename(subtitle_file)))
+    MuxLogging.log_records(mkv_file, job["logs"])
+    return job
+
+# Bytes (read, written) of each stage run, for the run report
+def _files_size(files):
+    return sum(os.path.getsize(f) for f in files if os.path.exists(f))
+
+def extract_io(job):
+    # Subtitle blocks read natively (whole MKV when mkvextract ran), the copies for the other targets are written too
+    return job["extract_stats"]["bytes_read"], sum(_files_size(files) for files, _ in job["restyle"])
+
+def restyle_io(job):
+    size = sum(_files_size(files) for files, _ in job["restyle"])
+    return size, size
+
+def mux_io(job):
+    mkv_size = os.path.getsize(job["mkv_file"])
+    bytes_read = sum(mkv_size + _files_size(job["subtitles"][target]) for target, output in job["output_files"].items() if output)
+    return bytes_read, _files_size([output for output in job["output_files"].values() if output])
+
+def process_all_mkv_files_in_directory(directory, extract_workers=4, restyle_workers=None, mux_workers="auto", queue_size=2,
+                                       read_limit=None, write_limit=None, low_priority=False, max_mux_workers=8,
+                                       mkv_files=None, incremental=True, rename_audio=RENAME_AUDIO, targets=("default",),
+                                       subtitles_in_ram=False, ram_limit=DEFAULT_MAX_BYTES, keep_subtitles=False,
+                                       order="lpt", dry_run=False, report=True, prometheus_file=None, trace_file=None,
+                                       verbosity="info", log_to_file=True):
+    """
+    Muxes every MKV file of the directory (or only `mkv_files` when given) with the restyled subtitles into `Output`.
 
-    output_subtitles_dir = os.path.join(output_directory, "Sous-titres")
-    os.makedirs(output_subtitles_dir, exist_ok=True)
+    `targets` lists the output profiles (OUTPUT_PROFILES) to produce, e.g. ("default", "fr") for
+    `Output` and `Output FR`: the subtitles are extracted once per MKV for all of them. A single
+    target, whichever it is, is written to `Output`.
+
+    `mux_workers="auto"` lets an AIMD controller pick the number of concurrent muxes from the
+    observed MB/s (between 1 and `max_mux_workers`), an integer fixes it.
+
+    With `incremental`, the files recorded in the manifest of an output directory whose input,
+    style profile, attachments and output are unchanged are skipped. With `rename_audio`, the
+    audio tracks are named by the mux itself (one probe and one write per episode).
+
+    With `subtitles_in_ram`, the extracted and restyled subtitles live in a private tmpfs
+    directory (at most `ram_limit` bytes, the jobs which do not fit use the disk) and are copied
+    to `Sous-titres` only with `keep_subtitles`.
+
+    `order` is "lpt" (largest estimated cost first, the default), "spt" (shortest first, for
+    fast feedback) or None (directory order). `dry_run` prints the planned order and the
+    predicted makespan without processing anything.
+
+    With `report`, the wall time, CPU time and bytes of every stage run are written to
+    `mux_report.jsonl` in the first output directory and summed up at the end (p50/p95 per stage,
+    MB/s), `prometheus_file` also gets them in the Prometheus textfile format. `trace_file`
+    records the timeline of the workers in the Chrome trace_event format (chrome://tracing).
+
+    The logs of the workers are written per MKV by a single thread, to the console and (with
+    `log_to_file`) to `mux.log` in the first output directory. `verbosity` is "quiet", "info"
+    or "debug" (one line per applied style).
+    """
+    if mkv_files is None:
+        mkv_files = [os.path.join(directory, f) for f in os.listdir(directory) if f.endswith('.mkv')]
+    
+    output_dirs = {}
+    subtitle_dirs = {}
+    for target in targets:
+        output_dir = OUTPUT_PROFILES[target]["output_dir"] if len(targets) > 1 else "Output"
+        output_dirs[target] = os.path.join(directory, output_dir)
+        subtitle_dirs[target] = os.path.join(output_dirs[target], "Sous-titres")
 
     attachment_files = [
         r"C:\Users\Marc\Desktop\Dossiers\Logiciels\LogicielPourPlex\TrebuchetAttachments\trebuc_0.ttf",
@@ -276,25 +620,108 @@ def process_all_mkv_files_in_directory(directory):
         r"C:\Users\Marc\Desktop\Dossiers\Logiciels\LogicielPourPlex\TrebuchetAttachments\arial_4.ttf"
     ]
 
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = [
-            executor.submit(process_mkv_file, mkv_file, output_subtitles_dir, attachment_files, output_directory)
-            for mkv_file in mkv_files
-        ]
-        
-        for future in concurrent.futures.as_completed(futures):
-            try:
-                future.result()
-                print("- Successfully processed file. -")
-            except Exception as e:
-                print(f"Error processing file: {e}")
-
-if __name__ == "__main__":
+    # Targets still to produce for each file
+    targets_by_file = {mkv_file: list(targets) for mkv_file in mkv_files}
+    manifests = {}
+    if incremental:
+        attachments = attachment_set(attachment_files)
+        profile_versions = {target: style_profile_version(target, rename_audio) for target in targets}
+        for target in targets:
+            manifests[target] = MuxManifest(output_dirs[target])
+        for mkv_file in mkv_files:
+            targets_by_file[mkv_file] = [
+                target for target in targets
+                if not manifests[target].is_up_to_date(mkv_file, get_output_file(mkv_file, output_dirs[target]),
+                                                       profile_versions[target], attachments)
+            ]
+        pending_files = [mkv_file for mkv_file in mkv_files if targets_by_file[mkv_file]]
+        if len(pending_files) < len(mkv_files):
+            print(f"{len(mkv_files) - len(pending_files)} file(s) already up to date in Output, skipped.")
+        mkv_files = pending_files
+
+    # The probes are cached, the probe stage does not run mkvmerge -J again
+    if order or dry_run:
+        costs = {mkv_file: estimate_job_cost(mkv_file, len(targets_by_file[mkv_file])) for mkv_file in mkv_files}
+        if order:
+            mkv_files = order_by_cost(mkv_files, costs, longest_first=(order == "lpt"))
+    if dry_run:
+        print_schedule(mkv_files, costs, mux_workers if isinstance(mux_workers, int) else 2)
+        return
+
+    for target in targets:
+        os.makedirs(output_dirs[target], exist_ok=True)
+        # Sous-titres only when the subtitles are written there
+        if not subtitles_in_ram or keep_subtitles:
+            os.makedirs(subtitle_dirs[target], exist_ok=True)
+    scratch = ScratchSpace(ram_limit) if subtitles_in_ram else None
+
+    # Heavy jobs are limited per disk, the stage pools only bound the number of threads
+    DeviceLimits.configure(read_limit=read_limit, write_limit=write_limit, low_priority=low_priority)
+
+    def report_done(mkv_file, job, error):
+        if scratch:
+            scratch.release(mkv_file)
+        if error is None:
+            MuxLogging.close_group(mkv_file, "- Successfully processed file. -")
+            if manifests:
+                for target in job["targets"]:
+                    manifests[target].record(mkv_file, job["output_files"][target], profile_versions[target], attachments)
+        else:
+            MuxLogging.close_group(mkv_file, f"Error processing file {os.path.basename(mkv_file)}: {error}", logging.ERROR)
+
+    mux_limiter = None
+    if mux_workers == "auto":
+        mux_limiter = AdaptiveLimiter(name="mux", initial=2, maximum=max_mux_workers)
+
+    # probe -> extract (mkvextract) -> restyle (process pool) -> mux (mkvmerge, once per target)
+    stages = [
+        Stage("probe", functools.partial(probe_stage, targets_by_file=targets_by_file), workers=1),
+        Stage("extract", functools.partial(extract_stage, subtitle_dirs=subtitle_dirs, scratch=scratch), workers=extract_workers,
+              io=extract_io),
+        Stage("restyle", restyle_stage, workers=restyle_workers, processes=True, io=restyle_io),
+        Stage("mux", functools.partial(mux_stage, attachment_files=attachment_files, output_dirs=output_dirs,
+                                       rename_audio=rename_audio, archive_dirs=subtitle_dirs if keep_subtitles else None),
+              workers=mux_workers, limiter=mux_limiter,
+              measure=lambda job: os.path.getsize(job["mkv_file"]) * len(job["targets"]), io=mux_io),
+    ]
+    run_report = None
+    if report or prometheus_file:
+        report_file = os.path.join(output_dirs[targets[0]], "mux_report.jsonl") if report else None
+        run_report = RunReport(report_file, prometheus_file)
+    if trace_file:
+        TraceEvents.start(trace_file)
+    log_file = os.path.join(output_dirs[targets[0]], "mux.log") if log_to_file else None
+    logging_handle = MuxLogging.start_logging(verbosity, log_file)
+    try:
+        run_staged_pipeline(mkv_files, stages, queue_size=queue_size, on_done=report_done, metrics=run_report,
+                            process_initializer=MuxLogging.set_level, initargs=(MuxLogging.VERBOSITY[verbosity],))
+    finally:
+        for manifest in manifests.values():
+            manifest.save()
+        MuxLogging.stop_logging(logging_handle)
+        if trace_file:
+            TraceEvents.stop()
+        if scratch:
+            scratch.cleanup()
+    if run_report:
+        run_report.finish(sum(os.path.getsize(mkv_file) for mkv_file in mkv_files))
+
+    print_probe_stats()
+
+def select_mkv_folder():
+    # Tk is only imported when the folder picker is used, the batch runs headless
+    from tkinter import Tk
+    from tkinter.filedialog import askdirectory
     root = Tk()
     root.attributes("-topmost", True)
     root.withdraw()
     root.call('wm', 'attributes', '.', '-topmost', True)
     directory = askdirectory(title="Choisir un dossier contenant des fichiers MKV")
+    root.destroy()
+    return directory
+
+if __name__ == "__main__":
+    directory = select_mkv_folder()
 
     if directory:
         process_all_mkv_files_in_directory(directory)
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+Staged pipeline used by the muxing scripts.
+
+Each file goes through the stages in order (probe -> extract -> restyle -> mux). Every stage
+has its own pool of workers and a bounded queue in front of it, so file N+1 can be extracted
+while file N is restyled and file N-1 is muxed. CPU bound stages (pysubs2 restyling) run in a
+process pool so they do not queue up behind the GIL.
+"""
+
+import os
+import time
+import heapq
+import queue
+import threading
+import multiprocessing
+import concurrent.futures
+import MuxLogging
+import StageMetrics
+import TraceEvents
+
+_DONE = object()
+
+
+class AdaptiveLimiter:
+    """
+    AIMD control of the number of jobs in flight, driven by the observed throughput.
+
+    After each window of completed jobs the aggregate MB/s is compared with the previous window:
+    the limit grows by one while the throughput improves, is multiplied by `decrease_factor` when it
+    drops, and is kept when it stops improving. The best level seen so far is logged at the end
+    (nothing when no window completed).
+    """
+
+    def __init__(self, name="jobs", initial=2, minimum=1, maximum=8,
+                 increase_threshold=0.05, decrease_threshold=0.10, decrease_factor=0.75):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = max(minimum, min(initial, maximum))
+        self.increase_threshold = increase_threshold
+        self.decrease_threshold = decrease_threshold
+        self.decrease_factor = decrease_factor
+        self.best = (0.0, self.limit)
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self._last_throughput = None
+        self._reset_window()
+
+    def _reset_window(self):
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+        self._window_jobs = 0
+
+    def acquire(self):
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self, nbytes=0):
+        change = None
+        with self._condition:
+            self._in_flight -= 1
+            self._window_bytes += nbytes
+            self._window_jobs += 1
+            if self._window_jobs >= max(2, self.limit):
+                change = self._adjust()
+            self._condition.notify_all()
+        # Logged once the other workers can acquire again
+        if change:
+            MuxLogging.logger.info(change)
+
+    def _adjust(self):
+        """Ends the window and returns the line describing the level change, None when it is kept."""
+        elapsed = max(time.monotonic() - self._window_start, 1e-6)
+        throughput = self._window_bytes / elapsed / (1024 * 1024)
+        previous = self._last_throughput
+        if throughput > self.best[0]:
+            self.best = (throughput, self.limit)
+
+        new_limit = self.limit
+        if previous is None or throughput > previous * (1 + self.increase_threshold):
+            new_limit = min(self.maximum, self.limit + 1)
+        elif throughput < previous * (1 - self.decrease_threshold):
+            new_limit = max(self.minimum, int(self.limit * self.decrease_factor))
+
+        change = None
+        if new_limit != self.limit:
+            change = f"[{self.name}] {throughput:.1f} MB/s with {self.limit} jobs in flight -> {new_limit}"
+        self.limit = new_limit
+        self._last_throughput = throughput
+        self._reset_window()
+        return change
+
+    def summary(self):
+        """Chosen level and best throughput, None when no window completed (e.g. every file skipped)."""
+        if self._last_throughput is None:
+            return None
+        throughput, level = self.best
+        return f"[{self.name}] Chosen concurrency: {self.limit} (best {throughput:.1f} MB/s with {level} jobs in flight)"
+
+
+class Stage:
+    """
+    One step of the pipeline, `func` is applied to the output of the previous stage.
+
+    With a `limiter` (AdaptiveLimiter), `workers` is the upper bound of threads and the limiter decides
+    how many of them run at the same time, `measure(payload)` giving the bytes handled by a job.
+    `io(result)` gives the (bytes read, bytes written) of a run for the metrics.
+    """
+
+    def __init__(self, name, func, workers=None, processes=False, limiter=None, measure=None, io=None):
+        self.name = name
+        self.func = func
+        self.limiter = limiter
+        self.measure = measure
+        self.io = io
+        if limiter is not None:
+            workers = limiter.maximum
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.processes = processes
+
+    def run(self, payload, process_pool=None):
+        if self.limiter is None:
+            return self._call(payload, process_pool)
+        self.limiter.acquire()
+        nbytes = 0
+        try:
+            value = self._call(payload, process_pool)
+            nbytes = self.measure(payload) if self.measure else 0
+            return value
+        finally:
+            self.limiter.release(nbytes)
+
+    def _call(self, payload, process_pool):
+        if process_pool is not None:
+            value, cpu = process_pool.submit(_call_with_cpu, self.func, payload).result()
+            StageMetrics.add_cpu(cpu)
+            return value
+        return self.func(payload)
+
+
+def _call_with_cpu(func, payload):
+    # Runs in the pool process, its CPU time is sent back with the result
+    started = time.process_time()
+    value = func(payload)
+    return value, time.process_time() - started
+
+
+def order_by_cost(items, costs, longest_first=True):
+    """
+    Orders the items by estimated cost. Largest first (LPT) keeps a long job from starting last and
+    leaving a single busy worker at the end of the batch, shortest first gives the first results sooner.
+    """
+    return sorted(items, key=lambda item: costs[item], reverse=longest_first)
+
+
+def predict_makespan(costs, workers):
+    """
+    Simulates the list scheduling of the costs, in their order, on identical workers.
+
+    Returns:
+        tuple: (makespan, [(worker, start, end)] in the order of `costs`)
+    """
+    free_at = [(0, worker) for worker in range(max(1, workers))]
+    schedule = []
+    for cost in costs:
+        start, worker = heapq.heappop(free_at)
+        schedule.append((worker, start, start + cost))
+        heapq.heappush(free_at, (start + cost, worker))
+    return max((end for _, _, end in schedule), default=0), schedule
+
+
+def run_staged_pipeline(items, stages, queue_size=2, on_done=None, metrics=None, process_initializer=None, initargs=()):
+    """
+    Run every item through the stages, overlapping the stages of consecutive items.
+
+    Args:
+        items (list): The inputs of the first stage (e.g. MKV file paths).
+        stages (list): The Stage objects, in order.
+        queue_size (int): Number of items waiting in front of each stage.
+        on_done (callable): Called as on_done(item, result, error) when an item leaves the pipeline.
+        metrics (StageMetrics.RunReport): Receives the wall/CPU time and the bytes (Stage.io) of every stage run.
+        process_initializer (callable): Run with `initargs` in each worker process of the process stages.
+
+    Returns:
+        list: (result, error) tuples in the order of `items`. An item failing in a stage is not sent to the next ones.
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    results = [(None, None)] * len(items)
+    # "spawn" everywhere (as on Windows): a forked worker would inherit the pipes of the
+    # mkvextract/mkvmerge processes started at the same time by the other stages and block them
+    mp_context = multiprocessing.get_context("spawn")
+    process_pools = {
+        index: concurrent.futures.ProcessPoolExecutor(max_workers=stage.workers, mp_context=mp_context,
+                                                      initializer=process_initializer, initargs=initargs)
+        for index, stage in enumerate(stages) if stage.processes
+    }
+
+    def finish(position, result, error):
+        results[position] = (result, error)
+        if on_done:
+            on_done(items[position], result, error)
+
+    def worker(index):
+        stage = stages[index]
+        while True:
+            entry = queues[index].get()
+            if entry is _DONE:
+                return
+            position, payload = entry
+            if metrics is not None:
+                started = StageMetrics.start_measure()
+            try:
+                with TraceEvents.span(stage.name, file=os.path.basename(str(items[position]))):
+                    value = stage.run(payload, process_pools.get(index))
+            except Exception as e:
+                if metrics is not None:
+                    metrics.record(items[position], stage.name, started[0], *StageMetrics.stop_measure(started),
+                                   worker=threading.current_thread().name, error=e)
+                finish(position, None, e)
+                continue
+            if metrics is not None:
+                wall, cpu = StageMetrics.stop_measure(started)
+                bytes_read, bytes_written = stage.io(value) if stage.io else (0, 0)
+                metrics.record(items[position], stage.name, started[0], wall, cpu, bytes_read, bytes_written,
+                               worker=threading.current_thread().name)
+            if index + 1 < len(stages):
+                queues[index + 1].put((position, value))
+            else:
+                finish(position, value, None)
+
+    threads = []
+    for index, stage in enumerate(stages):
+        stage_threads = [
+            threading.Thread(target=worker, args=(index,), name=f"{stage.name}-{n}", daemon=True)
+            for n in range(stage.workers)
+        ]
+        for thread in stage_threads:
+            thread.start()
+        threads.append(stage_threads)
+
+    try:
+        for position, item in enumerate(items):
+            queues[0].put((position, item))
+
+        # Close the stages one after the other: a stage is drained before the next one is told to stop
+        for index, stage_threads in enumerate(threads):
+            for _ in stage_threads:
+                queues[index].put(_DONE)
+            for thread in stage_threads:
+                thread.join()
+    finally:
+        for pool in process_pools.values():
+            pool.shutdown()
+
+    for stage in stages:
+        summary = stage.limiter.summary() if stage.limiter is not None else None
+        if summary:
+            MuxLogging.logger.info(summary)
+
+    return results
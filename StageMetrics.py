@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Per-stage metrics of the muxing pipeline.
+
+Every stage run of a file is recorded with its wall time, CPU time and bytes read/written:
+the CPU of the stage thread (time.thread_time), of the pool process for the process stages,
+and of the mkvextract/mkvmerge children started by the stage (os.wait4 in DeviceLimits).
+The records go to a JSON-lines report as they arrive; the end of the batch prints p50/p95 per
+stage and the throughput, and can write a Prometheus textfile (node_exporter collector).
+"""
+
+import os
+import json
+import math
+import time
+import tempfile
+import threading
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_current = threading.local()
+
+
+def start_measure():
+    """Starts measuring the stage run of the calling thread."""
+    _current.cpu = 0.0
+    return time.perf_counter(), time.thread_time()
+
+
+def add_cpu(seconds):
+    """Adds CPU time spent outside the thread (child process, pool worker) to the current measure."""
+    if getattr(_current, "cpu", None) is not None:
+        _current.cpu += seconds
+
+
+def stop_measure(started):
+    """Returns (wall seconds, CPU seconds) since start_measure."""
+    wall = time.perf_counter() - started[0]
+    cpu = time.thread_time() - started[1] + _current.cpu
+    _current.cpu = None
+    return wall, cpu
+
+
+def children_cpu():
+    """User + system time of every waited child process (None on Windows)."""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def percentile(values, q):
+    """Nearest-rank percentile, q in [0, 100]."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class RunReport:
+    """Collects the stage records of a batch, safe to use from the pipeline threads."""
+
+    def __init__(self, report_file=None, prometheus_file=None):
+        self.report_file = report_file
+        self.prometheus_file = prometheus_file
+        self.records = []
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._children_cpu = children_cpu()
+        # Opened by the first record: a run that processes nothing keeps the previous report
+        self._report = None
+
+    def record(self, item, stage, started_at, wall, cpu, bytes_read=0, bytes_written=0, worker=None, error=None):
+        entry = {
+            "file": os.path.basename(item),
+            "stage": stage,
+            "start": round(started_at - self._start, 6),
+            "wall": round(wall, 6),
+            "cpu": round(cpu, 6),
+            "bytes_read": bytes_read,
+            "bytes_written": bytes_written,
+            "worker": worker,
+            "error": None if error is None else str(error),
+        }
+        with self._lock:
+            self.records.append(entry)
+            if self.report_file and self._report is None:
+                self._report = open(self.report_file, "w", encoding="utf-8")
+            if self._report:
+                self._report.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def stage_summaries(self):
+        """{stage: {"count", "p50", "p95", "wall", "cpu", "bytes_read", "bytes_written"}} in first-seen order."""
+        summaries = {}
+        for entry in self.records:
+            summary = summaries.setdefault(entry["stage"], {"walls": [], "cpu": 0.0, "bytes_read": 0, "bytes_written": 0})
+            summary["walls"].append(entry["wall"])
+            summary["cpu"] += entry["cpu"]
+            summary["bytes_read"] += entry["bytes_read"]
+            summary["bytes_written"] += entry["bytes_written"]
+        for summary in summaries.values():
+            walls = summary.pop("walls")
+            summary.update(count=len(walls), wall=sum(walls), p50=percentile(walls, 50), p95=percentile(walls, 95))
+        return summaries
+
+    def finish(self, total_bytes):
+        """Closes the report, prints the summary of the batch and writes the Prometheus textfile (nothing without records)."""
+        elapsed = time.perf_counter() - self._start
+        if self._report:
+            self._report.close()
+            self._report = None
+        if not self.records:
+            return
+        summaries = self.stage_summaries()
+        for stage, summary in summaries.items():
+            print(f"{stage}: {summary['count']} runs, p50 {summary['p50']:.2f}s, p95 {summary['p95']:.2f}s, "
+                  f"CPU {summary['cpu']:.1f}s, read {summary['bytes_read'] / 1e6:.0f} MB, "
+                  f"written {summary['bytes_written'] / 1e6:.0f} MB")
+        throughput = total_bytes / elapsed if elapsed else 0.0
+        print(f"Batch: {total_bytes / 1e6:.0f} MB in {elapsed:.1f}s, {throughput / 1e6:.1f} MB/s")
+        children = children_cpu()
+        if children is not None:
+            print(f"Child processes CPU: {children - self._children_cpu:.1f}s")
+        if self.report_file:
+            print(f"Run report: {self.report_file}")
+        if self.prometheus_file:
+            self.write_prometheus(summaries, elapsed, total_bytes)
+
+    def write_prometheus(self, summaries, elapsed, total_bytes):
+        lines = [
+            "# HELP mux_stage_seconds Wall time of a stage run per file.",
+            "# TYPE mux_stage_seconds summary",
+        ]
+        for stage, summary in summaries.items():
+            lines.append(f'mux_stage_seconds{{stage="{stage}",quantile="0.5"}} {summary["p50"]}')
+            lines.append(f'mux_stage_seconds{{stage="{stage}",quantile="0.95"}} {summary["p95"]}')
+            lines.append(f'mux_stage_seconds_sum{{stage="{stage}"}} {summary["wall"]}')
+            lines.append(f'mux_stage_seconds_count{{stage="{stage}"}} {summary["count"]}')
+        for name, key, help_text in (("mux_stage_cpu_seconds_total", "cpu", "CPU time of the stage and its child processes."),
+                                     ("mux_stage_read_bytes_total", "bytes_read", "Bytes read by the stage."),
+                                     ("mux_stage_written_bytes_total", "bytes_written", "Bytes written by the stage.")):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for stage, summary in summaries.items():
+                lines.append(f'{name}{{stage="{stage}"}} {summary[key]}')
+        lines += [
+            "# HELP mux_batch_seconds Duration of the last batch.",
+            "# TYPE mux_batch_seconds gauge",
+            f"mux_batch_seconds {elapsed}",
+            "# HELP mux_batch_bytes Size of the MKV files of the last batch.",
+            "# TYPE mux_batch_bytes gauge",
+            f"mux_batch_bytes {total_bytes}",
+        ]
+        # Atomic replace, the collector never reads a partial file
+        directory = os.path.dirname(os.path.abspath(self.prometheus_file))
+        fd, temp_path = tempfile.mkstemp(suffix=".prom.tmp", dir=directory)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, self.prometheus_file)
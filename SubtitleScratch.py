@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+RAM scratch space for the intermediate subtitles of the muxing.
+
+The extracted ASS files are restyled then read back by mkvmerge: in a private tmpfs directory
+(/dev/shm, Linux) these round-trips never touch the disk of the videos. The space is capped,
+a job which does not fit (or a system without tmpfs) uses the disk directory as before.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+
+RAM_ROOT = "/dev/shm"
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# Size assumed for a track without statistics tags
+UNKNOWN_TRACK_BYTES = 4 * 1024 * 1024
+
+
+def estimate_subtitle_bytes(tracks, copies=1):
+    """
+    Room needed by the extracted tracks: each copy, plus the temporary file of the restyle.
+
+    Args:
+        tracks (list): Subtitle tracks of the mkvmerge -J data.
+        copies (int): Number of restyled copies of each track.
+    """
+    total = 0
+    for track in tracks:
+        size = track["properties"].get("tag_number_of_bytes")
+        total += int(size) if size is not None else UNKNOWN_TRACK_BYTES
+    return total * (copies + 1)
+
+
+class ScratchSpace:
+    """Private tmpfs directory shared by the jobs of a batch, with a size cap."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, root=RAM_ROOT):
+        self.max_bytes = max_bytes
+        self.directory = None
+        self.fallbacks = 0
+        self._reserved = {}
+        self._lock = threading.Lock()
+        if os.path.isdir(root) and hasattr(os, "statvfs"):
+            try:
+                # Never take more than half of the free RAM of the tmpfs
+                stat = os.statvfs(root)
+                self.max_bytes = min(max_bytes, stat.f_bavail * stat.f_frsize // 2)
+                self.directory = tempfile.mkdtemp(prefix="mux-subs-", dir=root)
+            except OSError:
+                self.directory = None
+        if self.directory is None:
+            print("No tmpfs available, the intermediate subtitles stay on disk.")
+
+    def reserve(self, key, nbytes):
+        """
+        Returns a new private directory in RAM for `key`, or None when `nbytes` do not fit
+        under the cap (the caller then uses the disk).
+        """
+        with self._lock:
+            used = sum(size for size, _ in self._reserved.values())
+            if self.directory is None or used + nbytes > self.max_bytes:
+                self.fallbacks += 1
+                return None
+            path = tempfile.mkdtemp(dir=self.directory)
+            self._reserved[key] = (nbytes, path)
+        return path
+
+    def release(self, key):
+        """Deletes the directory of `key` and frees its room, no-op for a job on disk."""
+        with self._lock:
+            entry = self._reserved.pop(key, None)
+        if entry:
+            shutil.rmtree(entry[1], ignore_errors=True)
+
+    def cleanup(self):
+        if self.directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+        if self.fallbacks:
+            print(f"{self.fallbacks} file(s) used the disk for their subtitles (RAM cap {self.max_bytes // (1024 * 1024)} MB).")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.cleanup()
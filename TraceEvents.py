@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Timeline of a batch in the Chrome/Perfetto trace_event JSON format (chrome://tracing, ui.perfetto.dev).
+
+Every stage run of a file is a span on the row of its worker thread, with the subprocesses and
+the waits for a disk slot nested inside, so overlaps and idle workers are visible. When no
+trace is started, span() returns a shared no-op context manager.
+"""
+
+import os
+import json
+import time
+import threading
+import contextlib
+
+_NO_SPAN = contextlib.nullcontext()
+_writer = None
+
+
+class TraceWriter:
+    """Collects complete ("X") events and writes them when closed."""
+
+    def __init__(self, path):
+        self.path = path
+        self.events = []
+        self._threads = {}
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+
+    def add(self, name, category, start, end, args):
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": round((start - self._start) * 1e6, 1),
+            "dur": round((end - start) * 1e6, 1),
+            "pid": os.getpid(),
+            "tid": thread.ident,
+            "args": args,
+        }
+        with self._lock:
+            self.events.append(event)
+            if thread.ident not in self._threads:
+                # Row label of the worker in the viewer
+                self._threads[thread.ident] = thread.name
+                self.events.append({"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": thread.ident,
+                                    "args": {"name": thread.name}})
+
+    def close(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+
+
+@contextlib.contextmanager
+def _span(writer, name, category, args):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        writer.add(name, category, start, time.perf_counter(), args)
+
+
+def span(name, category="stage", **args):
+    """Context manager recording a span of the calling thread, no-op when no trace is started."""
+    if _writer is None:
+        return _NO_SPAN
+    return _span(_writer, name, category, args)
+
+
+def start(path):
+    global _writer
+    _writer = TraceWriter(path)
+
+
+def stop():
+    """Writes the trace file and disables the spans."""
+    global _writer
+    writer, _writer = _writer, None
+    if writer is not None:
+        writer.close()
+        print(f"Trace written: {writer.path}")